@@ -110,6 +110,8 @@ else:
     extensions.append(utils_ext)
     if utils_ext.check_cc(['<sys/prctl.h>'], 'prctl(PR_SET_NAME, "x");'):
         utils_ext.config('#define HAVE_PRCTL')
+    if utils_ext.check_cc(['<sys/eventfd.h>'], 'eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);'):
+        utils_ext.config('#define HAVE_EVENTFD')
 
     if osname == 'linux':
         inotify_ext = Extension("kaa.base.inotify._inotify",
@@ -289,7 +289,7 @@ _lazy_import('async', [
 _lazy_import('thread', [
     'MainThreadCallable', 'ThreadPoolCallable', 'ThreadCallable', 'threaded',
     'synchronized', 'MAINTHREAD', 'ThreadInProgress', 'ThreadPool',
-    'register_thread_pool', 'get_thread_pool'
+    'ProcessPool', 'register_thread_pool', 'get_thread_pool'
 ])
 
 # Timer classes and decorators
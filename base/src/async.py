@@ -25,7 +25,7 @@
 # 02110-1301 USA
 #
 # -----------------------------------------------------------------------------
-from __future__ import absolute_import
+from __future__ import absolute_import, with_statement
 
 __all__ = [ 'TimeoutException', 'InProgress', 'InProgressCallable',
             'AsyncException', 'InProgressAny', 'InProgressAll', 'InProgressAborted',
@@ -36,6 +36,7 @@ __all__ = [ 'TimeoutException', 'InProgress', 'InProgressCallable',
 import sys
 import logging
 import traceback
+import linecache
 import time
 import _weakref
 import threading
@@ -48,6 +49,9 @@ from .core import Object, Signal, Signals, CoreThreading
 # get logging object
 log = logging.getLogger('base.async')
 
+# Lock for creating the threading.Event of an InProgress
+_finished_event_lock = threading.Lock()
+
 
 def make_exception_class(name, bases, dict):
     """
@@ -55,7 +59,7 @@ def make_exception_class(name, bases, dict):
     which derives the class of a particular Exception instance.
     """
     def create(exc, stack, *args):
-        return type(name, bases + (exc.__class__,), {})(exc, stack, *args)
+        return type(name, bases + (exc.__class__,), dict)(exc, stack, *args)
     return create
 
 
@@ -271,6 +275,12 @@ class InProgress(Signal, Object):
             '''
     }
 
+    # Most InProgress objects are short-lived and nobody ever looks at
+    # their exception or abort signals, or waits for them in a thread.  So
+    # these are only created when needed, and the attributes are slots.
+    __slots__ = ('_finished', '_result', '_exception', '_unhandled_exception',
+                 '_exception_signal', '_signals', '_finished_event', 'progress',
+                 '_abortable', '_stack', '_name')
 
     def __init__(self, abortable=False, frame=0):
         """
@@ -278,28 +288,55 @@ class InProgress(Signal, Object):
                           (Default: False)
         :type abortable: bool
         """
-        super(InProgress, self).__init__()
-        self._exception_signal = Signal()
+        # Signal.__init__() isn't called, because kaa.Object.__init__() would
+        # create the signals right away.
+        self._callbacks = ()
+        self._changed_cb = None
+        self._deferred_args = ()
+        self._dispatch = None
+
+        self._exception_signal = None
+        self._signals = None
         self._finished = False
-        self._finished_event = threading.Event()
+        self._finished_event = None
         self._exception = None
         self._unhandled_exception = None
         # TODO: make progress a property so we can document it.
         self.progress = None
-        self.abortable = abortable
+        self._abortable = abortable
 
-        # Stack frame for the caller who is creating us, for debugging.
-        self._stack = traceback.extract_stack()[:frame-1]
+        # Stack frame for the caller who is creating us, for debugging.  The
+        # (code, line) tuples are turned into what traceback.extract_stack()
+        # returns by _get_stack() when needed, which is a lot faster.
+        stack = []
+        f = sys._getframe(1 - frame)
+        while f is not None:
+            stack.append((f.f_code, f.f_lineno))
+            f = f.f_back
+        stack.reverse()
+        self._stack = stack
         self._name = None
 
 
+    def _get_stack(self):
+        """
+        Returns the stack of the caller who created us, like
+        traceback.extract_stack().
+        """
+        stack = []
+        for code, lineno in self._stack:
+            line = linecache.getline(code.co_filename, lineno)
+            stack.append((code.co_filename, lineno, code.co_name, line.strip() or None))
+        return stack
+
+
     def __repr__(self):
         if not self._name:
             # Go no further than 2 frames up for the owner.  TODO: could
             # use a more intelligent heuristic to determine IP owner.
             if self._stack:
-                frame = self._stack[-min(len(self._stack), 2)]
-                self._name = 'owner=%s:%d:%s()' % frame[:3]
+                code, lineno = self._stack[-min(len(self._stack), 2)]
+                self._name = 'owner=%s:%d:%s()' % (code.co_filename, lineno, code.co_name)
             else:
                 self._name = 'owner=unknown'
         finished = 'finished' if self.finished else 'not finished'
@@ -322,9 +359,26 @@ class InProgress(Signal, Object):
         Callbacks connected to this signal receive three arguments: exception class,
         exception instance, traceback.
         """
+        if self._exception_signal is None:
+            self._exception_signal = Signal()
         return self._exception_signal
 
 
+    @property
+    def signals(self):
+        """
+        The :class:`~kaa.Signals` of this InProgress (see kaa.Object).
+        """
+        if self._signals is None:
+            self._signals = self._create_signals()
+        return self._signals
+
+
+    @signals.setter
+    def signals(self, signals):
+        self._signals = signals
+
+
     @property
     def finished(self):
         """
@@ -384,7 +438,7 @@ class InProgress(Signal, Object):
         This is useful when constructing an InProgress object that corresponds
         to an asynchronous task that can be safely aborted with no explicit action.
         """
-        return self._abortable or self.signals['abort'].count() > 0
+        return self._abortable or (self._signals is not None and self._signals['abort'].count() > 0)
 
 
     @abortable.setter
@@ -417,20 +471,30 @@ class InProgress(Signal, Object):
             return self
 
         # store result
-        self._finished = True
         self._result = result
         self._exception = None
+        self._finished = True
         # Wake any threads waiting on us
-        self._finished_event.set()
+        if self._finished_event:
+            self._finished_event.set()
         # emit signal
         self.emit_when_handled(result)
         # cleanup
-        self.disconnect_all()
-        self._exception_signal.disconnect_all()
-        self.signals['abort'].disconnect_all()
+        self._cleanup()
         return self
 
 
+    def _cleanup(self):
+        """
+        Disconnects all callbacks once finished.
+        """
+        self.disconnect_all()
+        if self._exception_signal is not None:
+            self._exception_signal.disconnect_all()
+        if self._signals is not None:
+            self._signals['abort'].disconnect_all()
+
+
     def throw(self, type, value, tb, aborted=False):
         """
         This method should be called when the owner (creator) of the InProgress is
@@ -462,8 +526,8 @@ class InProgress(Signal, Object):
         # custom traceback object in C code that preserves the parts of the
         # stack frames needed for printing tracebacks, but discarding objects
         # that would create circular references.  This might be a TODO.
-        self._finished = True
         self._exception = type, value, tb
+        self._finished = True
         self._unhandled_exception = True
         stack = traceback.extract_tb(tb)
 
@@ -476,9 +540,10 @@ class InProgress(Signal, Object):
         # the traceback object, so any threads that access the result property
         # between now and the end of this function will have an opportunity to
         # get the live traceback.
-        self._finished_event.set()
+        if self._finished_event:
+            self._finished_event.set()
 
-        if self._exception_signal.count() == 0:
+        if self.exception.count() == 0:
             # There are no exception handlers, so we know we will end up
             # queuing the traceback in the exception signal.  Set it to None
             # to prevent that.
@@ -493,7 +558,8 @@ class InProgress(Signal, Object):
             if not aborted:
                 # An InProgress we were waiting on has been aborted, so we
                 # abort too.
-                self.signals['abort'].emit(value)
+                if self._signals is not None:
+                    self._signals['abort'].emit(value)
             self._unhandled_exception = None
 
         if self._unhandled_exception:
@@ -506,7 +572,7 @@ class InProgress(Signal, Object):
             #
             # If the exception is passed back via result property, then it is
             # considered handled, and it will not be logged.
-            cb = Callable(InProgress._log_exception, trace, value, self._stack)
+            cb = Callable(InProgress._log_exception, trace, value, self._get_stack())
             self._unhandled_exception = _weakref.ref(self, cb)
 
         # Remove traceback from stored exception.  If any waiting threads
@@ -516,9 +582,7 @@ class InProgress(Signal, Object):
         self._exception = value.__class__, value, None
 
         # cleanup
-        self.disconnect_all()
-        self._exception_signal.disconnect_all()
-        self.signals['abort'].disconnect_all()
+        self._cleanup()
 
         # We return False here so that if we've received a thrown exception
         # from another InProgress we're waiting on, we essentially inherit
@@ -632,7 +696,7 @@ class InProgress(Signal, Object):
         async = InProgress()
         def trigger():
             self.disconnect(async.finish)
-            self._exception_signal.disconnect(async.throw)
+            self.exception.disconnect(async.throw)
             if not async._finished:
                 if callback:
                     callback()
@@ -707,11 +771,11 @@ class InProgress(Signal, Object):
                 main.loop(lambda: not self.finished, timeout)
             except RuntimeError:
                 # oops, there is something running, wait
-                self._finished_event.wait(timeout)
+                self._wait_event(timeout)
         else:
             # We're waiting in some other thread, so wait for some other
             # thread to wake us up.
-            self._finished_event.wait(timeout)
+            self._wait_event(timeout)
 
         if not self.finished:
             self.disconnect(dummy)
@@ -720,6 +784,20 @@ class InProgress(Signal, Object):
         return self.result
 
 
+    def _wait_event(self, timeout):
+        """
+        Blocks the current thread until finish() or throw() is called, for at
+        most timeout seconds.
+        """
+        with _finished_event_lock:
+            if self._finished_event is None:
+                self._finished_event = threading.Event()
+        # finish() and throw() set _finished before they look for the event,
+        # so either they set it or we see that we are finished.
+        if not self._finished:
+            self._finished_event.wait(timeout)
+
+
     def waitfor(self, inprogress):
         """
         Connects to another InProgress object (A) to self (B).  When A finishes
@@ -764,7 +842,7 @@ class InProgress(Signal, Object):
         if exception is None:
             exception = finished
         self.connect(finished)
-        self._exception_signal.connect_once(exception)
+        self.exception.connect_once(exception)
 
 
 
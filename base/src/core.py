@@ -35,12 +35,17 @@ import sys
 import os
 import fcntl
 import signal
+import errno
+import struct
+import time
+from collections import deque
 
 # kaa imports
 from .callable import Callable, WeakCallable, CallableError
 from .utils import property
 from .strutils import py3_b
 from . import nf_wrapper as notifier
+from . import _utils
 
 # get logging object
 log = logging.getLogger('base')
@@ -67,6 +72,8 @@ class CoreThreading:
     # and CoreThreading.wakeup().  XXX: this pipe must not be carried through
     # to forked children, or ugly behaviour will ensue.  kaa.utils.fork() and
     # .daemonize() will ensure a new pipe is created in the child process.
+    # Where available (Linux), it's an eventfd instead, with the same fd for
+    # both sides.
     _pipe = None
     # The signal wake pipe.  We pass the write side of the pipe to Python's
     # signal.set_wakeup_fd(), and any time there is a unix signal received
@@ -78,15 +85,22 @@ class CoreThreading:
     # executed from the main thread.  Without this, we could wait up to 30
     # seconds (the maximum sleep time in notifier) to handle a signal.
     _signal_wake_pipe = None
-    # Holds a queue of callbacks and their arguments that need to be executed
-    # from the main loop (by CoreThreading.run_queue, which is called by the
-    # notifier when there is activity on the pipe.)
-    _queue = []
+    # Holds a queue of callbacks and their arguments (and the time they were
+    # queued) that need to be executed from the main loop (by
+    # CoreThreading.run_queue, which is called by the notifier when there is
+    # activity on the pipe.)  run_queue takes the whole queue and replaces it
+    # with an empty one, so the lock isn't held while callbacks run.
+    _queue = deque()
     _queue_lock = threading.RLock()
     _mainthread = threading.currentThread()
     # Create a one byte dummy token for writing to the pipe.  Normally we'd
     # just use b'1' but Python 2.5 can't parse it.
     _PIPE_NOTIFY_TOKEN = py3_b('1')
+    # An eventfd is incremented by the 8 byte integer written to it.
+    _EVENTFD_NOTIFY_TOKEN = struct.pack('@Q', 1)
+    _notify_token = _PIPE_NOTIFY_TOKEN
+    # Counters for queue_stats().
+    _stats = dict(queued=0, run=0, batches=0, max_depth=0, latency=0.0, max_latency=0.0)
 
 
     @staticmethod
@@ -111,12 +125,19 @@ class CoreThreading:
         if CoreThreading._pipe:
             # There is an existing pipe already, so stop monitoring it.
             notifier.socket_remove(CoreThreading._pipe[0])
-        CoreThreading._pipe = CoreThreading._create_nonblocking_pipe()
+        try:
+            fd = _utils.eventfd()
+            CoreThreading._pipe = fd, fd
+            CoreThreading._notify_token = CoreThreading._EVENTFD_NOTIFY_TOKEN
+        except (AttributeError, OSError):
+            # Not supported by the system.
+            CoreThreading._pipe = CoreThreading._create_nonblocking_pipe()
+            CoreThreading._notify_token = CoreThreading._PIPE_NOTIFY_TOKEN
         notifier.socket_add(CoreThreading._pipe[0], CoreThreading.run_queue)
 
         if purge:
             with CoreThreading._queue_lock:
-                del CoreThreading._queue[:]
+                CoreThreading._queue.clear()
         elif CoreThreading._queue:
             # A thread is already running and wanted to run something in the
             # mainloop before the mainloop is started. In that case we need
@@ -158,8 +179,13 @@ class CoreThreading:
     @staticmethod
     def queue_callback(callback, args, kwargs, in_progress):
         with CoreThreading._queue_lock:
-            CoreThreading._queue.append((callback, args, kwargs, in_progress))
-            if len(CoreThreading._queue) == 1:
+            queue = CoreThreading._queue
+            queue.append((callback, args, kwargs, in_progress, time.time()))
+            stats = CoreThreading._stats
+            stats['queued'] += 1
+            if len(queue) > stats['max_depth']:
+                stats['max_depth'] = len(queue)
+            if len(queue) == 1:
                 # We just added the first callback to the queue, so notify the
                 # mainthread.
                 CoreThreading._wakeup()
@@ -169,30 +195,74 @@ class CoreThreading:
     def run_queue(fd):
         try:
             os.read(CoreThreading._pipe[0], 1000)
-        except socket.error, (err, msg):
-            if err == errno.EAGAIN:
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
                 # Resource temporarily unavailable -- we are trying to read
                 # data on a socket when none is avilable.  This should not
                 # happen under normal circumstances, so log an error.
                 log.error("Thread notifier pipe woke but no data available.")
-        except OSError:
-            pass
         with CoreThreading._queue_lock:
-            while CoreThreading._queue:
-                callback, args, kwargs, in_progress = CoreThreading._queue.pop(0)
-                try:
-                    in_progress.finish(callback(*args, **kwargs))
-                except BaseException, e:
-                    # All exceptions, including SystemExit and KeyboardInterrupt,
-                    # are caught and thrown to the InProgress, because it may be
-                    # waiting in another thread.  However SE and KI are reraised
-                    # in here the main thread so they can be propagated back up
-                    # the mainloop.
-                    in_progress.throw(*sys.exc_info())
-                    if isinstance(e, (KeyboardInterrupt, SystemExit)):
-                        raise
+            queue = CoreThreading._queue
+            CoreThreading._queue = deque()
+        if not queue:
+            return True
+
+        stats = CoreThreading._stats
+        stats['batches'] += 1
+        now = time.time()
+        while queue:
+            callback, args, kwargs, in_progress, queued = queue.popleft()
+            latency = now - queued
+            stats['run'] += 1
+            stats['latency'] += latency
+            if latency > stats['max_latency']:
+                stats['max_latency'] = latency
+            try:
+                in_progress.finish(callback(*args, **kwargs))
+            except BaseException, e:
+                # All exceptions, including SystemExit and KeyboardInterrupt,
+                # are caught and thrown to the InProgress, because it may be
+                # waiting in another thread.  However SE and KI are reraised
+                # in here the main thread so they can be propagated back up
+                # the mainloop.
+                in_progress.throw(*sys.exc_info())
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    if queue:
+                        # Put back the callbacks we didn't get to.
+                        with CoreThreading._queue_lock:
+                            queue.extend(CoreThreading._queue)
+                            CoreThreading._queue = queue
+                            CoreThreading._wakeup()
+                    raise
+            now = time.time()
         return True
 
+
+    @staticmethod
+    def queue_stats(reset=False):
+        """
+        Return statistics about the callbacks queued by other threads for
+        the main thread (e.g. by :class:`~kaa.MainThreadCallable`).
+
+        :param reset: if True, the counters are reset afterwards
+        :returns: dict with the keys ``depth`` (number of callbacks currently
+                  queued), ``max_depth``, ``queued`` and ``run`` (number of
+                  callbacks queued and run), ``batches`` (number of times
+                  the queue was run), and ``avg_latency`` and ``max_latency``
+                  (seconds between queueing a callback and running it).
+
+        A growing depth or latency means the main thread can't keep up.
+        """
+        with CoreThreading._queue_lock:
+            stats = dict(CoreThreading._stats)
+            stats['depth'] = len(CoreThreading._queue)
+            if reset:
+                CoreThreading._stats = dict(queued=0, run=0, batches=0, max_depth=0,
+                                            latency=0.0, max_latency=0.0)
+        latency = stats.pop('latency')
+        stats['avg_latency'] = latency / stats['run'] if stats['run'] else 0.0
+        return stats
+
     @staticmethod
     def _wakeup():
         """
@@ -200,7 +270,7 @@ class CoreThreading:
         writes a byte to the notifier pipe.
         """
         if CoreThreading._pipe:
-            os.write(CoreThreading._pipe[1], CoreThreading._PIPE_NOTIFY_TOKEN)
+            os.write(CoreThreading._pipe[1], CoreThreading._notify_token)
 
 
     @staticmethod
@@ -214,7 +284,7 @@ class CoreThreading:
         :class:`~kaa.MainThreadCallable` is invoked, it calls ``wakeup()``.
         """
         if len(CoreThreading._queue) == 0:
-            os.write(CoreThreading._pipe[1], CoreThreading._PIPE_NOTIFY_TOKEN)
+            os.write(CoreThreading._pipe[1], CoreThreading._notify_token)
 
 
     @staticmethod
@@ -247,6 +317,11 @@ class CoreThreading:
 
 
 
+# Class -> list of (name, docstring) for the merged __kaasignals__ of the
+# class, see Object._create_signals().
+_kaasignals = {}
+
+
 class Object(object):
     """
     Base class for kaa objects.
@@ -298,23 +373,39 @@ class Object(object):
         # Accept all args, and pass to superclass.  Necessary for kaa.Object
         # descendants to be involved in inheritance diamonds.
         super(Object, self).__init__(*args, **kwargs)
+        signals = self._create_signals()
+        if signals is not None:
+            self.signals = signals
 
-        # Merge __kaasignals__ dict for the entire inheritance tree for the
-        # given class.  Newer (most descended) __kaasignals__ will replace
-        # older ones if there are conflicts.
-        signals = {}
-        for c in reversed(inspect.getmro(self.__class__)):
-            if hasattr(c, '__kaasignals__'):
-                signals.update(c.__kaasignals__)
 
-        # Remove all signals whose value is None.
-        [ signals.pop(k) for k, v in signals.items() if v is None ]
+    @classmethod
+    def _create_signals(cls):
+        """
+        Returns a new kaa.Signals object for the class's __kaasignals__, or
+        None if it has no signals.
+        """
+        try:
+            signals = _kaasignals[cls]
+        except KeyError:
+            # Merge __kaasignals__ dict for the entire inheritance tree for the
+            # given class.  Newer (most descended) __kaasignals__ will replace
+            # older ones if there are conflicts.
+            signals = {}
+            for c in reversed(inspect.getmro(cls)):
+                if hasattr(c, '__kaasignals__'):
+                    signals.update(c.__kaasignals__)
+
+            # Remove all signals whose value is None.
+            [ signals.pop(k) for k, v in signals.items() if v is None ]
+            _kaasignals[cls] = signals = signals.items()
+
         if signals:
             # Construct the kaa.Signals object and attach the docstrings to
             # each signal in the Signal object's __doc__ attribute.
-            self.signals = Signals(*signals.keys())
-            for name in signals:
-                self.signals[name].__doc__ = signals[name]
+            result = Signals(*[ name for name, doc in signals ])
+            for name, doc in signals:
+                result[name].__doc__ = doc
+            return result
 
 
 class Signal(object):
@@ -322,6 +413,12 @@ class Signal(object):
     Create a Signal object to which callbacks can be connected and later
     invoked in sequence when the Signal is emitted.
     """
+    # Signals are created in large numbers, e.g. as InProgress objects, so
+    # they have slots.  Instances still get a __dict__ when needed, so
+    # subclasses and other attributes (like a __doc__) work as before.
+    __slots__ = ('_callbacks', '_changed_cb', '_deferred_args', '_dispatch',
+                 '__dict__', '__weakref__')
+
     # Constants used for the action parameter for changed_cb.
     CONNECTED = 1
     DISCONNECTED = 2
@@ -332,9 +429,14 @@ class Signal(object):
         :type changed_cb: callable
         """
         super(Signal, self).__init__()
-        self._callbacks = []
+        # A list once a callback is connected.
+        self._callbacks = ()
+        # Tuple of (callback, func, once) built from _callbacks by emit(), and
+        # reset when callbacks are connected or disconnected.  func is set if
+        # the callback can be called directly (see _dispatch_entry).
+        self._dispatch = None
         self.changed_cb = changed_cb
-        self._deferred_args = []
+        self._deferred_args = ()
 
 
     @property
@@ -425,13 +527,17 @@ class Signal(object):
         if pos == -1:
             pos = len(self._callbacks)
 
-        self._callbacks.insert(pos, callback)
+        if self._callbacks:
+            self._callbacks.insert(pos, callback)
+        else:
+            self._callbacks = [ callback ]
+        self._dispatch = None
         self._changed(Signal.CONNECTED)
 
         if self._deferred_args:
-            for args, kwargs in self._deferred_args:
+            deferred, self._deferred_args = self._deferred_args, ()
+            for args, kwargs in deferred:
                 self.emit(*args, **kwargs)
-            del self._deferred_args[:]
 
         return callback
 
@@ -517,6 +623,7 @@ class Signal(object):
 
         if len(new_callbacks) != len(self._callbacks):
             self._callbacks = new_callbacks
+            self._dispatch = None
             self._changed(Signal.DISCONNECTED)
             return True
 
@@ -557,7 +664,8 @@ class Signal(object):
         Disconnects all callbacks from the signal.
         """
         count = self.count()
-        self._callbacks = []
+        self._callbacks = ()
+        self._dispatch = None
         if self._changed_cb and count > 0:
             self._changed_cb(self, Signal.DISCONNECTED)
 
@@ -568,16 +676,25 @@ class Signal(object):
 
         :return: False if any of the callbacks returned False, and True otherwise.
         """
-        if len(self._callbacks) == 0:
+        if not self._callbacks:
             return True
+        dispatch = self._dispatch
+        if dispatch is None:
+            dispatch = self._dispatch = tuple(map(self._dispatch_entry, self._callbacks))
 
         retval = True
-        for cb in self._callbacks[:]:
-            if cb._signal_once:
+        for cb, func, once in dispatch:
+            if once:
                 self.disconnect(cb)
 
             try:
-                if cb(*args, **kwargs) == False:
+                if func is None or cb._ignore_caller_args:
+                    result = cb(*args, **kwargs)
+                elif kwargs:
+                    result = func(*args, **kwargs)
+                else:
+                    result = func(*args)
+                if result == False:
                     retval = False
             except CallableError:
                 if self._disconnect(cb, (), {}) != False:
@@ -594,6 +711,20 @@ class Signal(object):
         return retval
 
 
+    @staticmethod
+    def _dispatch_entry(cb):
+        """
+        Returns the (callback, func, once) entry emit() uses for the given
+        callback.  func is the wrapped function if the callback is a strong
+        Callable without arguments of its own, which emit() then calls
+        directly (unless ignore_caller_args, which can change any time, is
+        set).
+        """
+        if type(cb) is Callable and not cb._args and not cb._kwargs:
+            return cb, cb._func, cb._signal_once
+        return cb, None, cb._signal_once
+
+
     def emit_deferred(self, *args, **kwargs):
         """
         Queues the emission until after the next callback is connected.
@@ -602,7 +733,7 @@ class Signal(object):
         that subsequently connects to it will be called with the given
         arguments.
         """
-        self._deferred_args.append((args, kwargs))
+        self._deferred_args += ((args, kwargs),)
 
 
     def emit_when_handled(self, *args, **kwargs):
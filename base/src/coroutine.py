@@ -54,12 +54,15 @@ __all__ = [ 'NotFinished', 'coroutine' ]
 
 # python imports
 import sys
+import time
 import logging
 import types
 
 # kaa.base imports
 from .utils import property, wraps, DecoratorDataStore
 from .timer import Timer
+from .core import CoreThreading
+from .thread import MainThreadCallable
 from .async import InProgress, InProgressAborted, InProgressStatus
 from .generator import generator
 
@@ -78,6 +81,45 @@ POLICY_PASS_LAST = 'passlast'
 # CoroutineInProgress.__init__ for rational.
 _active_coroutines = set()
 
+# Coroutines with an interval of 0 are not resumed by a timer of their own,
+# but put in this list.  _resume_ready() resumes them together from one timer
+# on the next main loop iteration.
+_ready = []
+
+# Seconds the coroutines resumed by _resume_ready() may run in a main loop
+# iteration.  A coroutine yielding finished InProgress objects is resumed
+# immediately until then, and the coroutines not resumed by then wait for
+# the next iteration.
+RESUME_BUDGET = 0.05
+
+def _resume_ready():
+    """
+    Resumes the coroutines in _ready, for at most RESUME_BUDGET seconds.
+    Coroutines becoming ready meanwhile are resumed in the next main loop
+    iteration.
+    """
+    global _ready
+    batch, _ready = _ready, []
+    deadline = time.time() + RESUME_BUDGET
+    for n, ip in enumerate(batch):
+        if time.time() >= deadline:
+            _ready = batch[n:] + _ready
+            break
+        ip._scheduled = False
+        if ip._coroutine is None:
+            # stopped meanwhile
+            continue
+        try:
+            if ip._step(deadline) == True:
+                ip._schedule()
+        except BaseException:
+            # SystemExit or KeyboardInterrupt
+            _ready = batch[n+1:] + _ready
+            raise
+    return len(_ready) > 0
+
+_resume_timer = Timer(_resume_ready)
+
 def _process(generator, inprogress=None):
     """
     function to call next, step, or throw
@@ -218,8 +260,8 @@ def coroutine(interval=0, policy=None, progress=False, group=None):
                 store.lock = ip
             # Perform as much as we can of the coroutine now.
             if ip._step() == True:
-                # Generator yielded NotFinished, so start the CoroutineInProgress timer.
-                ip._timer.start(interval)
+                # Generator yielded NotFinished, so schedule the next step.
+                ip._schedule()
             return wrap(ip)
 
 
@@ -260,11 +302,17 @@ class CoroutineInProgress(InProgress):
     for coroutine if it takes some more time. progress can be either NotFinished
     (iterate now) or InProgress (wait until InProgress is done).
     """
+    __slots__ = ('_coroutine', '_coroutine_info', '_timer', '_scheduled', '_interval',
+                 '_prerequisite_ip', '_valid')
+
     def __init__(self, function, function_info, interval, progress=None):
         InProgress.__init__(self)
         self._coroutine = function
         self._coroutine_info = function_info
-        self._timer = Timer(self._step)
+        # Timer to resume the coroutine if the interval is not 0, created when
+        # needed.  Otherwise _scheduled is True while in _ready.
+        self._timer = None
+        self._scheduled = False
         self._interval = interval
         self._prerequisite_ip = None
         self._valid = True
@@ -289,8 +337,8 @@ class CoroutineInProgress(InProgress):
         _active_coroutines.add(self)
 
         if progress is NotFinished:
-            # coroutine was stopped NotFinished, start the step timer
-            self._timer.start(interval)
+            # coroutine was stopped NotFinished, schedule the next step
+            self._schedule()
         elif isinstance(progress, InProgress):
             # continue when InProgress is done
             self._prerequisite_ip = progress
@@ -309,30 +357,53 @@ class CoroutineInProgress(InProgress):
 
     @interval.setter  
     def interval(self, interval):
+        self._interval = interval
         if self._timer and self._timer.active:
             # restart timer
-            self._timer.start(interval)
-        self._interval = interval
+            self._timer.stop()
+            self._schedule()
 
 
-    def _continue(self, *args, **kwargs):
+    def _schedule(self):
         """
-        Restart timer to call _step() after interval seconds.
+        Call _step() after interval seconds, or with the other coroutines in
+        the next main loop iteration if the interval is 0.
         """
-        if self._timer:
+        if not CoreThreading.is_mainthread():
+            # _ready and the timers are only used by the main thread.
+            return MainThreadCallable(self._schedule)()
+        if self._interval:
+            if not self._timer:
+                self._timer = Timer(self._step)
             self._timer.start(self._interval)
+        elif not self._scheduled:
+            self._scheduled = True
+            _ready.append(self)
+            if not _resume_timer.active:
+                _resume_timer.start(0)
 
 
-    def _step(self):
+    def _continue(self, *args, **kwargs):
+        """
+        Schedule the next step when the InProgress we wait for is finished.
+        """
+        if self._coroutine is not None:
+            self._schedule()
+
+
+    def _step(self, deadline=None):
         """
         Call next step of the coroutine.
+
+        If a deadline is given and reached while the coroutine yields
+        finished InProgress objects, it is continued in the next step.
         """
         try:
             while True:
                 result = _process(self._coroutine, self._prerequisite_ip)
                 self._prerequisite_ip = None
                 if result is NotFinished:
-                    # Schedule next iteration with the timer
+                    # Schedule next iteration
                     return True
                 elif not isinstance(result, InProgress):
                     # Coroutine is done.
@@ -352,6 +423,8 @@ class CoroutineInProgress(InProgress):
                 # If we're here, then the coroutine had yielded a finished
                 # InProgress, so we can iterate immediately and step back
                 # into the coroutine.
+                if deadline is not None and time.time() >= deadline:
+                    return True
 
         except StopIteration:
             # Generator is exhausted but did not yield a result, so use None as
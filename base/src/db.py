@@ -35,9 +35,14 @@ import time
 import re
 import logging
 import math
+import array
+import bisect
+import heapq
+import struct
 import cPickle
 import copy_reg
 import _weakref
+import weakref
 import threading
 try:
     # Try a system install of pysqlite
@@ -59,7 +64,17 @@ if sqlite.sqlite_version < '3.3.1':
 # get logging object
 log = logging.getLogger('db')
 
-SCHEMA_VERSION = 0.2
+# Maximum number of compiled query plans kept by Database.query()
+QUERY_PLAN_CACHE_SIZE = 100
+
+# Array typecode for posting list keys, which pack (object_type, object_id)
+# into (object_type << 32 | object_id).  On platforms where long is only 32
+# bits, fall back to doubles, which still represent these keys exactly.
+POSTING_KEY_TYPECODE = ('d', 'l')[array.array('l').itemsize >= 8]
+
+# Schema 0.3 stores ATTR_SIMPLE attributes in the indexed pickle format (see
+# _pickle_attrs()).  0.2 databases are upgraded when opened.
+SCHEMA_VERSION = 0.3
 SCHEMA_VERSION_COMPATIBLE = 0.2
 CREATE_SCHEMA = """
     CREATE TABLE meta (
@@ -171,6 +186,74 @@ def _list_to_printable(value):
 
 
 
+def _query_expr_sql(var, operator):
+    """
+    Returns the SQL expression for the given QExpr operator on var.  The
+    operand list of IN operators is left as a %s to be substituted by
+    the fragment from _bind_query_expr().
+    """
+    if operator == 'range':
+        return "%s >= ? AND %s <= ?" % (var, var)
+    elif operator in ('in', 'not in'):
+        return "%s %s %%s" % (var, operator.upper())
+    else:
+        return "%s %s ?" % (var, operator.upper())
+
+
+def _bind_query_expr(value, attr_type, attr_flags, parts, values):
+    """
+    Appends the query value(s) for the given value (either a QExpr or a
+    value implying an equality test) to the values list, or, for IN
+    operators, the SQL fragment to the parts list.  If attr_type is None,
+    no coercion or type checking is done.
+    """
+    if type(value) == QExpr:
+        operator, operand = value._operator, value._operand
+    else:
+        operator, operand = '=', value
+
+    if attr_type is not None:
+        # Coerce between numeric types; also coerce a string of digits into a numeric
+        # type.
+        if attr_type in (int, long, float) and (type(operand) in (int, long, float) or \
+            isinstance(operand, basestring) and operand.isdigit()):
+            operand = attr_type(operand)
+
+        # Verify expression operand type is correct for this attribute.
+        if operator not in ("range", "in", "not in") and type(operand) != attr_type:
+            raise TypeError, "Type mismatch in query: '%s' (%s) is not a %s" % \
+                                  (str(operand), str(type(operand)), str(attr_type))
+
+        # Queries on ATTR_IGNORE_CASE string columns are case-insensitive.
+        if isinstance(operand, basestring) and attr_flags & ATTR_IGNORE_CASE:
+            operand = operand.lower()
+
+        if type(operand) == str:
+            # Treat strings (non-unicode) as buffers.
+            operand = buffer(operand)
+
+    if operator == 'range':
+        values.extend(operand)
+    elif operator in ('in', 'not in'):
+        parts.append(_list_to_printable(operand))
+    else:
+        values.append(operand)
+
+
+def _gallop(a, x, lo, hi):
+    """
+    Returns the index of the first item in the sorted sequence a[lo:hi] that
+    is not less than x (or hi if there is none), like bisect_left(), but
+    probes in exponentially growing steps from lo first.  This is much
+    cheaper than a full binary search when x is expected near lo, as is the
+    case when intersecting sorted lists.
+    """
+    bound = 1
+    while lo + bound < hi and a[lo + bound] < x:
+        bound *= 2
+    return bisect.bisect_left(a, x, lo + bound / 2, min(lo + bound + 1, hi))
+
+
 class QExpr(object):
     """
     Flexible query expressions for use with Database.query()
@@ -198,6 +281,57 @@ class QExpr(object):
                    (self._operand,)
 
 
+# Magic prefix for the indexed pickle format.  Protocol 2 pickles always begin
+# with '\x80', so the two formats can't be confused.
+PICKLE_MAGIC = 'KDB\x01'
+
+def _pickle_attrs(attrs):
+    """
+    Serializes the given dict of ATTR_SIMPLE attributes for the pickle column
+    of an object, returning a buffer.
+
+    Each value is pickled individually, and preceded by an index of the keys
+    and the offset and length of their pickled value, so that a single value
+    can be decoded without unpickling the whole dict (which is what the
+    ObjectRow extension does).  The layout (all integers little endian) is:
+
+        magic (4 bytes), number of keys (uint32), size of index (uint32),
+        index: [ key length (uint16), key, offset (uint32), length (uint32) ]
+        data: pickled values, offsets are relative to the start of data
+    """
+    index, data, offset = [], [], 0
+    for key, value in attrs.items():
+        key = str(key)
+        value = cPickle.dumps(value, 2)
+        index.append(struct.pack('<H', len(key)) + key + struct.pack('<II', offset, len(value)))
+        data.append(value)
+        offset += len(value)
+    index = ''.join(index)
+    return buffer(PICKLE_MAGIC + struct.pack('<II', len(attrs), len(index)) + index + ''.join(data))
+
+
+def _unpickle_attrs(value):
+    """
+    Returns the dict of attributes for the given pickle column value, which
+    is either in the indexed format (see _pickle_attrs()) or a pickled dict
+    as stored by older versions.
+    """
+    value = str(value)
+    if not value.startswith(PICKLE_MAGIC):
+        return cPickle.loads(value)
+
+    attrs = {}
+    count, index_size = struct.unpack_from('<II', value, 4)
+    pos, data = 12, 12 + index_size
+    for i in xrange(count):
+        key_len, = struct.unpack_from('<H', value, pos)
+        key = value[pos + 2:pos + 2 + key_len]
+        offset, length = struct.unpack_from('<II', value, pos + 2 + key_len)
+        attrs[key] = cPickle.loads(value[data + offset:data + offset + length])
+        pos += 10 + key_len
+    return attrs
+
+
 # Register handlers for pickling ObjectRow objects.
 
 def _pickle_ObjectRow(o):
@@ -238,8 +372,126 @@ class RegexpCache(object):
         return self.last_result
 
 
+class _QueryIterator(object):
+    """
+    Iterator over the results of a query, returned by Database.query_iter().
+
+    Each statement is executed on a cursor of its own, from which rows are
+    fetched in batches as the iterator is consumed.  Because committing
+    resets all open cursors of the connection, Database.commit() calls
+    _prefetch() first, which pulls the remaining rows of the current
+    statement into memory.
+    """
+    def __init__(self, db, statements, limit, batch, reader=None):
+        self._db = db
+        self._statements = list(statements)
+        self._limit = limit
+        self._batch = batch
+        # Reader connection (see Database._checkout_reader()) to fetch rows
+        # from, or None to use the main connection.
+        self._reader = reader
+        self._cursor = None
+        self._rows = []
+        self._pos = 0
+        self._count = 0
+
+
+    def __del__(self):
+        self._finish()
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        if self._limit is not None and self._count >= self._limit:
+            self._finish()
+            raise StopIteration
+        while self._pos >= len(self._rows):
+            if not self._fetch():
+                raise StopIteration
+        row = self._rows[self._pos]
+        self._pos += 1
+        self._count += 1
+        return row
+
+
+    def _fetch(self):
+        """
+        Fetches the next batch of rows, executing the next statement if the
+        current one has been exhausted.  Returns False if there are no more
+        rows.
+        """
+        db = self._db
+        if self._reader:
+            # Reader connections are used by one query at a time, so there's
+            # no need to lock.
+            return self._fetch_rows(self._reader[0])
+
+        db._lock.acquire()
+        try:
+            return self._fetch_rows(db._db)
+        finally:
+            db._lock.release()
+
+
+    def _fetch_rows(self, connection):
+        while True:
+            if not self._cursor:
+                if not self._statements:
+                    self._finish()
+                    return False
+                q, values = self._statements.pop(0)
+                self._cursor = connection.cursor(self._db._qcursor.__class__)
+                self._cursor.execute(q, values)
+                if not self._reader:
+                    self._db._query_iterators[self] = True
+
+            self._rows = self._cursor.fetchmany(self._batch)
+            self._pos = 0
+            if self._rows:
+                return True
+            self._close()
+
+
+    def _prefetch(self):
+        """
+        Reads all remaining rows of the current statement into memory.
+        """
+        if self._cursor:
+            self._rows = self._rows[self._pos:] + self._cursor.fetchall()
+            self._pos = 0
+            self._close()
+
+
+    def _close(self):
+        if self._cursor:
+            self._cursor.close()
+            self._cursor = None
+            self._db._query_iterators.pop(self, None)
+
+
+    def _finish(self):
+        """
+        Closes the cursor and returns the reader connection to the pool.
+        """
+        self._close()
+        if self._reader:
+            self._db._checkin_reader(self._reader)
+            self._reader = None
+
+
 class Database:
-    def __init__(self, dbfile):
+    def __init__(self, dbfile, posting_lists=False, readers=0):
+        # If posting_lists is True, inverted index queries are done against
+        # in-memory posting lists (see _query_posting_lists()) rather than
+        # by walking the terms map table in SQL.
+        # If readers is non-zero, queries from threads other than the main
+        # thread (e.g. functions decorated with @kaa.threaded) use a pool of
+        # up to that many read-only connections, so they neither wait on nor
+        # block writes from the main thread.  This requires WAL mode (see
+        # _open_db()).  Such queries only see committed changes.
         # _object_types dict is keyed on type name, where value is a 3-
         # tuple (id, attrs, idx), where:
         #   - id is a unique numeric database id for the type,
@@ -262,6 +514,41 @@ class Database:
         #            attributes.
         self._inverted_indexes = {}
 
+        # Inverted index terms for objects added with add_many() that have
+        # not yet been written to the database.  Keyed on ivtidx name, where
+        # value is a list of (type_id, object_id, terms) tuples.  Flushed by
+        # _flush_inverted_index_terms()
+        self._pending_ivtidx_terms = {}
+
+        # Compiled query plans keyed on query signature, where value is a
+        # 2-list [plan, tick] and tick is used for LRU eviction.  See
+        # _get_query_plan().
+        self._query_plans = {}
+        self._query_plans_tick = 0
+        self._query_plans_stats = {'hits': 0, 'misses': 0}
+        self._query_plans_lock = threading.Lock()
+
+        # If posting lists are enabled, dict keyed on ivtidx name, where value
+        # is a dict keyed on term id holding a 2-tuple (keys, frequencies) of
+        # arrays, sorted on keys.  Lists are loaded on demand by
+        # _get_posting_list() and kept in sync when terms are added or
+        # deleted.  None if posting lists are disabled.
+        self._posting_lists = {} if posting_lists else None
+
+        # _QueryIterator objects with an open cursor, which must be prefetched
+        # before committing.
+        self._query_iterators = weakref.WeakKeyDictionary()
+
+        # Idle reader connections as (connection, cursor, qcursor) tuples, and
+        # the number of reader connections opened.  See _checkout_reader().
+        self._readers = readers
+        self._reader_pool = []
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        # Holds the reader used by the query in progress in the current
+        # thread, if any.  See _read_cursor().
+        self._reader_local = threading.local()
+
         # True when there are uncommitted changes
         self._dirty = False
         self._dbfile = os.path.realpath(dbfile)
@@ -290,6 +577,19 @@ class Database:
             cursor.execute("PRAGMA cache_size=50000")
             cursor.execute("PRAGMA page_size=8192")
 
+        # In WAL mode, readers don't block the writer and the writer doesn't
+        # block readers, so other processes (and reader connections) can
+        # query the database while changes are written.  The journal mode is
+        # persistent, and changing it needs an exclusive lock, so if another
+        # process is busy with the database we use the current mode.
+        self.wal = False
+        if sqlite.sqlite_version_info >= (3, 7, 0):
+            try:
+                mode = self._db_query_row("PRAGMA journal_mode=WAL")[0]
+            except sqlite.OperationalError:
+                mode = self._db_query_row("PRAGMA journal_mode")[0]
+            self.wal = mode.lower() == 'wal'
+
         if not self.check_table_exists("meta"):
             self._db.executescript(CREATE_SCHEMA % SCHEMA_VERSION)
 
@@ -301,6 +601,91 @@ class Database:
         self._load_inverted_indexes()
         self._load_object_types()
 
+        if float(row[0]) < 0.3:
+            self._upgrade_pickles()
+
+
+    def _upgrade_pickles(self):
+        """
+        Upgrades a schema 0.2 database by converting the pickle column of all
+        objects to the indexed format.
+        """
+        log.info('Upgrading database %s to schema version %s', self._dbfile, SCHEMA_VERSION)
+        for type_name in self._object_types:
+            rows = self._db_query('SELECT id,pickle FROM objects_%s WHERE pickle IS NOT NULL' % type_name)
+            self._db_query('UPDATE objects_%s SET pickle=? WHERE id=?' % type_name,
+                           [(_pickle_attrs(_unpickle_attrs(pickle)), id) for id, pickle in rows], many = True)
+        self._db_query("UPDATE meta SET value=? WHERE attr='version'", (SCHEMA_VERSION,))
+        self._lock.acquire()
+        self._db.commit()
+        self._lock.release()
+
+
+    def _checkout_reader(self):
+        """
+        Returns a reader connection as a 3-tuple (connection, cursor, qcursor)
+        for a query from the current thread, or None if the query should use
+        the main connection.
+
+        Readers are only used outside the main thread, and only if the
+        database is in WAL mode.  Idle readers are reused, and new ones are
+        opened as long as fewer than the number of readers passed to the
+        constructor are open.  If all readers are busy, None is returned
+        rather than waiting for one.  A reader must be given back with
+        _checkin_reader().
+        """
+        if not self._readers or not self.wal or main.is_mainthread():
+            return None
+
+        self._reader_lock.acquire()
+        try:
+            if self._reader_pool:
+                return self._reader_pool.pop()
+            if self._reader_count >= self._readers:
+                return None
+            self._reader_count += 1
+        finally:
+            self._reader_lock.release()
+
+        try:
+            db = sqlite.connect(self._dbfile, check_same_thread=False)
+            db.create_function("regexp", 2, RegexpCache())
+            cursor = db.cursor()
+            db.row_factory = ObjectRow
+            qcursor = db.cursor(self._qcursor.__class__)
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA cache_size=10000")
+            # Refuse writes on this connection (ignored by sqlite < 3.8)
+            cursor.execute("PRAGMA query_only=ON")
+        except:
+            self._reader_lock.acquire()
+            self._reader_count -= 1
+            self._reader_lock.release()
+            raise
+        return db, cursor, qcursor
+
+
+    def _checkin_reader(self, reader):
+        """
+        Returns a reader gotten from _checkout_reader() to the pool.
+        """
+        self._reader_lock.acquire()
+        self._reader_pool.append(reader)
+        self._reader_lock.release()
+
+
+    def _read_cursor(self, cursor):
+        """
+        Returns the cursor to use for reads in place of the given cursor
+        (_cursor or _qcursor): the equivalent cursor of the reader used by
+        the query in progress in the current thread, or cursor itself if
+        there is none.
+        """
+        reader = getattr(self._reader_local, 'reader', None)
+        if not reader:
+            return cursor
+        return reader[2] if cursor is self._qcursor else reader[1]
+
 
     def _set_dirty(self):
         if self._dirty:
@@ -311,6 +696,10 @@ class Database:
 
     def _db_query(self, statement, args = (), cursor = None, many = False):
         #t0=time.time()
+        if cursor and cursor.connection is not self._db:
+            # Cursor of a reader, which is only used by one thread at a time.
+            cursor.execute(statement, args)
+            return cursor.fetchall()
         self._lock.acquire()
         if not cursor:
             cursor = self._cursor
@@ -701,6 +1090,10 @@ class Database:
     def _load_object_types(self):
         for id, name, attrs, idx in self._db_query("SELECT * from types"):
             self._object_types[name] = id, cPickle.loads(str(attrs)), cPickle.loads(str(idx))
+        # Compiled query plans depend on the object type definitions.
+        self._query_plans_lock.acquire()
+        self._query_plans.clear()
+        self._query_plans_lock.release()
 
 
     def _get_type_inverted_indexes(self, type_name):
@@ -783,7 +1176,7 @@ class Database:
 
             # What's left gets put into the pickle.
             columns.append("pickle")
-            values.append(buffer(cPickle.dumps(attrs_copy, 2)))
+            values.append(_pickle_attrs(attrs_copy))
             placeholders.append("?")
 
         table_name = "objects_" + type_name
@@ -953,12 +1346,44 @@ class Database:
             self._db_query("UPDATE inverted_indexes SET value=value+1 WHERE attr='objectcount' AND name IN %s" % \
                            _list_to_printable(inverted_indexes))
 
-
         # Process inverted index maps for this row
-        ivtidx_terms = []
+        ivtidx_terms = self._score_object_inverted_index_terms(object_type, attrs)
         for ivtidx in inverted_indexes:
             # Sync cached objectcount with the DB (that we just updated above)
             self._inverted_indexes[ivtidx]['objectcount'] += 1
+
+        query, values = self._make_query_from_attrs("add", attrs, object_type)
+        self._db_query(query, values)
+
+        # Add id given by db, as well as object type.
+        attrs['id'] = self._cursor.lastrowid
+        attrs['type'] = unicode(object_type)
+        attrs['parent'] = self._to_obj_tuple(parent) if parent else (None, None)
+
+        for ivtidx, terms in ivtidx_terms:
+            self._add_object_inverted_index_terms((object_type, attrs['id']), ivtidx, terms)
+
+        # Populate dictionary with keys for this object type not specified in kwargs.
+        attrs.update(dict.fromkeys([k for k in type_attrs if k not in attrs.keys() + ['pickle']]))
+
+        self._set_dirty()
+        return ObjectRow(None, None, attrs)
+
+
+    def _score_object_inverted_index_terms(self, object_type, attrs):
+        """
+        Scores the terms for all inverted indexes of the given object type
+        using the attributes in the attrs dict, which is modified in place
+        to hold the cached terms of any registered attribute named after an
+        inverted index.
+
+        Returns a list of (ivtidx, terms) tuples, where terms is the dict
+        as computed by _score_terms().  Inverted indexes without any terms
+        are not included.
+        """
+        type_attrs = self._get_type_attrs(object_type)
+        ivtidx_terms = []
+        for ivtidx in self._get_type_inverted_indexes(object_type):
             terms_list = []
             split = self._inverted_indexes[ivtidx]['split']
             for name, (attr_type, flags, attr_ivtidx, attr_split) in type_attrs.items():
@@ -980,23 +1405,84 @@ class Database:
                     # Registered attribute named after ivtidx; store ivtidx
                     # terms in object.
                     attrs[ivtidx] = terms.keys()
+        return ivtidx_terms
 
-        query, values = self._make_query_from_attrs("add", attrs, object_type)
-        self._db_query(query, values)
 
-        # Add id given by db, as well as object type.
-        attrs['id'] = self._cursor.lastrowid
-        attrs['type'] = unicode(object_type)
-        attrs['parent'] = self._to_obj_tuple(parent) if parent else (None, None)
+    def add_many(self, object_type, objects, parent=None):
+        """
+        Adds many objects of the same type to the database in one pass.
+
+        :param object_type: the type name of all objects being added
+        :param objects: a sequence of dicts, each holding the attributes
+                        for one object as they would be passed as kwargs
+                        to :meth:`~kaa.db.Database.add`.  A dict may contain
+                        a ``parent`` key, which overrides the parent argument
+                        for that object.
+        :param parent: the default parent for all objects
+        :type parent: ObjectRow, or (type, id)
+        :returns: list of ObjectRow, one for each added object, in the
+                  same order as given in objects
+
+        This method is considerably faster than calling add() for each
+        object.  Object ids are allocated up front so that all rows of the
+        same shape can be inserted with a single executemany(), and the
+        inverted index terms for the new objects are kept in memory and
+        written in one pass when the database is next committed (or before
+        the inverted index is otherwise accessed).
+        """
+        type_attrs = self._get_type_attrs(object_type)
+        type_id = self._get_type_id(object_type)
+        inverted_indexes = self._get_type_inverted_indexes(object_type)
+        if not objects:
+            return []
 
-        for ivtidx, terms in ivtidx_terms:
-            self._add_object_inverted_index_terms((object_type, attrs['id']), ivtidx, terms)
+        results = []
+        # Rows keyed on the INSERT statement, so that all objects providing
+        # the same set of columns can be inserted together.
+        rows = {}
 
-        # Populate dictionary with keys for this object type not specified in kwargs.
-        attrs.update(dict.fromkeys([k for k in type_attrs if k not in attrs.keys() + ['pickle']]))
+        self._lock.acquire()
+        try:
+            # Allocate ids ourselves, since lastrowid isn't available with
+            # executemany.  Because the id column is AUTOINCREMENT, sqlite
+            # keeps sqlite_sequence in sync with the explicit ids we insert.
+            row = self._db_query_row("SELECT seq FROM sqlite_sequence WHERE name=?", ('objects_' + object_type,))
+            next_id = (row[0] if row else 0) + 1
+
+            for obj in objects:
+                attrs = dict(obj)
+                obj_parent = attrs.pop('parent', parent)
+                if obj_parent:
+                    attrs['parent_type'], attrs['parent_id'] = self._to_obj_tuple(obj_parent, numeric=True)
+
+                for ivtidx, terms in self._score_object_inverted_index_terms(object_type, attrs):
+                    self._pending_ivtidx_terms.setdefault(ivtidx, []).append((type_id, next_id, terms))
+
+                attrs['id'] = next_id
+                next_id += 1
+                query, values = self._make_query_from_attrs("add", attrs, object_type)
+                rows.setdefault(query, []).append(values)
+
+                attrs['type'] = unicode(object_type)
+                attrs['parent'] = self._to_obj_tuple(obj_parent) if obj_parent else (None, None)
+                # Populate dictionary with keys for this object type not specified in objects.
+                attrs.update(dict.fromkeys([k for k in type_attrs if k not in attrs and k != 'pickle']))
+                results.append(ObjectRow(None, None, attrs))
+
+            # Increment objectcount for the applicable inverted indexes.
+            if inverted_indexes:
+                self._db_query("UPDATE inverted_indexes SET value=value+? WHERE attr='objectcount' AND name IN %s" % \
+                               _list_to_printable(inverted_indexes), (len(results),))
+                for ivtidx in inverted_indexes:
+                    self._inverted_indexes[ivtidx]['objectcount'] += len(results)
+
+            for query, values in rows.items():
+                self._db_query(query, values, many=True)
+        finally:
+            self._lock.release()
 
         self._set_dirty()
-        return ObjectRow(None, None, attrs)
+        return results
 
 
     def get(self, obj):
@@ -1071,7 +1557,7 @@ class Database:
             if reqd_columns[0] == 'pickle' and row[0]:
                 # One of the attrs we're updating is in the pickle, so we
                 # have fetched it; now convert it to a dict.
-                row_attrs = cPickle.loads(str(row[0]))
+                row_attrs = _unpickle_attrs(row[0])
                 for key, value in row_attrs.items():
                     # Rename all __foo to foo for ATTR_IGNORE_CASE columns
                     if key.startswith('__') and type_attrs[key[2:]][1] & ATTR_IGNORE_CASE:
@@ -1148,42 +1634,187 @@ class Database:
         main.signals['exit'].disconnect(self.commit)
         self._dirty = False
         self._lock.acquire()
-        self._db.commit()
-        self._lock.release()
+        try:
+            self._flush_inverted_index_terms()
+            for iterator in self._query_iterators.keys():
+                iterator._prefetch()
+            self._db.commit()
+        finally:
+            self._lock.release()
 
 
-    def query(self, **attrs):
+    def _get_query_plan(self, signature):
         """
-        Query the database for objects matching all of the given attributes
-        (specified in kwargs).  There are a few special kwarg attributes:
+        Returns the query plan for the given query signature (as constructed
+        by query()), compiling it if it's not in the plan cache.  When the
+        cache is full, the least recently used half of the plans is evicted.
 
-             parent: (type, id) tuple referring to the object's parent, where
-                     type is the name of the type and id is the database id
-                     of the parent, or a QExpr.   parent may also be a tuple
-                     of (type, id) tuples.
-             object: (type, id) tuple referring to the object itself.
-               type: only search items of this type (e.g. "images"); if None
-                     (or not specified) all types are searched.
-              limit: return only this number of results; if None (or not
-                     specified) all matches are returned.  For better
-                     performance it is highly recommended a limit is specified
-                     for searches on inverted indexes.
-              attrs: A list of attributes to be returned.  If not specified,
-                     all possible attributes.
-           distinct: If True, selects only distinct rows.  When distinct is
-                     specified, attrs kwarg must also be given, and no
-                     specified attrs can be ATTR_SIMPLE.
+        The cache is shared with queries on reader connections, so it's only
+        accessed with _query_plans_lock held.  Compiling a plan doesn't touch
+        the database, so this doesn't need the main connection's lock.
+        """
+        self._query_plans_lock.acquire()
+        try:
+            self._query_plans_tick += 1
+            try:
+                entry = self._query_plans[signature]
+            except KeyError:
+                self._query_plans_stats['misses'] += 1
+                entry = [self._compile_query_plan(*signature), 0]
+                if len(self._query_plans) >= QUERY_PLAN_CACHE_SIZE:
+                    lru = sorted(self._query_plans.items(), key=lambda (sig, (plan, tick)): tick)
+                    for sig, e in lru[:len(lru) / 2 + 1]:
+                        del self._query_plans[sig]
+                self._query_plans[signature] = entry
+            else:
+                self._query_plans_stats['hits'] += 1
 
-        Return value is a list of ObjectRow objects, which behave like
-        dictionaries in most respects.  Attributes defined in the object
-        type are accessible, as well as 'type' and 'parent' keys.
+            entry[1] = self._query_plans_tick
+            return entry[0]
+        finally:
+            self._query_plans_lock.release()
+
+
+    def _compile_query_plan(self, type_name, requested_columns, distinct, limit, ivtidx, parents, attrs):
+        """
+        Compiles a query plan for a query of the given shape.  parents is a
+        tuple of operators for the QExpr of each parent, and attrs is a
+        sorted tuple of (attr, operator) pairs for the searched attributes.
+        The other arguments are as passed to query(), except that limit and
+        ivtidx are booleans indicating a result limit and inverted index
+        results respectively.
+
+        The plan is a list of (type_name, type_id, sql, bind) tuples for each
+        object type that needs to be queried.  sql is the statement, which
+        contains a %s for each fragment that can only be generated from the
+        query values (id lists for inverted index results and IN operators),
+        and bind is a function taking (attrs, parents, ivtidx_ids, limit) and
+        returning a list of those fragments and a list of query values.
+
+        Decoding of result rows needs no compilation here, because the
+        ObjectRow extension caches its decoding information per query shape
+        already.
+        """
+        if type_name is not None:
+            if type_name not in self._object_types:
+                raise ValueError, "Unknown object type '%s'" % type_name
+            type_list = [(type_name, self._object_types[type_name])]
+        else:
+            type_list = self._object_types.items()
+
+        query_type = ('ALL', 'DISTINCT')[distinct]
+        plan = []
+        for type_name, (type_id, type_attrs, type_idx) in type_list:
+            # Select only sql columns (i.e. attrs that aren't ATTR_SIMPLE).
+            all_columns = [ x for x in type_attrs if type_attrs[x][1] & ATTR_SEARCHABLE ]
+            if requested_columns:
+                columns = list(requested_columns)
+                # Ensure that all the requested columns exist for this type
+                missing = tuple(set(columns).difference(type_attrs.keys()))
+                if missing:
+                    raise ValueError, "One or more requested attributes %s are not available for type '%s'" % \
+                                      (str(missing), type_name)
+                # If any of the requested attributes are ATTR_SIMPLE or
+                # ATTR_INDEXED_IGNORE_CASE then we need the pickle.
+                pickled = [ x for x in columns if type_attrs[x][1] & (ATTR_SIMPLE | ATTR_INDEXED_IGNORE_CASE) in
+                                                                     (ATTR_SIMPLE, ATTR_INDEXED_IGNORE_CASE)]
+                if pickled:
+                    # One or more attributes from pickle are requested in attrs list,
+                    # so we need to grab the pickle column.
+                    if 'pickle' not in columns:
+                        columns.append('pickle')
+                    # Remove the list of pickled attributes so we don't
+                    # request them as sql columns.
+                    columns = list(set(columns).difference(pickled))
+            else:
+                columns = all_columns
+
+            # Now construct a query based on the supplied attributes for this
+            # object type.
+
+            # If any of the attribute names aren't valid for this type, then we
+            # don't bother matching, since this an AND query and there won't be
+            # any matches.
+            missing = set(attr for attr, operator in attrs).difference(all_columns)
+            if missing:
+                # Raise exception if user attempts to search on a simple attr.
+                simple = [ x for x in missing if x in type_attrs and type_attrs[x][1] & ATTR_SIMPLE ]
+                if simple:
+                    raise ValueError, "Querying on non-searchable attribute '%s'" % simple[0]
+                continue
+
+            q = []
+            q.append("SELECT %s '%s',%d,id,%s FROM objects_%s" % \
+                (query_type, type_name, type_id, ",".join(columns), type_name))
+
+            if ivtidx:
+                q.append("WHERE")
+                q.append("id IN %s")
+
+            if len(parents):
+                q.append(("WHERE", "AND")["WHERE" in q])
+                expr = []
+                for operator in parents:
+                    expr.append("(parent_type=? AND %s)" % _query_expr_sql("parent_id", operator))
+                q.append("(%s)" % " OR ".join(expr))
+
+            binders = []
+            for attr, operator in attrs:
+                attr_type, attr_flags = type_attrs[attr][:2]
+                binders.append((attr, attr_type, attr_flags))
+                # Queries on ATTR_IGNORE_CASE string columns are case-insensitive.
+                # Strings are the only operands that pass the type check in
+                # _bind_query_expr() for these attributes, with the exception
+                # of range and (not) in operators, whose operands are not
+                # modified.
+                if issubclass(attr_type, basestring) and attr_flags & ATTR_IGNORE_CASE and \
+                   operator not in ('range', 'in', 'not in') and not attr_flags & ATTR_INDEXED:
+                    # If this column is ATTR_INDEXED then we already ensure
+                    # the values are stored in lowercase in the db, so we
+                    # don't want to get sql to lower() the column because
+                    # it's needless, and more importantly, we won't be able
+                    # to use any indices on the column.
+                    attr = 'lower(%s)' % attr
+
+                q.append(("WHERE", "AND")["WHERE" in q])
+                q.append(_query_expr_sql(attr, operator))
+
+            if query_type == 'DISTINCT':
+                q.append(' GROUP BY %s' % ','.join(requested_columns))
+
+            if limit:
+                q.append(" LIMIT ?")
+
+            def bind(attrs, parents, ivtidx_ids, limit, binders=binders):
+                parts, values = [], []
+                if ivtidx_ids is not None:
+                    parts.append(_list_to_printable(ivtidx_ids))
+                for parent_type, parent_id in parents:
+                    values.append(parent_type)
+                    _bind_query_expr(parent_id, None, 0, parts, values)
+                for attr, attr_type, attr_flags in binders:
+                    _bind_query_expr(attrs[attr], attr_type, attr_flags, parts, values)
+                if limit is not None:
+                    values.append(limit)
+                return parts, values
+
+            plan.append((type_name, type_id, " ".join(q), bind))
+
+        return plan
+
+
+    def _prepare_query(self, attrs):
+        """
+        Prepares the statements for a query with the given attributes (see
+        query() for details), consuming the attrs dict in the process.
+
+        Returns a 3-tuple (statements, limit, ivtidx_results), where statements
+        is a list of (sql, values) tuples to be executed in order, limit is
+        the result limit (or None), and ivtidx_results is a dict mapping
+        (type_id, object_id) to score if an inverted index was searched, or
+        None otherwise.
         """
-        query_info = {}
         parents = []
-        query_type = "ALL"
-        results = []
-        query_info["columns"] = {}
-        query_info["attrs"] = {}
 
         if "object" in attrs:
             attrs['type'], attrs['id'] = self._to_obj_tuple(attrs['object'])
@@ -1217,7 +1848,7 @@ class Database:
 
                 if not ivtidx_results:
                     # No matches, so we're done.
-                    return []
+                    return [], None, None
 
                 del attrs[ivtidx]
 
@@ -1228,13 +1859,7 @@ class Database:
                     ivtidx_results_by_type[tp] = []
                 ivtidx_results_by_type[tp].append(id)
 
-        if "type" in attrs:
-            if attrs["type"] not in self._object_types:
-                raise ValueError, "Unknown object type '%s'" % attrs["type"]
-            type_list = [(attrs["type"], self._object_types[attrs["type"]])]
-            del attrs["type"]
-        else:
-            type_list = self._object_types.items()
+        type_name = attrs.pop('type', None)
 
         if "parent" in attrs:
             # ("type", id_or_QExpr) or (("type1", id_or_QExpr), ("type2", id_or_QExpr), ...)
@@ -1249,143 +1874,87 @@ class Database:
                 parents.append((parent_type_id, parent_id))
             del attrs['parent']
 
-        if "limit" in attrs:
-            result_limit = attrs["limit"]
-            del attrs["limit"]
-        else:
-            result_limit = None
-
-        if "attrs" in attrs:
-            requested_columns = attrs["attrs"]
-            del attrs["attrs"]
-        else:
-            requested_columns = None
-
-        if "distinct" in attrs:
-            if attrs["distinct"]:
-                if not requested_columns:
-                    raise ValueError, "Distinct query specified, but no attrs kwarg given."
-                query_type = "DISTINCT"
-            del attrs["distinct"]
-
-
-        for type_name, (type_id, type_attrs, type_idx) in type_list:
+        result_limit = attrs.pop('limit', None)
+        requested_columns = attrs.pop('attrs', None)
+        distinct = bool(attrs.pop('distinct', False))
+        if distinct and not requested_columns:
+            raise ValueError, "Distinct query specified, but no attrs kwarg given."
+
+        # What remains in attrs are the attributes to search on.  Look up
+        # (or compile) the query plan for the shape of this query.
+        signature = (type_name, tuple(requested_columns) if requested_columns else None, distinct,
+                     result_limit is not None, ivtidx_results is not None,
+                     tuple(parent_id._operator for parent_type_id, parent_id in parents),
+                     tuple(sorted((attr, value._operator if type(value) == QExpr else '=') \
+                                  for attr, value in attrs.items())))
+        plan = self._get_query_plan(signature)
+
+        statements = []
+        for type_name, type_id, sql, bind in plan:
             if ivtidx_results and type_id not in ivtidx_results_by_type:
                 # If we've done a ivtidx search, don't bother querying
                 # object types for which there were no hits.
                 continue
 
-            # Select only sql columns (i.e. attrs that aren't ATTR_SIMPLE).
-            all_columns = [ x for x in type_attrs if type_attrs[x][1] & ATTR_SEARCHABLE ]
-            if requested_columns:
-                columns = requested_columns[:]
-                # Ensure that all the requested columns exist for this type
-                missing = tuple(set(columns).difference(type_attrs.keys()))
-                if missing:
-                    raise ValueError, "One or more requested attributes %s are not available for type '%s'" % \
-                                      (str(missing), type_name)
-                # If any of the requested attributes are ATTR_SIMPLE or
-                # ATTR_INDEXED_IGNORE_CASE then we need the pickle.
-                pickled = [ x for x in columns if type_attrs[x][1] & (ATTR_SIMPLE | ATTR_INDEXED_IGNORE_CASE) in
-                                                                     (ATTR_SIMPLE, ATTR_INDEXED_IGNORE_CASE)]
-                if pickled:
-                    # One or more attributes from pickle are requested in attrs list,
-                    # so we need to grab the pickle column.
-                    if 'pickle' not in columns:
-                        columns.append('pickle')
-                    # Remove the list of pickled attributes so we don't
-                    # request them as sql columns.
-                    columns = list(set(columns).difference(pickled))
-            else:
-                columns = all_columns
-
-            # Now construct a query based on the supplied attributes for this
-            # object type.
-
-            # If any of the attribute names aren't valid for this type, then we
-            # don't bother matching, since this an AND query and there won't be
-            # any matches.
-            missing = set(attrs).difference(all_columns)
-            if missing:
-                # Raise exception if user attempts to search on a simple attr.
-                simple = [ x for x in missing if x in type_attrs and type_attrs[x][1] & ATTR_SIMPLE ]
-                if simple:
-                    raise ValueError, "Querying on non-searchable attribute '%s'" % simple[0]
-                continue
+            parts, query_values = bind(attrs, parents, ivtidx_results_by_type and ivtidx_results_by_type[type_id],
+                                       result_limit)
+            statements.append((sql % tuple(parts) if parts else sql, query_values))
 
-            q = []
-            query_values = []
-            q.append("SELECT %s '%s',%d,id,%s FROM objects_%s" % \
-                (query_type, type_name, type_id, ",".join(columns), type_name))
+        return statements, result_limit, ivtidx_results
 
-            if ivtidx_results != None:
-                q.append("WHERE")
-                q.append("id IN %s" % _list_to_printable(ivtidx_results_by_type[type_id]))
 
-            if len(parents):
-                q.append(("WHERE", "AND")["WHERE" in q])
-                expr = []
-                for parent_type, parent_id in parents:
-                    sql, values = parent_id.as_sql("parent_id")
-                    expr.append("(parent_type=? AND %s)" % sql)
-                    query_values += (parent_type,) + values
-                q.append("(%s)" % " OR ".join(expr))
-
-            for attr, value in attrs.items():
-                attr_type, attr_flags = type_attrs[attr][:2]
-                if type(value) != QExpr:
-                    value = QExpr("=", value)
-
-                # Coerce between numeric types; also coerce a string of digits into a numeric
-                # type.
-                if attr_type in (int, long, float) and (type(value._operand) in (int, long, float) or \
-                    isinstance(value._operand, basestring) and value._operand.isdigit()):
-                    value._operand = attr_type(value._operand)
-
-                # Verify expression operand type is correct for this attribute.
-                if value._operator not in ("range", "in", "not in") and \
-                   type(value._operand) != attr_type:
-                    raise TypeError, "Type mismatch in query: '%s' (%s) is not a %s" % \
-                                          (str(value._operand), str(type(value._operand)), str(attr_type))
-
-                # Queries on ATTR_IGNORE_CASE string columns are case-insensitive.
-                if isinstance(value._operand, basestring) and type_attrs[attr][1] & ATTR_IGNORE_CASE:
-                    value._operand = value._operand.lower()
-                    if not (type_attrs[attr][1] & ATTR_INDEXED):
-                        # If this column is ATTR_INDEXED then we already ensure
-                        # the values are stored in lowercase in the db, so we
-                        # don't want to get sql to lower() the column because
-                        # it's needless, and more importantly, we won't be able
-                        # to use any indices on the column.
-                        attr = 'lower(%s)' % attr
-
-                if type(value._operand) == str:
-                    # Treat strings (non-unicode) as buffers.
-                    value._operand = buffer(value._operand)
+    def query(self, **attrs):
+        """
+        Query the database for objects matching all of the given attributes
+        (specified in kwargs).  There are a few special kwarg attributes:
 
-                q.append(("WHERE", "AND")["WHERE" in q])
+             parent: (type, id) tuple referring to the object's parent, where
+                     type is the name of the type and id is the database id
+                     of the parent, or a QExpr.   parent may also be a tuple
+                     of (type, id) tuples.
+             object: (type, id) tuple referring to the object itself.
+               type: only search items of this type (e.g. "images"); if None
+                     (or not specified) all types are searched.
+              limit: return only this number of results; if None (or not
+                     specified) all matches are returned.  For better
+                     performance it is highly recommended a limit is specified
+                     for searches on inverted indexes.
+              attrs: A list of attributes to be returned.  If not specified,
+                     all possible attributes.
+           distinct: If True, selects only distinct rows.  When distinct is
+                     specified, attrs kwarg must also be given, and no
+                     specified attrs can be ATTR_SIMPLE.
 
-                sql, values = value.as_sql(attr)
-                q.append(sql)
-                query_values.extend(values)
+        Return value is a list of ObjectRow objects, which behave like
+        dictionaries in most respects.  Attributes defined in the object
+        type are accessible, as well as 'type' and 'parent' keys.
 
-            if query_type == 'DISTINCT':
-                q.append(' GROUP BY %s' % ','.join(requested_columns))
+        If the database was opened with readers, queries from threads other
+        than the main thread run on a read-only connection and see only
+        committed changes.
+        """
+        reader = self._checkout_reader()
+        self._reader_local.reader = reader
+        try:
+            return self._query(attrs)
+        finally:
+            if reader:
+                self._reader_local.reader = None
+                self._checkin_reader(reader)
 
-            if result_limit != None:
-                q.append(" LIMIT %d" % result_limit)
 
-            q = " ".join(q)
-            rows = self._db_query(q, query_values, cursor = self._qcursor)
+    def _query(self, attrs):
+        statements, result_limit, ivtidx_results = self._prepare_query(attrs)
+        cursor = self._read_cursor(self._qcursor)
+        results = []
+        for q, query_values in statements:
+            rows = self._db_query(q, query_values, cursor = cursor)
 
             if result_limit != None:
                 results.extend(rows[:result_limit - len(results) + 1])
             else:
                 results.extend(rows)
 
-            query_info["columns"][type_name] = ["type"] + columns
-            query_info["attrs"][type_name] = type_attrs
-
             if result_limit != None and len(rows) == result_limit:
                 # No need to try the other types, we're done.
                 break
@@ -1398,6 +1967,45 @@ class Database:
         return results
 
 
+    def query_iter(self, batch=500, **attrs):
+        """
+        Query the database like query(), but return the results lazily.
+
+        :param batch: the number of rows fetched from the database at a time
+        :returns: an iterator over ObjectRow objects
+
+        Rather than fetching all matching rows up front, rows are fetched
+        (and ObjectRow objects created) in batches as the iterator is
+        consumed, so the memory needed for large results stays bounded and
+        the first rows are available immediately.  Changes committed while
+        iterating may or may not be reflected in the results.
+
+        Results from queries on inverted indexes must be sorted by score, so
+        these are fetched entirely before the first row is returned.
+
+        As with query(), a reader connection is used outside the main thread
+        if available, and kept until the iterator is exhausted.
+        """
+        reader = self._checkout_reader()
+        self._reader_local.reader = reader
+        try:
+            statements, result_limit, ivtidx_results = self._prepare_query(attrs)
+            if not ivtidx_results:
+                # The iterator takes over the reader.
+                iterator, reader = _QueryIterator(self, statements, result_limit, batch, reader), None
+                return iterator
+
+            rows = []
+            cursor = self._read_cursor(self._qcursor)
+            for q, query_values in statements:
+                rows.extend(self._db_query(q, query_values, cursor = cursor))
+            rows.sort(lambda a, b: cmp(ivtidx_results[(b[1], b[2])], ivtidx_results[(a[1], a[2])]))
+            return iter(rows[:result_limit])
+        finally:
+            self._reader_local.reader = None
+            if reader:
+                self._checkin_reader(reader)
+
 
     def _score_terms(self, terms_list):
         """
@@ -1487,6 +2095,9 @@ class Database:
             type_id = self._get_type_id(type_name)
 
             for ivtidx in ivtidxes:
+                # Terms for these objects may still be pending from add_many().
+                self._flush_inverted_index_terms(ivtidx)
+                self._delete_posting_list_entries(ivtidx, type_id, object_ids)
                 # Remove all terms for the inverted index associated with this
                 # object.  A trigger will decrement the count column in the
                 # terms table for all term_id that get affected.
@@ -1534,6 +2145,174 @@ class Database:
 
         self._db_query('UPDATE ivtidx_%s_terms SET count=? WHERE id=?' % ivtidx, update_list, many = True)
         self._db_query('INSERT INTO ivtidx_%s_terms_map VALUES(?, ?, ?, ?, ?)' % ivtidx, map_list, many = True)
+        self._add_posting_list_entries(ivtidx, map_list)
+
+
+    def _flush_inverted_index_terms(self, ivtidx=None):
+        """
+        Writes inverted index terms deferred by add_many() to the database.
+        If ivtidx is None, pending terms of all inverted indexes are written,
+        otherwise only those of the given inverted index.
+
+        All terms of all pending objects are merged so that each term is
+        looked up, inserted, and its count updated only once, regardless of
+        how many objects refer to it.
+        """
+        if not self._pending_ivtidx_terms:
+            return
+
+        self._lock.acquire()
+        try:
+            for name in ([ivtidx] if ivtidx else self._pending_ivtidx_terms.keys()):
+                pending = self._pending_ivtidx_terms.pop(name, None)
+                if not pending:
+                    continue
+
+                # Number of new objects each (lowercased) term maps to.
+                new_counts = {}
+                for type_id, object_id, terms in pending:
+                    for term in terms:
+                        term = term.lower()
+                        new_counts[term] = new_counts.get(term, 0) + 1
+
+                # Fetch ids of terms already in the db, in chunks to keep the
+                # statement size reasonable.
+                term_ids = {}
+                all_terms = new_counts.keys()
+                for i in range(0, len(all_terms), 500):
+                    q = 'SELECT id,term FROM ivtidx_%s_terms WHERE term IN %s' % \
+                        (name, _list_to_printable(all_terms[i:i+500]))
+                    term_ids.update((row[1], row[0]) for row in self._db_query(q))
+
+                update_list = [(new_counts[term], id) for term, id in term_ids.items()]
+                self._db_query('UPDATE ivtidx_%s_terms SET count=count+? WHERE id=?' % name, update_list, many = True)
+
+                new_terms = [term for term in all_terms if term not in term_ids]
+                if new_terms:
+                    self._db_query('INSERT INTO ivtidx_%s_terms VALUES(NULL, ?, ?)' % name,
+                                   [(term, new_counts[term]) for term in new_terms], many = True)
+                    for i in range(0, len(new_terms), 500):
+                        q = 'SELECT id,term FROM ivtidx_%s_terms WHERE term IN %s' % \
+                            (name, _list_to_printable(new_terms[i:i+500]))
+                        term_ids.update((row[1], row[0]) for row in self._db_query(q))
+
+                map_list = []
+                for type_id, object_id, terms in pending:
+                    for term, score in terms.items():
+                        map_list.append((int(score*10), term_ids[term.lower()], type_id, object_id, score))
+                self._db_query('INSERT INTO ivtidx_%s_terms_map VALUES(?, ?, ?, ?, ?)' % name, map_list, many = True)
+                self._add_posting_list_entries(name, map_list)
+        finally:
+            self._lock.release()
+
+
+    def _get_posting_list(self, ivtidx, term_id):
+        """
+        Returns the posting list for the given term of the inverted index
+        as a 2-tuple (keys, frequencies), loading it from the terms map
+        table if it hasn't been already.
+        """
+        lists = self._posting_lists.setdefault(ivtidx, {})
+        if term_id not in lists:
+            keys, freqs = array.array(POSTING_KEY_TYPECODE), array.array('d')
+            rows = self._db_query('SELECT object_type,object_id,frequency FROM ivtidx_%s_terms_map '
+                                  'WHERE term_id=? ORDER BY object_type,object_id' % ivtidx, (term_id,))
+            for object_type, object_id, frequency in rows:
+                keys.append(object_type << 32 | object_id)
+                freqs.append(frequency)
+            lists[term_id] = keys, freqs
+        return lists[term_id]
+
+
+    def _add_posting_list_entries(self, ivtidx, map_list):
+        """
+        Adds the given rows (as inserted into the terms map table) to the
+        posting lists of the inverted index that are currently loaded.
+        """
+        lists = self._posting_lists and self._posting_lists.get(ivtidx)
+        if not lists:
+            return
+        for rank, term_id, object_type, object_id, frequency in map_list:
+            if term_id in lists:
+                keys, freqs = lists[term_id]
+                key = object_type << 32 | object_id
+                idx = bisect.bisect_left(keys, key)
+                keys.insert(idx, key)
+                freqs.insert(idx, frequency)
+
+
+    def _delete_posting_list_entries(self, ivtidx, object_type, object_ids):
+        """
+        Removes the given objects of the type (given as type id) from all
+        loaded posting lists of the inverted index.  Must be called before
+        the objects' rows are deleted from the terms map table.
+        """
+        lists = self._posting_lists and self._posting_lists.get(ivtidx)
+        if not lists or not object_ids:
+            return
+        rows = self._db_query('SELECT term_id,object_id FROM ivtidx_%s_terms_map WHERE object_type=? AND '
+                              'object_id IN %s' % (ivtidx, _list_to_printable(object_ids)), (object_type,))
+        for term_id, object_id in rows:
+            if term_id in lists:
+                keys, freqs = lists[term_id]
+                key = object_type << 32 | object_id
+                idx = bisect.bisect_left(keys, key)
+                if idx < len(keys) and keys[idx] == key:
+                    del keys[idx]
+                    del freqs[idx]
+
+
+    def _query_posting_lists(self, ivtidx, terms, ids, limit, object_type):
+        """
+        Implements _query_inverted_index() using the in-memory posting lists.
+        terms and ids are as computed by _query_inverted_index().
+
+        The posting lists of all terms are intersected, starting from the
+        shortest list and galloping through the longer ones.  Scores are the
+        same as those computed by the SQL algorithm.  If limit is given, only
+        the limit highest scoring objects are returned.
+        """
+        postings = []
+        for id in ids:
+            keys, freqs = self._get_posting_list(ivtidx, id)
+            lo, hi = 0, len(keys)
+            if object_type:
+                # Restrict the list to the range of keys for this type.
+                lo = bisect.bisect_left(keys, object_type << 32)
+                hi = bisect.bisect_left(keys, (object_type + 1) << 32, lo)
+            postings.append((hi - lo, keys, freqs, lo, hi, terms[id]['idf_t']))
+        postings.sort(key=lambda posting: posting[0])
+
+        results = {}
+        length, keys, freqs, lo, hi, idf_t = postings[0]
+        # Remaining lists as [keys, freqs, lo, hi, idf_t], where lo is
+        # advanced as we go.
+        others = [list(posting[1:]) for posting in postings[1:]]
+        exhausted = False
+        for idx in xrange(lo, hi):
+            key = keys[idx]
+            score = freqs[idx] * idf_t
+            for other in others:
+                other_keys, other_freqs, other_lo, other_hi, other_idf_t = other
+                other_lo = other[2] = _gallop(other_keys, key, other_lo, other_hi)
+                if other_lo == other_hi:
+                    # This list is exhausted, so there can be no more
+                    # intersections.
+                    exhausted = True
+                    break
+                if other_keys[other_lo] != key:
+                    break
+                score += other_freqs[other_lo] * other_idf_t
+            else:
+                object_type_id, object_id = divmod(int(key), 1 << 32)
+                results[object_type_id, object_id] = score
+
+            if exhausted:
+                break
+
+        if limit and len(results) > limit:
+            results = dict(heapq.nlargest(limit, results.iteritems(), key=lambda item: item[1]))
+        return results
 
 
     def _query_inverted_index(self, ivtidx, terms, limit = 100, object_type = None):
@@ -1566,6 +2345,12 @@ class Database:
         case can be mitigated by caching common term combinations, but it is
         an extremely difficult problem to solve.
 
+        If the database was created with posting_lists=True, none of the
+        above applies: the posting lists of all terms are intersected in
+        memory instead (see _query_posting_lists()), which has no such worst
+        case.  Queries on a reader connection still use SQL: the posting
+        lists are changed by the main thread and include uncommitted changes.
+
         object_type specifies an type name to search (for example we can
         search type "image" with keywords "2005 vacation"), or if object_type
         is None (default), then all types are searched.
@@ -1574,6 +2359,7 @@ class Database:
         which match the query.
         """
         t0 = time.time()
+        self._flush_inverted_index_terms(ivtidx)
         # Fetch number of files the inverted index applies to.  (Used in score
         # calculations.)
         objectcount = self._inverted_indexes[ivtidx]['objectcount']
@@ -1602,7 +2388,8 @@ class Database:
 
         # Find term ids and order by least popular to most popular.
         rows = self._db_query('SELECT id,term,count FROM ivtidx_%s_terms WHERE ' \
-                              'term IN %s ORDER BY count' % (ivtidx, terms_list))
+                              'term IN %s ORDER BY count' % (ivtidx, terms_list),
+                              cursor = self._read_cursor(self._cursor))
         save = map(lambda x: x.lower(), terms)
         terms = {}
         ids = []
@@ -1646,6 +2433,11 @@ class Database:
         if limit <= 0 or objectcount <= 0:
             return {}
 
+        if self._posting_lists is not None and not getattr(self._reader_local, 'reader', None):
+            all_results = self._query_posting_lists(ivtidx, terms, ids, limit, object_type)
+            log.info('%d results from posting lists, %.04f seconds', len(all_results), time.time()-t0)
+            return all_results
+
         sql_limit = min(limit*3, 200)
         finished = False
         nqueries = 0
@@ -1688,7 +2480,7 @@ class Database:
                     else:
                         q %= ''
 
-                    rows = self._db_query(q, v)
+                    rows = self._db_query(q, v, cursor = self._read_cursor(self._cursor))
                     nqueries += 1
                     state[id]['more'][rank] = len(rows) == sql_limit
                     state[id]['count'] += len(rows)
@@ -1801,6 +2593,7 @@ class Database:
         """
         if ivtidx not in self._inverted_indexes:
             raise ValueError, "'%s' is not a registered inverted index." % ivtidx
+        self._flush_inverted_index_terms(ivtidx)
 
         if prefix:
             where_clause = 'WHERE terms.term >= ? AND terms.term <= ?'
@@ -1850,6 +2643,10 @@ class Database:
                   idx: list of multi-column indices
            termcounts: Dictionary of number of index terms for each inverted index.
                  file: full path to DB file
+           queryplans: dict holding the number of cached query plans (size),
+                       and plan cache hits and misses.
+                  wal: True if the database is in WAL mode
+              readers: number of reader connections opened
         """
         total = 0
         info = {
@@ -1869,11 +2666,15 @@ class Database:
         info['total'] = total
 
         info['termcounts'] = {}
+        self._flush_inverted_index_terms()
         for ivtidx in self._inverted_indexes:
             row = self._db_query_row('SELECT COUNT(*) FROM ivtidx_%s_terms' % ivtidx)
             info['termcounts'][ivtidx] = int(row[0])
 
         info['file'] = self._dbfile
+        info['queryplans'] = dict(size=len(self._query_plans), **self._query_plans_stats)
+        info['wal'] = self.wal
+        info['readers'] = self._reader_count
         return info
 
 
@@ -1916,6 +2717,7 @@ class Database:
         # We need to do this eventually, but there's no index on count, so
         # this could potentially be slow.  It doesn't hurt to leave rows
         # with count=0, so this could be done intermittently.
+        self._flush_inverted_index_terms()
         for ivtidx in self._inverted_indexes:
             self._db_query('DELETE FROM ivtidx_%s_terms WHERE count=0' % ivtidx)
         self._db_query("VACUUM")
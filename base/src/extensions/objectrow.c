@@ -40,6 +40,14 @@
 
 #define PyObjectRow_Check(op)   ((op)->ob_type == &ObjectRow_PyObject_Type)
 
+/* Indexed pickle format for ATTR_SIMPLE attributes, see _pickle_attrs() in
+ * db.py.  The header is the magic followed by the number of keys and the
+ * size of the index.
+ */
+#define PICKLE_MAGIC             "KDB\x01"
+#define PICKLE_MAGIC_LEN         4
+#define PICKLE_HEADER_LEN        12
+
 #if PY_VERSION_HEX < 0x02050000
 typedef int Py_ssize_t;
 #define PY_SSIZE_T_MAX INT_MAX
@@ -85,6 +93,7 @@ typedef struct {
              *attrs,        // Dict of attributes for this type
              *type_name,    // String object of object type name
              *pickle,       // Dict of pickled attributes.
+             *decoded,      // Dict of values decoded from an indexed pickle
              *keys,         // Available attribute names
              *parent;       // Tuple (parent_name, parent_id)
     QueryInfo *query_info;
@@ -266,6 +275,7 @@ void ObjectRow_PyObject__dealloc(ObjectRow_PyObject *self)
     Py_XDECREF(self->desc);
     Py_XDECREF(self->row);
     Py_XDECREF(self->pickle);
+    Py_XDECREF(self->decoded);
     Py_XDECREF(self->attrs);
     Py_XDECREF(self->keys);
     Py_XDECREF(self->parent);
@@ -273,19 +283,109 @@ void ObjectRow_PyObject__dealloc(ObjectRow_PyObject *self)
     self->ob_type->tp_free((PyObject*)self);
 }
 
+static inline unsigned long
+read_uint(const unsigned char *p, int size)
+{
+    // Little endian integer of the given size in bytes.
+    unsigned long value = 0;
+    while (size--)
+        value = (value << 8) | p[size];
+    return value;
+}
+
+static const unsigned char *
+get_indexed_pickle(ObjectRow_PyObject *self, Py_ssize_t *len)
+{
+    /* Returns a pointer to the data of the pickle column if it is in the
+     * indexed format, or NULL otherwise.  The data is not copied, it is only
+     * valid as long as the row is.
+     */
+    const void *buf;
+    PyObject *o = PySequence_Fast_GET_ITEM(self->row, self->query_info->pickle_idx);
+    if (PyObject_AsReadBuffer(o, &buf, len) < 0) {
+        PyErr_Clear();
+        return NULL;
+    }
+    if (*len < PICKLE_HEADER_LEN || memcmp(buf, PICKLE_MAGIC, PICKLE_MAGIC_LEN))
+        return NULL;
+    return (const unsigned char *)buf;
+}
+
+int unpickle_indexed(ObjectRow_PyObject *self, const unsigned char *buf, Py_ssize_t len,
+                     const char *key, PyObject *dict)
+{
+    /* Decodes values from an indexed pickle into dict.  If key is given, only
+     * the value for that key is unpickled (if it exists), otherwise all values
+     * are.  Returns 0 on error with an exception set, and 1 otherwise.
+     */
+    struct module_state *mstate = GETSTATE(self);
+    Py_ssize_t count = read_uint(buf + 4, 4),
+               data = PICKLE_HEADER_LEN + read_uint(buf + 8, 4),
+               pos = PICKLE_HEADER_LEN,
+               key_len = key ? strlen(key) : 0,
+               i, klen, offset, vlen;
+
+    if (data > len)
+        goto corrupt;
+
+    for (i = 0; i < count; i++, pos += 10 + klen) {
+        PyObject *pickle_str, *o_key, *value;
+        if (pos + 2 > data)
+            goto corrupt;
+        klen = read_uint(buf + pos, 2);
+        if (pos + 10 + klen > data)
+            goto corrupt;
+        if (key && (klen != key_len || memcmp(buf + pos + 2, key, klen)))
+            continue;
+
+        offset = read_uint(buf + pos + 2 + klen, 4);
+        vlen = read_uint(buf + pos + 6 + klen, 4);
+        if (data + offset + vlen > len)
+            goto corrupt;
+
+        // Only the pickled value itself gets copied for unpickling.
+        pickle_str = PyString_FromStringAndSize((const char *)buf + data + offset, vlen);
+        if (!pickle_str)
+            return 0;
+        value = PyObject_CallFunctionObjArgs(mstate->pickle_loads, pickle_str, NULL);
+        Py_DECREF(pickle_str);
+        if (!value)
+            return 0;
+        o_key = PyString_FromStringAndSize((const char *)buf + pos + 2, klen);
+        PyDict_SetItem(dict, o_key, value);
+        Py_DECREF(o_key);
+        Py_DECREF(value);
+        if (key)
+            break;
+    }
+    return 1;
+
+corrupt:
+    PyErr_Format(PyExc_ValueError, "Row pickle is corrupt");
+    return 0;
+}
+
 int do_unpickle(ObjectRow_PyObject *self)
 {
     PyObject *result;
+    const unsigned char *buf;
+    Py_ssize_t len;
     if (!self->has_pickle) {
         PyErr_Format(PyExc_KeyError, "Attribute exists but row pickle is not available");
         return 0;
     }
     struct module_state *mstate = GETSTATE(self);
-    PyObject *pickle_str = PyObject_Str(PySequence_Fast_GET_ITEM(self->row, self->query_info->pickle_idx));
-    PyObject *args = Py_BuildValue("(O)", pickle_str);
-    result = PyEval_CallObject(mstate->pickle_loads, args);
-    Py_DECREF(args);
-    Py_DECREF(pickle_str);
+    if ((buf = get_indexed_pickle(self, &len)) != NULL) {
+        result = PyDict_New();
+        if (!unpickle_indexed(self, buf, len, NULL, result))
+            Py_CLEAR(result);
+    } else {
+        PyObject *pickle_str = PyObject_Str(PySequence_Fast_GET_ITEM(self->row, self->query_info->pickle_idx));
+        PyObject *args = Py_BuildValue("(O)", pickle_str);
+        result = PyEval_CallObject(mstate->pickle_loads, args);
+        Py_DECREF(args);
+        Py_DECREF(pickle_str);
+    }
 
     if (!result) {
         self->has_pickle = 0;
@@ -442,10 +542,6 @@ PyObject *ObjectRow_PyObject__subscript(ObjectRow_PyObject *self, PyObject *key)
          */
         return convert(self, attr, PySequence_Fast_GET_ITEM(self->row, attr->index));
 
-    // If we need to check the pickle but haven't unpickled, do so now.
-    if (!self->unpickled && !do_unpickle(self))
-        return NULL;
-
     if (IS_ATTR_INDEXED_IGNORE_CASE(attr->flags)) {
         // ATTR_INDEXED_IGNORE_CASE, these attributes are prefixed with __ in
         // the pickled dict.
@@ -453,6 +549,32 @@ PyObject *ObjectRow_PyObject__subscript(ObjectRow_PyObject *self, PyObject *key)
         skey = skey2;
     }
 
+    if (!self->unpickled) {
+        const unsigned char *buf;
+        Py_ssize_t len;
+        if (self->has_pickle && (buf = get_indexed_pickle(self, &len)) != NULL) {
+            /* Indexed pickle, so we only need to decode the value for this
+             * attribute.  Decoded values are kept for later accesses.
+             */
+            if (!self->decoded)
+                self->decoded = PyDict_New();
+            value = PyDict_GetItemString(self->decoded, skey);
+            if (!value) {
+                if (!unpickle_indexed(self, buf, len, skey, self->decoded))
+                    return NULL;
+                value = PyDict_GetItemString(self->decoded, skey);
+            }
+            if (!value)
+                // Attribute isn't stored in pickle, so return suitable default.
+                return get_default_for_attr(attr);
+            return convert(self, attr, value);
+        }
+
+        // If we need to check the pickle but haven't unpickled, do so now.
+        if (!do_unpickle(self))
+            return NULL;
+    }
+
     value = PyDict_GetItemString(self->pickle, skey);
     if (!value)
         // Attribute isn't stored in pickle, so return suitable default.
@@ -30,6 +30,9 @@
 #ifdef HAVE_PRCTL
 #include <sys/prctl.h>
 #endif
+#ifdef HAVE_EVENTFD
+#include <sys/eventfd.h>
+#endif
 
 /* Python 2.5 (all point releases) have a bug with listdir on POSIX systems.
  * We include the version from 2.6 here which is fixed.  See
@@ -69,6 +72,25 @@ PyObject *set_process_name(PyObject *self, PyObject *args)
 }
 
 
+#ifdef HAVE_EVENTFD
+/* Returns a new non-blocking eventfd, which is used to wake up the main loop
+ * instead of a pipe (see CoreThreading in core.py).
+ */
+PyObject *utils_eventfd(PyObject *self, PyObject *args)
+{
+    int fd;
+
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+
+    fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    if (fd == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+    return Py_BuildValue("i", fd);
+}
+#endif // HAVE_EVENTFD
+
+
 /* This code (until the #endif) stripped from Python 2.6
  * Modules/posixmodule.c:posix_listdir().  This code is therefore released
  * under the PSF (http://www.python.org/psf/license/) and copyrighted by
@@ -166,6 +188,9 @@ PyObject *listdir(PyObject *self, PyObject *args)
 
 PyMethodDef utils_methods[] = {
     {"set_process_name",  set_process_name, METH_VARARGS },
+#ifdef HAVE_EVENTFD
+    {"eventfd",  utils_eventfd, METH_VARARGS },
+#endif // HAVE_EVENTFD
 #if PY_VERSION_HEX < 0x02060000
     {"listdir",  listdir, METH_VARARGS },
 #endif // PY_VERSION_HEX < 0x02060000
@@ -35,8 +35,8 @@ import socket
 import logging
 import time
 import fcntl
-import cStringIO
 import re
+import collections
 
 from .utils import property
 from . import nf_wrapper as notifier
@@ -112,6 +112,128 @@ class WeakIOMonitor(notifier.WeakNotifierCallback, IOMonitor):
     pass
 
 
+def _find_delimiter(buf, delimiter, start=0):
+    """
+    Returns the position in buf after the first delimiter found from start,
+    or None.  Delimiter is a string or a list of strings.
+    """
+    if isinstance(delimiter, basestring):
+        idx = buf.find(delimiter, start)
+        return idx + len(delimiter) if idx >= 0 else None
+
+    # Delimiter is a list, so find any one of them.
+    m = re.compile('|'.join(delimiter)).search(buf, start)
+    return m.end() if m else None
+
+
+class _ReadQueue(object):
+    """
+    Data read from a channel and not consumed yet by read() or readline().
+
+    Data is appended to a bytearray and consumed from its front by advancing
+    an offset, so popping a line copies only the line itself.  The part of the
+    buffer already searched for a delimiter is remembered, so that a line
+    arriving in many chunks is not scanned from its start for each chunk.
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        # Start of the data not consumed yet.
+        self._pos = 0
+        # The delimiter last searched for, and the offset up to which it was
+        # not found.
+        self._delimiter = None
+        self._scanned = 0
+
+
+    def __len__(self):
+        return len(self._buf) - self._pos
+
+
+    def write(self, data):
+        self._buf += data
+
+
+    def getvalue(self):
+        return str(buffer(self._buf, self._pos))
+
+
+    def clear(self):
+        self._buf = bytearray()
+        self._pos = self._scanned = 0
+
+
+    def pop(self):
+        """
+        Removes and returns all data.
+        """
+        data = self.getvalue()
+        self.clear()
+        return data
+
+
+    def find(self, delimiter):
+        """
+        Returns the offset in the buffer after the first delimiter, or None if
+        there is none.  Delimiter is a string or a list of strings.
+        """
+        if delimiter != self._delimiter:
+            self._delimiter = delimiter
+            self._scanned = self._pos
+        # A delimiter may have been split between the data searched before
+        # and the data added since.
+        overlap = len(delimiter) if isinstance(delimiter, basestring) else max(len(d) for d in delimiter)
+        idx = _find_delimiter(self._buf, delimiter, max(self._pos, self._scanned - overlap + 1))
+        self._scanned = len(self._buf) if idx is None else idx
+        return idx
+
+
+    def popline(self, delimiter):
+        """
+        Removes and returns data up to and including the first delimiter, or
+        returns None if there is no delimiter.
+        """
+        idx = self.find(delimiter)
+        if idx is None:
+            return None
+        line = str(buffer(self._buf, self._pos, idx - self._pos))
+        self._pos = idx
+        if self._pos == len(self._buf):
+            self.clear()
+        elif self._pos > len(self._buf) / 2:
+            # Most of the buffer is consumed, drop that part.
+            del self._buf[:self._pos]
+            self._scanned -= self._pos
+            self._pos = 0
+        return line
+
+
+    def poplines(self, delimiter):
+        """
+        Removes and returns a list of all lines, including their delimiter.
+        Data after the last delimiter is kept.
+        """
+        idx = self.find(delimiter)
+        if idx is None:
+            return []
+        # Splitting a copy of the data is faster than popping the lines one
+        # by one.
+        data = self.getvalue()
+        idx -= self._pos
+        lines, last = [], 0
+        while idx is not None:
+            lines.append(data[last:idx])
+            last = idx
+            idx = _find_delimiter(data, delimiter, last)
+        if last == len(data):
+            self.clear()
+        else:
+            del self._buf[:self._pos + last]
+            self._pos = 0
+            self._scanned = len(self._buf)
+        return lines
+
+
+
 class IOChannel(Object):
     """
     Base class for read-only, write-only or read-write descriptors such as
@@ -222,9 +344,13 @@ class IOChannel(Object):
     def __init__(self, channel=None, mode=IO_READ|IO_WRITE, chunk_size=1024*1024, delimiter='\n'):
         super(IOChannel, self).__init__()
         self._delimiter = delimiter
-        self._write_queue = []
+        # Items are [data, inprogress] lists; data becomes a buffer of the
+        # remaining data if only part of it was written.
+        self._write_queue = collections.deque()
+        # Number of bytes in the write queue.
+        self._write_queue_used = 0
         # Read queue used for read() and readline(), and 'readline' signal.
-        self._read_queue = cStringIO.StringIO()
+        self._read_queue = _ReadQueue()
         # Number of bytes each queue (read and write) are limited to.
         self._queue_size = 1024*1024
         self._chunk_size = chunk_size
@@ -278,7 +404,7 @@ class IOChannel(Object):
         that read() call may return None, in which case the readable property
         will subsequently be False).
         """
-        return self._channel != None or self._read_queue.tell() > 0
+        return self._channel != None or len(self._read_queue) > 0
 
 
     @property
@@ -347,9 +473,7 @@ class IOChannel(Object):
         """
         The number of bytes queued in memory to be written to the channel.
         """
-        # XXX: this is not terribly efficient when the write queue has
-        # many elements.  We may decide to keep a separate counter.
-        return sum(len(data) for data, inprogress in self._write_queue)
+        return self._write_queue_used
 
 
     @property
@@ -360,7 +484,7 @@ class IOChannel(Object):
         The read queue is only used if either readline() or the readline signal
         is.
         """
-        return self._read_queue.tell()
+        return len(self._read_queue)
 
     @property
     def delimiter(self):
@@ -491,41 +615,6 @@ class IOChannel(Object):
         #main.signals['shutdown'].connect_weak(self.close)
 
 
-    def _clear_read_queue(self):
-        self._read_queue.seek(0)
-        self._read_queue.truncate()
-
-
-    def _find_delim(self, buf, start=0):
-        """
-        Returns the position in the buffer where the first delimiter is found.
-        The index position includes the delimiter.  If the delimiter is not
-        found, None is returned.
-        """
-        if isinstance(self._delimiter, basestring):
-            idx = buf.find(self._delimiter, start)
-            return idx + len(self._delimiter) if idx >= 0 else None
-
-        # Delimiter is a list, so find any one of them.
-        m = re.compile('|'.join(self._delimiter)).search(buf, start)
-        return m.end() if m else None
-
-
-    def _pop_line_from_read_queue(self):
-        """
-        Pops a line (plus delimiter) from the read queue.  If the delimiter
-        is not found in the queue, returns None.
-        """
-        s = self._read_queue.getvalue()
-        idx = self._find_delim(s)
-        if idx is None:
-            return
- 
-        self._clear_read_queue()
-        self._read_queue.write(s[idx:])
-        return s[:idx]
-
-
     def _async_read(self, signal):
         """
         Common implementation for read() and readline().
@@ -570,10 +659,8 @@ class IOChannel(Object):
                  data = yield process.read()
 
         """
-        if self._read_queue.tell() > 0:
-            s = self._read_queue.getvalue()
-            self._clear_read_queue()
-            return InProgress().finish(s)
+        if len(self._read_queue) > 0:
+            return InProgress().finish(self._read_queue.pop())
 
         return self._async_read(self._read_signal)
 
@@ -606,7 +693,7 @@ class IOChannel(Object):
             # not supported.  It's unclear how to behave in this case.
             raise RuntimeError('Callback currently connected to readline signal')
 
-        line = self._pop_line_from_read_queue()
+        line = self._read_queue.popline(self._delimiter)
         if line:
             return InProgress().finish(line)
         return self._async_read(self._readline_signal)
@@ -659,24 +746,10 @@ class IOChannel(Object):
         if self._is_readline_connected():
             if len(self._readline_signal) == 0:
                 # Callback is connected to the 'readline' signal, so loop
-                # through read queue and emit all lines individually.
-                queue = self._read_queue.getvalue() + data
-                self._clear_read_queue()
-
-                lines, last, idx = [], 0, self._find_delim(queue)
-                while True:
-                    # If idx is None, it will slice to the end.
-                    lines.append(queue[last:idx])
-                    if idx is None:
-                        break
-                    last = idx
-                    idx = self._find_delim(queue, last)
-
-                if self._find_delim(lines[-1]) is None:
-                    # Queue did not end with delimiter, so push the remainder back.
-                    self._read_queue.write(lines.pop())
-
-                for line in lines:
+                # through read queue and emit all lines individually.  The
+                # remainder without delimiter stays in the queue.
+                self._read_queue.write(data)
+                for line in self._read_queue.poplines(self._delimiter):
                     self.signals['readline'].emit(line)
 
             else:
@@ -688,12 +761,11 @@ class IOChannel(Object):
                     # it over with this chunk.
                     # TODO: it's possible this chunk contains the delimiter we've
                     # been waiting for.  If so, we could salvage things.
-                    line = self._read_queue.getvalue()
-                    self._clear_read_queue()
+                    line = self._read_queue.pop()
                     self._read_queue.write(data)
                 else:
                     self._read_queue.write(data)
-                    line = self._pop_line_from_read_queue()
+                    line = self._read_queue.popline(self._delimiter)
 
                 if line is not None:
                     self._readline_signal.emit(line)
@@ -746,17 +818,37 @@ class IOChannel(Object):
             raise IOError(9, 'Channel is not writable')
         if self.write_queue_used + len(data) > self._queue_size:
             raise ValueError('Data would exceed write queue limit')
+        return self._queue_write(data)
 
+
+    def _queue_write(self, data):
+        """
+        Appends data to the write queue and returns the InProgress for it.
+        Data is a string, or a callable writing the data itself when the
+        channel is writable (see _handle_write) whose len() is counted
+        against the queue limit, and whose started attribute is True once
+        it wrote anything.
+
+        Queue items are 3-lists [data, inprogress, started], where started
+        is True once part of the data is written.  Such writes can't be
+        aborted anymore.
+        """
         inprogress = InProgress()
-        if data:
+        if callable(data) or data:
+            item = [data, inprogress, False]
             def abort(exc):
+                if item[2]:
+                    # Part of the data is written already.
+                    return False
                 try:
-                    self._write_queue.remove((data, inprogress))
+                    self._write_queue.remove(item)
                 except ValueError:
                     # Too late to abort.
                     return False
+                self._write_queue_used -= len(item[0])
             inprogress.signals['abort'].connect(abort)
-            self._write_queue.append((data, inprogress))
+            self._write_queue.append(item)
+            self._write_queue_used += len(data)
             if self._channel and self._wmon and not self._wmon.active:
                 self._wmon.register(self.fileno, IO_WRITE)
         else:
@@ -772,27 +864,59 @@ class IOChannel(Object):
         registered then the write queue is empty, so we only get called when
         there is something to write.
         """
-        if not self._write_queue:
+        queue = self._write_queue
+        if not queue:
             # Can happen if a write was aborted.
             return
 
         try:
-            while self._write_queue:
-                data, inprogress = self._write_queue.pop(0)
-                sent = self._write(data)
+            while queue:
+                data = queue[0][0]
+                if callable(data):
+                    # The item writes its data itself (see Socket.sendfile)
+                    # and returns the number of bytes it wrote once it is
+                    # done, or None to be called again.  Its started
+                    # attribute tells if it wrote anything yet.
+                    sent = data()
+                    if sent is None:
+                        queue[0][2] = data.started
+                        break
+                    queue.popleft()[1].finish(sent)
+                    continue
+                if len(data) < self._chunk_size and len(queue) > 1:
+                    # Small writes are sent together with the following ones
+                    # with a single system call.
+                    parts, size = [], 0
+                    for item in queue:
+                        if callable(item[0]) or (size + len(item[0]) > self._chunk_size and parts):
+                            break
+                        parts.append(str(item[0]))
+                        size += len(item[0])
+                    data = ''.join(parts)
+                sent = max(self._write(data), 0)
                 log.debug2('IOChannel write data: channel=%s fd=%s len=%d (of %d)', 
                            self._channel, self.fileno, sent, len(data))
+                self._write_queue_used -= sent
+                # Remove all data written now from the queue before finishing
+                # their InProgress with the number of their bytes sent by this
+                # write, as callbacks may write or abort other writes.
+                left = sent
+                done = []
+                while left and left >= len(queue[0][0]):
+                    item = queue.popleft()
+                    left -= len(item[0])
+                    done.append(item)
+                if left:
+                    # Not all data was able to be sent; keep a view on the
+                    # remaining data, which doesn't copy it.
+                    queue[0][0] = buffer(queue[0][0], left)
+                    queue[0][2] = True
+                for item in done:
+                    item[1].finish(len(item[0]))
                 if sent != len(data):
-                    # Not all data was able to be sent; push remaining data
-                    # back onto the write buffer.
-                    self._write_queue.insert(0, (data[(sent if sent >= 0 else 0):], inprogress))
                     break
-                else:
-                    # All data is written, finish the InProgress associated
-                    # with this write.
-                    inprogress.finish(sent)
 
-            if not self._write_queue:
+            if not queue:
                 if self._queue_close:
                     return self.close(immediate=True)
                 self._wmon.unregister()
@@ -805,10 +929,14 @@ class IOChannel(Object):
                 # (mainloop will keep calling us back) we sleep a tiny
                 # bit.  It's admittedly a bit kludgy, but it's a simple
                 # solution to a condition which should not occur often.
-                self._write_queue.insert(0, (data, inprogress))
                 time.sleep(0.001)
                 return
 
+            if not queue:
+                raise
+            # The write failed for the data at the head of the queue.
+            data, inprogress = queue.popleft()[:2]
+            self._write_queue_used -= len(data)
             if tp in (IOError, socket.error, OSError):
                 # Any of these are treated as fatal.  We close, which
                 # also throws to any other pending InProgress writes.
@@ -869,18 +997,18 @@ class IOChannel(Object):
 
         # Finish any InProgress waiting on read() or readline() with whatever
         # is left in the read queue.
-        s = self._read_queue.getvalue()
+        s = self._read_queue.pop()
         self._read_signal.emit(s)
         self._readline_signal.emit(s)
-        self._clear_read_queue()
 
         # Throw IOError to any pending InProgress in the write queue
-        for data, inprogress in self._write_queue:
+        for data, inprogress, started in self._write_queue:
             if len(inprogress):
                 # Somebody cares about this InProgress, so we need to finish
                 # it.
                 inprogress.throw(IOError, IOError(9, 'Channel closed prematurely'), None)
-        del self._write_queue[:]
+        self._write_queue.clear()
+        self._write_queue_used = 0
 
         try:
             self._close()
@@ -925,6 +1053,7 @@ class IOChannel(Object):
         """
         self._delimiter = channel.delimiter
         self._write_queue = channel._write_queue
+        self._write_queue_used = channel._write_queue_used
         self._read_queue = channel._read_queue
         self._queue_size = channel._queue_size
         self._chunk_size = channel._chunk_size
@@ -933,8 +1062,9 @@ class IOChannel(Object):
         self.wrap(channel, channel.mode)
         # Generate new queues on the channel object whose fd we are stealing, since
         # we stole its queues too.
-        channel._write_queue = []
-        channel._read_queue = cStringIO.StringIO()
+        channel._write_queue = collections.deque()
+        channel._write_queue_used = 0
+        channel._read_queue = _ReadQueue()
         channel._channel = None
 
         def clone(src, dst):
@@ -92,6 +92,9 @@ def init(module=None, reset=False, **options):
 
     :param module: the main loop implementation to use.
                    ``generic``: Native python-based main loop (default),
+                   ``epoll``: like generic, but using epoll for sockets and a
+                              heap for timers, which scales better with many
+                              of them (Linux only);
                    ``gtk``: use pygtk's main loop (automatically selected if
                             the gtk module is imported);
                    ``twisted``: Twisted main loop;
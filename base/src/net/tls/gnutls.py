@@ -42,6 +42,7 @@ import sys
 import os
 import socket
 import logging
+import collections
 import kaa
 
 from .common import TLSSocketBase
@@ -139,7 +140,7 @@ class GNUTLSSocket(TLSSocketBase):
         self._handshake = True
         # Store current write queue and create a new one
         self._pre_handshake_write_queue = self._write_queue
-        self._write_queue = []
+        self._write_queue = collections.deque()
         if self._pre_handshake_write_queue:
             # flush pre handshake write data
             yield self._pre_handshake_write_queue[-1][1]
@@ -177,6 +177,23 @@ class M2TLSSocket(TLSSocketBase):
             raise TLSProtocolError(e.args[0])
 
 
+    def _can_sendfile(self):
+        # Once TLS is started, file data must be encrypted before it is sent.
+        return not self._tls_started and super(M2TLSSocket, self)._can_sendfile()
+
+
+    def _sendfile_data(self, data):
+        # Encrypts data read from a file by sendfile(), which stays a single
+        # item in the write queue, so later writes are sent after the file.
+        if not self._tls_started:
+            return data
+        self._buf_plaintext.append(data)
+        try:
+            return self._encrypt()
+        except M2Crypto.BIO.BIOError, e:
+            raise TLSProtocolError(e.args[0])
+
+
     def _check(self):
         if self._validated or not m2.ssl_is_init_finished(self._ssl.obj):
             return
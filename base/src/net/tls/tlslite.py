@@ -32,6 +32,7 @@
 # python imports
 from __future__ import absolute_import
 import logging
+import collections
 import os
 try:
     import tlslite.api as tlsapi
@@ -168,7 +169,7 @@ class TLSLiteSocket(TLSSocketBase):
         self._handshake = True
         # Store current write queue and create a new one
         self._pre_handshake_write_queue = self._write_queue
-        self._write_queue = []
+        self._write_queue = collections.deque()
         if self._pre_handshake_write_queue:
             # flush pre handshake write data
             yield self._pre_handshake_write_queue[-1][1]
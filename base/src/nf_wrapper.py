@@ -30,6 +30,7 @@ from __future__ import absolute_import
 # Python imports
 import logging
 import sys
+import select
 import atexit
 
 # notifier import
@@ -153,8 +154,8 @@ def init( module = None, force_internal=False, **options ):
         options['recursive_depth'] = 5
 
     try:
-        if force_internal:
-            # pynotifier is not allowed
+        if force_internal or module == 'epoll':
+            # pynotifier is not allowed (or has no epoll notifier)
             raise ImportError()
         import notifier
         if notifier.loop:
@@ -172,9 +173,13 @@ def init( module = None, force_internal=False, **options ):
             module = 'gtk'
             log.info('Implicitly using gtk integration for the notifier')
 
-    if not module in ('generic', 'gtk', 'twisted_experimental'):
+    if not module in ('generic', 'epoll', 'gtk', 'twisted_experimental'):
         raise AttributeError('unsupported notifier %s' % module)
 
+    if module == 'epoll' and not hasattr(select, 'epoll'):
+        log.warning('epoll is not available, using the generic notifier')
+        module = 'generic'
+
     if module == 'twisted_experimental':
         module = 'twisted'
 
@@ -0,0 +1,352 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# profiler.py - Find callbacks that block the main loop
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# -----------------------------------------------------------------------------
+# kaa.base - The Kaa Application Framework
+# Copyright 2005-2009 Dirk Meyer, Jason Tackaberry, et al.
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+#
+# -----------------------------------------------------------------------------
+
+"""
+Find callbacks that block the main loop
+
+While enabled, the time the main thread spends in timer and IOMonitor
+callbacks, coroutine steps, signal callbacks and main loop steps is recorded
+per callback, and callbacks taking longer than a threshold are logged with
+their source location::
+
+    import kaa.profiler
+    kaa.profiler.enable(threshold=0.05, dump='/tmp/kaa-profile.txt')
+
+The profiler is off by default and costs nothing then.  enable() replaces the
+methods doing the dispatching with timed versions, and disable() puts the
+originals back.
+"""
+from __future__ import absolute_import
+
+__all__ = [ 'enable', 'disable', 'is_enabled', 'snapshot', 'dump', 'HISTOGRAM' ]
+
+# python imports
+import sys
+import time
+import bisect
+import logging
+import threading
+import functools
+
+from . import nf_wrapper as notifier
+from .core import Signal, CoreThreading
+from .callable import Callable, CallableError
+from .coroutine import CoroutineInProgress
+from .io import IOMonitor
+from .timer import Timer
+
+# get logging object
+log = logging.getLogger('base.profiler')
+
+#: Upper bounds in seconds of the buckets of the time histograms.
+HISTOGRAM = (0.001, 0.01, 0.05, 0.1, 0.5, 1)
+
+_enabled = False
+# Callbacks taking at least that many seconds are logged; None logs nothing.
+_threshold = None
+# (kind, location) -> [ count, total, max, histogram ]
+_stats = {}
+# code object -> location string
+_locations = {}
+# One [ logged, start ] list for each callback or step being timed in the main
+# thread, innermost last.  logged is set once a callback in it was logged, so
+# only the innermost slow callback is.  A step's start is the time its first
+# callback was started.
+_stack = []
+# Methods replaced by enable()
+_originals = {}
+_dump_timer = None
+
+
+def _code(func):
+    """
+    Returns the code object of the function behind func, or its name if it
+    isn't Python code.
+    """
+    while True:
+        if isinstance(func, Callable):
+            func = func._get_func()
+        elif isinstance(func, functools.partial):
+            func = func.func
+        elif hasattr(func, 'im_func'):
+            func = func.im_func
+        elif hasattr(func, 'func_code'):
+            return func.func_code
+        elif hasattr(getattr(func, '__call__', None), 'im_func'):
+            # instance of a class with __call__
+            func = func.__call__
+        else:
+            return '<%s>' % getattr(func, '__name__', type(func).__name__)
+
+
+def _location(code):
+    if isinstance(code, basestring):
+        return code
+    try:
+        return _locations[code]
+    except KeyError:
+        location = _locations[code] = '%s:%d %s()' % (code.co_filename, code.co_firstlineno, code.co_name)
+        return location
+
+
+def _record(kind, code, elapsed, frame, detail=''):
+    key = kind, _location(code)
+    stats = _stats.get(key)
+    if stats is None:
+        stats = _stats[key] = [ 0, 0.0, 0.0, [0] * (len(HISTOGRAM) + 1) ]
+    stats[0] += 1
+    stats[1] += elapsed
+    if elapsed > stats[2]:
+        stats[2] = elapsed
+    stats[3][bisect.bisect_left(HISTOGRAM, elapsed)] += 1
+    if frame[0] or _threshold is None or elapsed < _threshold:
+        if frame[0] and _stack:
+            _stack[-1][0] = True
+        return
+    log.warning('%s took %.1fms: %s%s', kind, elapsed * 1000, key[1], detail)
+    if _stack:
+        _stack[-1][0] = True
+
+
+def _timed(kind, code, func, *args, **kwargs):
+    """
+    Calls func with the given arguments, recording the time it takes for the
+    callback code.
+    """
+    if not _enabled or threading.currentThread() is not CoreThreading._mainthread:
+        return func(*args, **kwargs)
+    t0 = time.time()
+    frame = [ False, t0 ]
+    if _stack and _stack[-1][1] is None:
+        # first callback of a step
+        _stack[-1][1] = t0
+    _stack.append(frame)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _stack.pop()
+        _record(kind, code, time.time() - t0, frame)
+
+
+def _step(*args, **kwargs):
+    """
+    Replaces the notifier's step().  Its time is counted from the start of the
+    first callback, the time spent waiting for something to do before isn't
+    interesting.
+    """
+    step = _originals['step']
+    if not _enabled or threading.currentThread() is not CoreThreading._mainthread:
+        return step(*args, **kwargs)
+    frame = [ False, None ]
+    _stack.append(frame)
+    try:
+        return step(*args, **kwargs)
+    finally:
+        _stack.pop()
+        if frame[1] is not None:
+            _record('step', 'main loop', time.time() - frame[1], frame)
+
+
+def _notifier_call(self, *args, **kwargs):
+    """
+    Replaces NotifierCallback.__call__, which is how timers and IOMonitors are
+    invoked by the notifier.
+    """
+    kind = 'io' if isinstance(self, IOMonitor) else 'timer' if isinstance(self, Timer) else 'notifier'
+    return _timed(kind, _code(self), _originals['notifier'], self, *args, **kwargs)
+
+
+def _coroutine_step(self, *args):
+    """
+    Replaces CoroutineInProgress._step.
+    """
+    step = _originals['coroutine']
+    coroutine = self._coroutine
+    if not _enabled or threading.currentThread() is not CoreThreading._mainthread or \
+       not hasattr(coroutine, 'gi_frame') or coroutine.gi_frame is None:
+        return step(self, *args)
+    # Remember the line the coroutine resumes at, which is more interesting
+    # than the function for long coroutines.
+    line = coroutine.gi_frame.f_lineno
+    t0 = time.time()
+    frame = [ False, t0 ]
+    if _stack and _stack[-1][1] is None:
+        _stack[-1][1] = t0
+    _stack.append(frame)
+    try:
+        return step(self, *args)
+    finally:
+        _stack.pop()
+        _record('coroutine', coroutine.gi_code, time.time() - t0, frame, ' (resumed at line %d)' % line)
+
+
+def _emit(self, *args, **kwargs):
+    """
+    Replaces Signal.emit, timing each callback.  Must do what Signal.emit
+    does.
+    """
+    if not _enabled or threading.currentThread() is not CoreThreading._mainthread:
+        return _originals['emit'](self, *args, **kwargs)
+    if len(self._callbacks) == 0:
+        return True
+
+    retval = True
+    for cb in self._callbacks[:]:
+        if cb._signal_once:
+            self.disconnect(cb)
+
+        try:
+            if _timed('signal', _code(cb), cb, *args, **kwargs) == False:
+                retval = False
+        except CallableError:
+            if self._disconnect(cb, (), {}) != False:
+                raise
+        except Exception, e:
+            log.exception('Exception while emitting signal')
+    return retval
+
+
+def _dump_periodically(filename):
+    try:
+        dump(filename)
+    except IOError, e:
+        log.error('Unable to write profile to %s: %s', filename, e)
+    return True
+
+
+def enable(threshold=0.1, dump=None, interval=60):
+    """
+    Starts recording the time spent in main loop callbacks.
+
+    :param threshold: callbacks taking at least that many seconds are logged
+                      as a warning, or None to log nothing
+    :type threshold: float
+    :param dump: name of a file a report (see :func:`dump`) is written to
+                 every interval seconds
+    :type dump: str
+    :param interval: seconds between the reports written to dump
+
+    The notifier is initialized if it isn't yet, so when using a notifier
+    other than the default one, call :func:`kaa.main.init` before.  Coroutines
+    started before the profiler was enabled are not profiled.
+    """
+    global _enabled, _threshold, _dump_timer
+    _threshold = threshold
+    if _dump_timer:
+        _dump_timer.stop()
+        _dump_timer = None
+    if dump:
+        _dump_timer = Timer(_dump_periodically, dump)
+        _dump_timer.start(interval)
+    if _enabled:
+        return
+    if not notifier.loaded:
+        notifier.init()
+    # Timers and signals can have the replacements as callbacks, report them
+    # as the originals.
+    for replacement, original in ((_emit, Signal.emit), (_coroutine_step, CoroutineInProgress._step)):
+        _locations[replacement.func_code] = _location(_code(original))
+    _originals.update(step=notifier.step, notifier=notifier.NotifierCallback.__call__,
+                      coroutine=CoroutineInProgress._step, emit=Signal.emit)
+    notifier.step = _step
+    notifier.NotifierCallback.__call__ = _notifier_call
+    CoroutineInProgress._step = _coroutine_step
+    Signal.emit = _emit
+    _enabled = True
+
+
+def disable():
+    """
+    Stops recording.  The statistics are kept.
+    """
+    global _enabled, _dump_timer
+    if _dump_timer:
+        _dump_timer.stop()
+        _dump_timer = None
+    if not _enabled:
+        return
+    notifier.step = _originals['step']
+    notifier.NotifierCallback.__call__ = _originals['notifier']
+    CoroutineInProgress._step = _originals['coroutine']
+    Signal.emit = _originals['emit']
+    _enabled = False
+
+
+def is_enabled():
+    """
+    Return True if the profiler is recording.
+    """
+    return _enabled
+
+
+def snapshot(reset=False):
+    """
+    Return the statistics recorded so far.
+
+    :param reset: if True, the statistics are cleared afterwards
+    :returns: dict mapping (kind, location) tuples to dicts with the keys
+              ``count``, ``total``, ``avg`` and ``max`` (seconds), and
+              ``histogram``, a list of (bound, count) tuples like
+              :attr:`kaa.ThreadPool.stats` has.
+
+    The kind is one of ``timer``, ``io``, ``coroutine``, ``signal`` and
+    ``step``, and the location is the file, line number and name of the
+    callback's function, or ``main loop`` for steps.  Times include those of
+    nested callbacks, for example a timer includes the coroutine step it does.
+    """
+    stats = _stats.items()
+    if reset:
+        _stats.clear()
+    result = {}
+    for key, (count, total, longest, histogram) in stats:
+        result[key] = dict(count=count, total=total, avg=total / count, max=longest,
+                           histogram=zip(HISTOGRAM + (None,), histogram))
+    return result
+
+
+def dump(file=sys.stderr, reset=False):
+    """
+    Writes the statistics as a table, most time consuming callbacks first.
+
+    :param file: file name or file object
+    :param reset: if True, the statistics are cleared afterwards
+    """
+    stats = sorted(snapshot(reset).items(), key=lambda (key, stats): -stats['total'])
+    lines = [ 'kaa.profiler report, %s' % time.strftime('%Y-%m-%d %H:%M:%S') ]
+    buckets = [ '<%gms' % (bound * 1000) for bound in HISTOGRAM ] + [ 'more' ]
+    lines.append('%-9s %8s %10s %8s %8s %s  %s' % ('kind', 'count', 'total/ms', 'avg/ms', 'max/ms',
+                 ''.join('%8s' % bucket for bucket in buckets), 'location'))
+    for (kind, location), s in stats:
+        lines.append('%-9s %8d %10.1f %8.2f %8.1f %s  %s' % (kind, s['count'], s['total'] * 1000,
+                     s['avg'] * 1000, s['max'] * 1000, ''.join('%8d' % count for bound, count in s['histogram']),
+                     location))
+    report = '\n'.join(lines) + '\n'
+    if isinstance(file, basestring):
+        open(file, 'w').write(report)
+    else:
+        file.write(report)
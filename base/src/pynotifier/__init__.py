@@ -44,7 +44,7 @@ loop = None
 step = None
 
 # notifier types
-( GENERIC, QT, GTK, WX, TWISTED ) = range( 5 )
+( GENERIC, QT, GTK, WX, TWISTED, EPOLL ) = range( 6 )
 
 # socket conditions
 IO_READ = None
@@ -70,6 +70,8 @@ def init( model = GENERIC, **kwargs ):
 	elif model == WX:
 		from . import nf_wx as nf_impl
 		log.warn( 'the WX notifier is deprecated and is no longer maintained' )
+	elif model == EPOLL:
+		from . import nf_epoll as nf_impl
 	elif model == TWISTED:
 		from . import nf_twisted as nf_impl
 		log.info("using nf_twisted")
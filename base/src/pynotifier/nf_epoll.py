@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# epoll notifier implementation
+#
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version
+# 2.1 as published by the Free Software Foundation.
+#
+# This library is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301 USA
+
+#
+# Behaves like nf_generic, with two differences in how the work is done:
+#
+#     1. Sockets are registered with an epoll object when they are added
+#        (and modified or unregistered when they are removed), instead of
+#        passing all of them to select() on each step.
+#     2. Timers are kept in a heap of (timestamp, id) tuples in addition to
+#        the __timers dict, so finding the next timer to expire doesn't
+#        need to look at every timer.  Removing a timer only deletes it from
+#        __timers; its heap entry is discarded once it comes up.  An entry
+#        is also stale if its timestamp isn't the one of the timer anymore.
+#
+
+"""Mainloop that watches sockets with epoll and keeps timers in a heap."""
+from __future__ import absolute_import
+
+# python core packages
+from heapq import heappush, heappop, heapify
+from time import time, sleep as time_sleep
+import select
+import errno
+
+# internal packages
+from . import log
+from . import dispatch
+
+IO_READ = 1
+IO_WRITE = 2
+IO_EXCEPT = 4
+( INTERVAL, TIMESTAMP, CALLBACK ) = range( 3 )
+
+# epoll events for the conditions, and the events reported for a condition.
+# Like select(), report errors and hangups as readable and writable.
+_EVENTS = {
+	IO_READ : select.EPOLLIN,
+	IO_WRITE : select.EPOLLOUT,
+	IO_EXCEPT : select.EPOLLPRI,
+}
+_READY = (
+	( IO_READ, select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP ),
+	( IO_WRITE, select.EPOLLOUT | select.EPOLLERR | select.EPOLLHUP ),
+	( IO_EXCEPT, select.EPOLLPRI ),
+)
+
+# condition -> { id: ( fd, method ) }
+__sockets = {}
+__sockets[ IO_READ ] = {}
+__sockets[ IO_WRITE ] = {}
+__sockets[ IO_EXCEPT ] = {}
+# condition -> { fd: id }
+__fds = {}
+__fds[ IO_READ ] = {}
+__fds[ IO_WRITE ] = {}
+__fds[ IO_EXCEPT ] = {}
+# fd -> events registered with __epoll
+__registered = {}
+# fds epoll doesn't support (regular files), which are always ready
+__always_ready = set()
+__epoll = None
+__timers = {}
+__timer_heap = []
+__timer_id = 0
+__min_timer = None
+__in_step = False
+__step_depth = 0
+__step_depth_max = 0
+
+_options = {
+	'recursive_depth' : 2,
+}
+
+def _fileno( id ):
+	if isinstance( id, int ):
+		return id
+	return id.fileno()
+
+def _update( fd, added = False ):
+	"""Registers the events of all conditions fd was added for with epoll.
+	If added is True, fd was just added, and may be a new file that got the
+	number of one that was closed without being removed, which drops it
+	from the epoll set."""
+	events = 0
+	for condition, fds in __fds.items():
+		if fd in fds:
+			events |= _EVENTS[ condition ]
+	if fd in __always_ready:
+		if not events:
+			__always_ready.discard( fd )
+		return
+	try:
+		if not events:
+			if __registered.pop( fd, None ) is not None:
+				__epoll.unregister( fd )
+		elif added or __registered.get( fd ) != events:
+			try:
+				__epoll.register( fd, events )
+			except IOError, e:
+				if e.errno != errno.EEXIST:
+					raise
+				__epoll.modify( fd, events )
+			__registered[ fd ] = events
+	except IOError, e:
+		if e.errno == errno.EPERM:
+			# Regular files can't be used with epoll, but are always ready
+			# for select().
+			__registered.pop( fd, None )
+			__always_ready.add( fd )
+		elif e.errno not in ( errno.EBADF, errno.ENOENT ):
+			raise
+
+def socket_add( id, method, condition = IO_READ ):
+	"""The first argument specifies a socket, the second argument has to be a
+	function that is called whenever there is data ready in the socket.
+	The callback function gets the socket back as only argument."""
+	fd = _fileno( id )
+	if id in __sockets[ condition ]:
+		socket_remove( id, condition )
+	__sockets[ condition ][ id ] = ( fd, method )
+	__fds[ condition ][ fd ] = id
+	_update( fd, True )
+
+def socket_remove( id, condition = IO_READ ):
+	"""Removes the given socket from scheduler. If no condition is specified the
+	default is IO_READ."""
+	if id in __sockets[ condition ]:
+		fd = __sockets[ condition ].pop( id )[ 0 ]
+		if __fds[ condition ].get( fd ) == id:
+			del __fds[ condition ][ fd ]
+		_update( fd )
+
+def timer_add( interval, method ):
+	"""The first argument specifies an interval in milliseconds, the second
+	argument a function. This is function is called after interval
+	seconds. If it returns true it's called again after interval
+	seconds, otherwise it is removed from the scheduler. The third
+	(optional) argument is a parameter given to the called
+	function. This function returns an unique identifer which can be
+	used to remove this timer"""
+	global __timer_id
+
+	try:
+		__timer_id += 1
+	except OverflowError:
+		__timer_id = 0
+
+	timestamp = int( time() * 1000 ) + interval
+	__timers[ __timer_id ] = [ interval, timestamp, method ]
+	heappush( __timer_heap, ( timestamp, __timer_id ) )
+
+	return __timer_id
+
+def timer_remove( id ):
+	"""Removes the timer identifed by the unique ID from the main loop."""
+	if id in __timers:
+		del __timers[ id ]
+
+def dispatcher_add( method ):
+	global __min_timer
+	__min_timer = dispatch.MIN_TIMER
+	dispatch.dispatcher_add( method )
+
+dispatcher_remove = dispatch.dispatcher_remove
+
+
+def step( sleep = True, external = True, simulate = False ):
+	"""Do one step forward in the main loop. First all timers are checked for
+	expiration and if necessary the accociated callback function is called.
+	After that the timer heap is searched for the next timer that will expire.
+	This will define the maximum timeout for the following epoll call
+	evaluating the registered sockets. Returning from the epoll call the
+	callback functions from the sockets reported by it are invoked. As a
+	final task in a notifier step all registered external dispatcher
+	functions are invoked."""
+
+	global __in_step, __step_depth, __step_depth_max
+
+	__in_step = True
+	__step_depth += 1
+
+	try:
+		if __step_depth > __step_depth_max:
+			log.exception( 'maximum recursion depth reached' )
+			return
+
+		if __step_depth == 1 and len( __timer_heap ) > 2 * len( __timers ) + 64:
+			# Mostly stale entries, rebuild the heap.  Not in a recursive
+			# step(), where timers being called are out of the heap.
+			__timer_heap[:] = [ ( timer[ TIMESTAMP ], i ) for i, timer in __timers.iteritems() ]
+			heapify( __timer_heap )
+
+		# get minInterval for max timeout
+		timeout = None
+		if not sleep or __always_ready:
+			timeout = 0
+		else:
+			while __timer_heap:
+				timestamp, i = __timer_heap[ 0 ]
+				timer = __timers.get( i )
+				if timer is None or timer[ TIMESTAMP ] != timestamp:
+					# stale entry
+					heappop( __timer_heap )
+					continue
+				timeout = max( timestamp - int( time() * 1000 ), 0 )
+				break
+			if timeout == None:
+				if dispatch.dispatcher_count():
+					timeout = dispatch.MIN_TIMER
+				else:
+					# No timers and no dispatchers, timeout could be infinity.
+					timeout = 30000
+			if __min_timer and __min_timer < timeout: timeout = __min_timer
+
+
+		# wait for event
+		events = None
+		if __registered:
+			try:
+				events = __epoll.poll( timeout / 1000.0 )
+			except IOError, e:
+				if e.errno != errno.EINTR:
+					raise e
+		elif timeout:
+			time_sleep(timeout / 1000.0)
+		if __always_ready:
+			events = ( events or [] ) + [ ( fd, select.EPOLLIN | select.EPOLLOUT ) for fd in __always_ready ]
+
+		if simulate:
+			# we only simulate
+			return
+
+		# handle timers
+		now = int( time() * 1000 )
+		rescheduled = []
+		# Timers added by the callbacks get a higher id; like rescheduled
+		# ones they are left for the next step.
+		last_id = __timer_id
+		while __timer_heap and __timer_heap[ 0 ][ 0 ] <= now:
+			timestamp, i = heappop( __timer_heap )
+			if i > last_id:
+				rescheduled.append( ( timestamp, i ) )
+				continue
+			timer = __timers.get( i )
+			if timer is None or timer[ TIMESTAMP ] != timestamp:
+				# timer was unregistered or rescheduled, or would recurse
+				continue
+			# Update timestamp on timer before calling the callback to
+			# prevent infinite recursion in case the callback calls
+			# step().
+			timer[ TIMESTAMP ] = 0
+			if not timer[ CALLBACK ]():
+				if __timers.get( i ) is timer:
+					del __timers[ i ]
+			elif __timers.get( i ) is timer:
+				# Find a moment in the future. If interval is 0, we
+				# just reuse the old timestamp, doesn't matter.
+				interval = timer[ INTERVAL ]
+				if interval:
+					now = int( time() * 1000 )
+					timestamp += interval
+					if timestamp <= now:
+						timestamp += ( ( now - timestamp ) // interval + 1 ) * interval
+				timer[ TIMESTAMP ] = timestamp
+				# Not pushed before all timers are handled, so a timer is
+				# called at most once per step.
+				rescheduled.append( ( timestamp, i ) )
+		for entry in rescheduled:
+			heappush( __timer_heap, entry )
+
+		# handle sockets
+		if events:
+			for fd, event in events:
+				for condition, ready in _READY:
+					if not event & ready:
+						continue
+					# the timer handling or a previous callback might have
+					# removed the socket.
+					id = __fds[ condition ].get( fd )
+					if id is None:
+						continue
+					callback = __sockets[ condition ][ id ][ 1 ]
+					if not callback( id ):
+						socket_remove( id, condition )
+
+		# handle external dispatchers
+		if external:
+			dispatch.dispatcher_run()
+	finally:
+		__step_depth -= 1
+		__in_step = False
+
+def loop():
+	"""Executes the 'main loop' forever by calling step in an endless loop"""
+	while 1:
+		step()
+
+def _init():
+	global __step_depth_max, __epoll
+
+	__step_depth_max = _options[ 'recursive_depth' ]
+	__epoll = select.epoll()
@@ -72,6 +72,21 @@
 # server side. The client and the channel objects have a signal 'disconnected'
 # to be called when the connection gets lost.
 #
+# An exposed function may also be a generator.  Its items are sent in chunks
+# as the function produces them when called with rpc_iter(), which returns a
+# kaa.Generator the chunks (lists of items) can be consumed from before the
+# last of them was sent, and as one list when called with rpc().  Items that are
+# InProgress objects aren't sent, the generator waits for them instead and
+# gets their result back (similar to a coroutine).
+#
+# | @kaa.rpc.expose()
+# | def search(self, text):
+# |     for row in (yield self.db.query(text=text)):
+# |         yield row
+#
+# | for chunk in (yield client.rpc_iter('search', 'foo')):
+# |     rows = yield chunk
+#
 # -----------------------------------------------------------------------------
 # Copyright 2006-2009 Dirk Meyer, Jason Tackaberry
 #
@@ -101,6 +116,7 @@ import types
 import socket
 import logging
 import cPickle
+import cStringIO
 import pickle
 import struct
 import sys
@@ -120,6 +136,30 @@ log = logging.getLogger('rpc')
 
 # Global constants
 RPC_PACKET_HEADER_SIZE = struct.calcsize("I4sI")
+# Number of items of a streamed result sent in the first packet.  The
+# chunk size doubles with each packet up to RPC_STREAM_CHUNK_MAX.
+RPC_STREAM_CHUNK_SIZE = 100
+RPC_STREAM_CHUNK_MAX = 2000
+# Features of this version announced to the remote end during
+# authentication, in the salt of the response to its challenge: the salt
+# starts with RPC_FEATURES_TAG followed by a byte of RPC_FEATURE_* flags.
+# Older versions treat the salt as random data and announce nothing.
+RPC_FEATURES_TAG = 'kaa\x01'
+RPC_FEATURE_ITER = 0x01
+RPC_FEATURES = RPC_FEATURE_ITER
+
+def _dumps(obj):
+    """
+    Encodes obj for the payload of a CALL, RETN, PART or EXCP packet.
+    """
+    return cPickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(payload):
+    """
+    Decodes the payload of a CALL, RETN, PART or EXCP packet.
+    """
+    return cPickle.load(cStringIO.StringIO(payload))
 
 
 class RemoteException(AsyncExceptionBase):
@@ -248,12 +288,25 @@ class Channel(Object):
         self._socket.chunk_size = 1024
         # Buffer containing packets deferred until after authentication.
         self._write_buffer_deferred = []
-        self._read_buffer = []
+        # Packets held back to be written at once, or None if not batching
+        # (see batch()).  _batching_answers is True while this is done for
+        # the answers to packets handled by _handle_read().
+        self._write_batch = None
+        self._batching_answers = False
+        # Data read from the socket, and the offset of the first byte in it
+        # that doesn't belong to an already handled packet.
+        self._read_buffer = bytearray()
+        self._read_pos = 0
         self._callbacks = {}
         self._next_seq = 1
         self._rpc_in_progress = {}
+        # kaa.Generator objects for the calls made with rpc_iter(), keyed
+        # on seq.
+        self._rpc_streams = {}
         self._auth_secret = auth_secret
         self._pending_challenge = None
+        # RPC_FEATURE_* flags announced by the remote end.
+        self._remote_features = 0
 
         # Creates a circular reference so that RPC channels survive even when
         # there is no reference to them.  (Servers may not hold references to
@@ -303,14 +356,96 @@ class Channel(Object):
         self._next_seq += 1
         # create InProgress object
         callback = kwargs.pop('_kaa_rpc_callback', kaa.InProgress())
-        packet_type = 'CALL'
-        payload = cPickle.dumps((cmd, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        stream = kwargs.pop('_kaa_rpc_stream', None)
+        packet_type = 'ITER' if stream else 'CALL'
+        payload = _dumps((cmd, args, kwargs))
         self._send_packet(seq, packet_type, payload)
+        if self._batching_answers:
+            # Calls made while handling a packet aren't held back, as the
+            # handler may wait for their result.
+            self._flush_write_batch()
+            self._write_batch = []
         # callback with error handler
         self._rpc_in_progress[seq] = (callback, cmd)
+        if stream:
+            self._rpc_streams[seq] = stream
         return callback
 
 
+    def rpc_iter(self, cmd, *args, **kwargs):
+        """
+        Call the remote command and stream its result.
+
+        :returns: InProgress finished with a :class:`~kaa.Generator` once
+                  the first item of the result was received
+
+        The remote command should be a generator, whose items are received
+        in chunks as it produces them.  Iterating over the kaa.Generator
+        yields an InProgress for each chunk, finished with the list of items
+        in it::
+
+            for chunk in (yield channel.rpc_iter('search', 'foo')):
+                for row in (yield chunk):
+                    ...
+
+        The result of a remote command that is not a generator must be a
+        sequence, which is received as a single chunk.  If the remote end
+        didn't announce support for streaming calls during authentication
+        (older kaa.rpc versions don't), a plain call is made instead and the
+        whole result is received as a single chunk too.
+        """
+        generator = kaa.Generator()
+        kwargs['_kaa_rpc_stream'] = generator
+        ip = self.rpc(cmd, *args, **kwargs)
+        ip.connect(generator.finish)
+        ip.exception.connect(generator.throw)
+        return kaa.inprogress(generator)
+
+
+    def rpc_many(self, calls):
+        """
+        Call multiple remote commands at once.
+
+        :param calls: list of (cmd, args) or (cmd, args, kwargs) tuples
+        :returns: :class:`~kaa.InProgressAll` for the InProgress objects of
+                  the individual calls, in the same order as calls
+
+        The calls are sent in a single write (see batch()), and the remote
+        end answers those that complete immediately in a single write too.
+        """
+        callbacks = [ kaa.InProgress() for call in calls ]
+        if not CoreThreading.is_mainthread():
+            kaa.MainThreadCallable(self._rpc_many)(calls, callbacks)
+        else:
+            self._rpc_many(calls, callbacks)
+        return kaa.InProgressAll(*callbacks)
+
+
+    def _rpc_many(self, calls, callbacks):
+        with self.batch():
+            for call, callback in zip(calls, callbacks):
+                kwargs = dict(call[2]) if len(call) > 2 else {}
+                kwargs['_kaa_rpc_callback'] = callback
+                self.rpc(call[0], *call[1], **kwargs)
+
+
+    def batch(self):
+        """
+        Return a context manager that holds back the packets sent on the
+        channel (e.g. by calling rpc()) while it is active, and writes them
+        to the socket at once at the end::
+
+            with channel.batch():
+                for item in items:
+                    channel.rpc('parse', item)
+
+        This saves a write (and system call) for each packet.  Don't wait for
+        the result of calls made within the block before it has ended, they
+        haven't been sent yet.
+        """
+        return _WriteBatch(self)
+
+
     def close(self):
         """
         Forcefully close the RPC channel.
@@ -326,10 +461,22 @@ class Channel(Object):
         """
         Writes data to the channel.
         """
+        if self._write_batch is not None:
+            self._write_batch.append(data)
+            return
         cb = self._socket.write(data).exception.connect_weak(self._handle_close, False, write_failed=True)
         cb.ignore_caller_args = True
 
 
+    def _flush_write_batch(self):
+        """
+        Writes the packets held back by the current batch and ends it.
+        """
+        batch, self._write_batch = self._write_batch, None
+        if batch and self._socket and self._socket.alive:
+            self._write(''.join(batch))
+
+
     def _handle_close(self, expected, reset_signals=True, write_failed=False):
         """
         kaa.Socket callback invoked when socket is closed.
@@ -358,6 +505,7 @@ class Channel(Object):
                 # Raise an error if this happens during runtime or if
                 # someone wants to get the result or exception.
                 callback.throw(IOError, IOError('kaa.rpc channel closed'), None)
+        self._rpc_streams = {}
 
         # Return False for reason explained above.
         return False
@@ -367,17 +515,17 @@ class Channel(Object):
         """
         Invoked when a new chunk is read from the socket.  When not authenticated,
         chunk size is 1k; when authenticated it is 1M.
+
+        Packets are parsed in place in the read buffer, and the payload given
+        to the packet handlers is a buffer object referencing it rather than
+        a copy.  The data of handled packets is only removed from the read
+        buffer once no complete packet is left, so a packet spanning many
+        chunks costs no more than appending those chunks.
         """
-        self._read_buffer.append(data)
-        # Before we start into the loop, make sure we have enough data for
-        # a full packet.  For very large packets (if we just received a huge
-        # pickled object), this saves the string.join() which can be very
-        # expensive.  (This is the reason we use a list for our read buffer.)
-        buflen = sum(len(x) for x in self._read_buffer)
-        if buflen < RPC_PACKET_HEADER_SIZE:
-            return
+        buf = self._read_buffer
+        buf.extend(data)
 
-        if not self._authenticated and buflen > 1024:
+        if not self._authenticated and len(buf) - self._read_pos > 1024:
             # Because we are not authenticated, we shouldn't have more than 1k
             # in the buffer.  If we do it's because the remote has sent a
             # large amount of data before completing authentication.
@@ -385,48 +533,41 @@ class Channel(Object):
             self.close()
             return
 
-        # Ensure the first block in the read buffer is big enough for a full
-        # packet header.  If it isn't, then we must have more than 1 block in
-        # the buffer, so keep merging blocks until we have a block big enough
-        # to be a header.  If we're here, it means that buflen >=
-        # RPC_PACKET_HEADER_SIZE, so we can safely loop.
-        while len(self._read_buffer[0]) < RPC_PACKET_HEADER_SIZE:
-            self._read_buffer[0] += self._read_buffer.pop(1)
-
-        # Make sure the the buffer holds enough data as indicated by the
-        # payload size in the header.
-        header = self._read_buffer[0][:RPC_PACKET_HEADER_SIZE]
-        payload_len = struct.unpack("I4sI", header)[2]
-        if buflen < payload_len + RPC_PACKET_HEADER_SIZE:
-            return
-
-        # At this point we know we have enough data in the buffer for the
-        # packet, so we merge the array into a single buffer.
-        strbuf = ''.join(self._read_buffer)
-        self._read_buffer = []
-        while True:
-            if len(strbuf) <= RPC_PACKET_HEADER_SIZE:
-                if len(strbuf) > 0:
-                    self._read_buffer.append(str(strbuf))
-                break
-            header = strbuf[:RPC_PACKET_HEADER_SIZE]
-            seq, packet_type, payload_len = struct.unpack("I4sI", header)
-            if len(strbuf) < payload_len + RPC_PACKET_HEADER_SIZE:
-                # We've also received portion of another packet that we
-                # haven't fully received yet.  Put back to the buffer what
-                # we have so far, and we can exit the loop.
-                self._read_buffer.append(str(strbuf))
-                break
-
-            # Grab the payload for this packet, and shuffle strbuf to the
-            # next packet.
-            payload = strbuf[RPC_PACKET_HEADER_SIZE:RPC_PACKET_HEADER_SIZE + payload_len]
-            strbuf = buffer(strbuf, RPC_PACKET_HEADER_SIZE + payload_len)
-            #log.debug("Got packet %s", packet_type)
-            if not self._authenticated:
-                self._handle_packet_before_auth(seq, packet_type, payload)
-            else:
-                self._handle_packet_after_auth(seq, packet_type, payload)
+        # Answers to the packets handled here are written at once, so many
+        # calls (e.g. sent with rpc_many()) are answered with a single write.
+        batching = self._write_batch is None
+        if batching:
+            self._write_batch, self._batching_answers = [], True
+        try:
+            while True:
+                pos = self._read_pos
+                if len(buf) - pos < RPC_PACKET_HEADER_SIZE:
+                    break
+                seq, packet_type, payload_len = struct.unpack_from("I4sI", buf, pos)
+                pos += RPC_PACKET_HEADER_SIZE
+                if len(buf) < pos + payload_len:
+                    # We have only received a portion of this packet so far.
+                    break
+
+                # Move past this packet before handling it, as the handler may
+                # step the main loop, in which case we get reentered.  Handlers
+                # must be done with the payload before they do that.
+                self._read_pos = pos + payload_len
+                payload = buffer(buf, pos, payload_len)
+                #log.debug("Got packet %s", packet_type)
+                if not self._authenticated:
+                    self._handle_packet_before_auth(seq, packet_type, payload)
+                else:
+                    self._handle_packet_after_auth(seq, packet_type, payload)
+        finally:
+            if batching:
+                self._batching_answers = False
+                self._flush_write_batch()
+
+        if self._read_pos:
+            # Discard the handled packets, which leaves at most a partial one.
+            del buf[:self._read_pos]
+            self._read_pos = 0
 
 
     def _send_packet(self, seq, packet_type, payload):
@@ -435,22 +576,90 @@ class Channel(Object):
         """
         if not self._socket:
             return
-        header = struct.pack("I4sI", seq, packet_type, len(payload))
         if not self._authenticated and packet_type not in ('RESP', 'AUTH'):
             log.debug('delay packet %s', packet_type)
-            self._write_buffer_deferred.append(header + payload)
-        else:
-            self._write(header + payload)
+            self._write_buffer_deferred.append((seq, packet_type, payload))
+            return
+        if packet_type == 'ITER' and not self._remote_features & RPC_FEATURE_ITER:
+            # The remote doesn't know about streaming calls, it would never
+            # answer.  Make a plain call, whose result RETN handles as a
+            # single chunk.
+            packet_type = 'CALL'
+        header = struct.pack("I4sI", seq, packet_type, len(payload))
+        self._write(header + payload)
 
 
     def _send_answer(self, answer, seq):
         """
         Send delayed answer when callback returns InProgress.
         """
-        payload = cPickle.dumps(answer, pickle.HIGHEST_PROTOCOL)
+        payload = _dumps(answer)
         self._send_packet(seq, 'RETN', payload)
 
 
+    @kaa.coroutine()
+    def _send_stream(self, generator, seq, stream):
+        """
+        Send the items of the generator returned by a callback.  For a
+        streaming call (see rpc_iter()) they are sent in PART packets,
+        followed by an empty RETN; otherwise they are collected and sent as
+        a list in RETN.
+
+        The main loop is stepped after each PART packet, so it gets written
+        while the generator produces the next items.  The first packets are
+        small for the remote to get the first items early, later ones
+        larger to save main loop steps.
+        """
+        items = []
+        chunk_size = RPC_STREAM_CHUNK_SIZE
+        value = exc_info = None
+        while True:
+            if not self._socket or not self._socket.alive:
+                # The remote end is gone, no use producing more items.
+                generator.close()
+                return
+            try:
+                if exc_info:
+                    item = generator.throw(*exc_info)
+                else:
+                    item = generator.send(value)
+            except StopIteration:
+                break
+            except Exception:
+                self._send_exception(*sys.exc_info() + (seq,))
+                return
+            value = exc_info = None
+
+            if isinstance(item, kaa.InProgress):
+                # Send what we have so far while waiting for it.
+                if stream and items:
+                    self._send_packet(seq, 'PART', _dumps(items))
+                    items = []
+                try:
+                    value = yield item
+                except Exception:
+                    exc_info = sys.exc_info()
+                continue
+
+            items.append(item)
+            if stream and len(items) >= chunk_size:
+                self._send_packet(seq, 'PART', _dumps(items))
+                items = []
+                chunk_size = min(chunk_size * 2, RPC_STREAM_CHUNK_MAX)
+                yield kaa.NotFinished
+                # Don't let the write queue grow much faster than the
+                # remote end reads.
+                while self._socket.alive and self._socket.write_queue_used > self._socket.queue_size / 2:
+                    yield kaa.NotFinished
+
+        if not stream:
+            self._send_answer(items, seq)
+            return
+        if items:
+            self._send_packet(seq, 'PART', _dumps(items))
+        self._send_answer(None, seq)
+
+
     def _send_exception(self, type, value, tb, seq):
         """
         Send delayed exception when callback returns InProgress.
@@ -468,9 +677,9 @@ class Channel(Object):
         Handle incoming packet (called from _handle_write) after
         authentication has been completed.
         """
-        if packet_type == 'CALL':
-            # Remote function call, send answer
-            function, args, kwargs = cPickle.loads(payload)
+        if packet_type in ('CALL', 'ITER'):
+            # Remote function call, send answer (streamed for ITER)
+            function, args, kwargs = _loads(payload)
             try:
                 if self._callbacks[function]._kaa_rpc_param[0]:
                     args = [ self ] + list(args)
@@ -485,6 +694,8 @@ class Channel(Object):
             if isinstance(result, kaa.InProgress):
                 result.connect(self._send_answer, seq)
                 result.exception.connect(self._send_exception, seq)
+            elif isinstance(result, types.GeneratorType):
+                self._send_stream(result, seq, packet_type == 'ITER')
             else:
                 self._send_answer(result, seq)
 
@@ -492,24 +703,38 @@ class Channel(Object):
 
         if packet_type == 'RETN':
             # RPC return
-            payload = cPickle.loads(payload)
+            payload = _loads(payload)
             callback, cmd = self._rpc_in_progress.get(seq)
             if callback is None:
                 return True
             del self._rpc_in_progress[seq]
+            stream = self._rpc_streams.pop(seq, None)
+            if stream and payload is not None:
+                # Streaming call of a function that is no generator.
+                if payload:
+                    stream.send(list(payload))
+                payload = None
             callback.finish(payload)
             return True
 
+        if packet_type == 'PART':
+            # Part of the result of a streaming call
+            stream = self._rpc_streams.get(seq)
+            if stream:
+                stream.send(_loads(payload))
+            return True
+
         if packet_type == 'EXCP':
             # Exception for remote call
             try:
-                exc_value, stack = cPickle.loads(payload)
+                exc_value, stack = _loads(payload)
             except Exception, e:
                 exc_value, stack = e, ''
             callback, cmd = self._rpc_in_progress.get(seq)
             if callback is None:
                 return True
             del self._rpc_in_progress[seq]
+            self._rpc_streams.pop(seq, None)
             remote_exc = RemoteException(exc_value, stack, cmd)
             callback.throw(remote_exc.__class__, remote_exc, None)
             return True
@@ -664,6 +889,10 @@ class Channel(Object):
             self._authenticated = True
             self._socket.chunk_size = 1024*1024
             log.debug('Valid response received, remote authenticated.')
+            # The salt of a valid response also holds the features the remote
+            # supports (see _get_challenge_response()).
+            if salt.startswith(RPC_FEATURES_TAG):
+                self._remote_features = ord(salt[len(RPC_FEATURES_TAG)])
 
             # If remote has issued a counter-challenge along with their
             # response (step 2), we'll respond.  Unless something fishy is
@@ -681,8 +910,9 @@ class Channel(Object):
                 log.debug('Sent response to challenge from client.')
 
             # Empty deferred write buffer now that we're authenticated.
-            self._write(''.join(self._write_buffer_deferred))
-            self._write_buffer_deferred = []
+            deferred, self._write_buffer_deferred = self._write_buffer_deferred, []
+            for packet in deferred:
+                self._send_packet(*packet)
             self._handle_connected()
 
 
@@ -723,7 +953,9 @@ class Channel(Object):
 
         If salt is not None, it is the value generated by the remote end that
         was used in computing their response.  If it is None, a new 20-byte
-        salt is generated and used in computing our response.
+        salt is generated and used in computing our response.  It consists of
+        RPC_FEATURES_TAG, a byte of RPC_FEATURES flags and 15 random bytes, so
+        the remote learns about our features along with the response.
         """
         def xor(s, byte):
             # XORs each character in string s with byte.
@@ -734,7 +966,8 @@ class Channel(Object):
             return hashlib.sha1(s).digest()
 
         if not salt:
-            salt = self._get_rand_value()
+            salt = RPC_FEATURES_TAG + chr(RPC_FEATURES)
+            salt += self._get_rand_value()[:20 - len(salt)]
 
         # block size of SHA-1 is 512 bits (64 bytes)
         B = 64
@@ -757,6 +990,34 @@ class Channel(Object):
 
 
 
+class _WriteBatch(object):
+    """
+    Context manager returned by Channel.batch().
+    """
+    def __init__(self, channel):
+        self._channel = channel
+        self._outer = False
+        self._batching_answers = False
+
+    def __enter__(self):
+        channel = self._channel
+        if channel._write_batch is None:
+            # Not nested in another batch, so we write the packets.
+            channel._write_batch = []
+            self._outer = True
+        # Calls are held back in here, even within a packet handler.
+        self._batching_answers, channel._batching_answers = channel._batching_answers, False
+        return channel
+
+    def __exit__(self, type, value, tb):
+        self._channel._batching_answers = self._batching_answers
+        if self._outer:
+            self._outer = False
+            self._channel._flush_write_batch()
+        return False
+
+
+
 DISCONNECTED = 'DISCONNECTED'
 CONNECTING = 'CONNECTING'
 CONNECTED = 'CONNECTED'
@@ -818,7 +1079,9 @@ class Client(Channel):
             # reset variables
             self._authenticated = False
             self._pending_challenge = None
-            self._read_buffer = []
+            self._remote_features = 0
+            self._read_buffer = bytearray()
+            self._read_pos = 0
             self.status = CONNECTING
             self._socket = kaa.Socket(buffer_size)
             self._socket.chunk_size = 1024
@@ -34,6 +34,7 @@ import errno
 import os
 import re
 import socket
+import stat
 import logging
 import ctypes.util
 import collections
@@ -116,6 +117,128 @@ def if_indextoname(idx):
 
 
 
+def _libc_sendfile():
+    """
+    Returns libc's sendfile64(), or None if unavailable.  Only Linux is
+    supported, other systems' sendfile() take different arguments.
+    """
+    try:
+        return _libc_sendfile._func
+    except AttributeError:
+        pass
+
+    _libc_sendfile._func = None
+    if sys.platform.startswith('linux') and _libc() and hasattr(ctypes, 'get_errno'):
+        func = getattr(_libc(), 'sendfile64', None)
+        if func:
+            func.restype = ctypes.c_ssize_t
+            func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+            _libc_sendfile._func = func
+    return _libc_sendfile._func
+
+
+def sendfile(out_fd, in_fd, offset, count):
+    """
+    Copies data from one file descriptor to another within the kernel.
+
+    :param out_fd: descriptor to write to, usually a socket
+    :param in_fd: descriptor of a regular file to read from
+    :param offset: offset in the file to start reading at
+    :param count: maximum number of bytes to copy
+    :returns: the number of bytes copied, 0 at the end of the file
+    :raises: OSError if the system call fails (with EAGAIN if out_fd is
+             a non-blocking socket whose buffer is full);
+             NotImplementedError on unsupported platforms.
+
+    Uses os.sendfile() if available, and libc's sendfile() otherwise.
+    """
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(out_fd, in_fd, offset, count)
+
+    func = _libc_sendfile()
+    if not func:
+        raise NotImplementedError('Platform does not support sendfile()')
+    sent = func(out_fd, in_fd, ctypes.byref(ctypes.c_int64(offset)), count)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return sent
+
+
+
+class _FileSender(object):
+    """
+    Write queue item for Socket.sendfile(), called by the IOChannel when the
+    socket is writable.
+    """
+    def __init__(self, socket, fd, offset, count):
+        self._socket = socket
+        self._fd = fd
+        self._offset = offset
+        self._count = count
+        # Number of bytes of the file sent (or read to be sent).
+        self._sent = 0
+        # Data read from the file but not written yet when copying.
+        self._pending = None
+        # False once sendfile() turned out not to be supported.
+        self._zerocopy = True
+        # True once anything is written to the socket, after which the
+        # write can't be aborted.
+        self.started = False
+
+
+    def __len__(self):
+        # The file's data doesn't occupy the write queue.
+        return 0
+
+
+    def __call__(self):
+        """
+        Writes data from the file until the socket's buffer is full.  Returns
+        the number of bytes written in total once all are, or None otherwise.
+        """
+        sock = self._socket
+        try:
+            while self._count > 0 or self._pending:
+                if self._pending:
+                    sent = sock._write(self._pending)
+                    self._pending = buffer(self._pending, sent) if sent < len(self._pending) else None
+                    self.started = self.started or sent > 0
+                elif self._zerocopy and sock._can_sendfile():
+                    try:
+                        sent = sendfile(sock.fileno, self._fd, self._offset, min(self._count, sock._chunk_size))
+                    except NotImplementedError:
+                        self._zerocopy = False
+                        continue
+                    if sent == 0:
+                        # The file is shorter than expected.
+                        break
+                    self._offset += sent
+                    self._count -= sent
+                    self._sent += sent
+                    self.started = True
+                else:
+                    # Copy through a string.  This moves the file position.
+                    os.lseek(self._fd, self._offset, os.SEEK_SET)
+                    data = os.read(self._fd, min(self._count, sock._chunk_size))
+                    if not data:
+                        break
+                    self._offset += len(data)
+                    self._count -= len(data)
+                    self._sent += len(data)
+                    self._pending = sock._sendfile_data(data)
+                    continue
+                if self._pending:
+                    # Socket buffer is full.
+                    return None
+        except (OSError, IOError, socket.error), e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            raise
+        return self._sent
+
+
+
 class SocketError(Exception):
     pass
 
@@ -608,6 +731,68 @@ class Socket(IOChannel):
         return self._channel.send(data)
 
 
+    def _can_sendfile(self):
+        """
+        True if file data can be sent to the socket's descriptor by the
+        kernel.  Not the case for sockets whose data is transformed, like
+        TLS sockets.
+        """
+        return isinstance(self._channel, socket.socket)
+
+
+    def _sendfile_data(self, data):
+        """
+        Returns the data to write to the socket for data read from a file by
+        sendfile() when the kernel can't copy it.  Sockets which transform
+        data in write() rather than in their channel, like M2Crypto TLS
+        sockets, do it here.
+        """
+        return data
+
+
+    def sendfile(self, fileobj, offset=0, count=None):
+        """
+        Writes data from a file to the socket without reading it into memory.
+
+        :param fileobj: the file to send
+        :type fileobj: file object or file descriptor of a regular file
+        :param offset: position in the file to start at
+        :type offset: int
+        :param count: number of bytes to send, or None to send up to the
+                      end of the file
+        :type count: int
+        :returns: An :class:`~kaa.InProgress` object which is finished with
+                  the number of bytes sent (which is less than count if the
+                  file is shorter) when all are written to the socket.
+                  Like :meth:`~kaa.IOChannel.write`, an IOError is thrown to
+                  it if the socket closes prematurely.
+
+        The data is queued behind the data written before, and data written
+        afterwards is sent after the file.  The kernel copies the data from
+        the file to the socket with sendfile(2) where supported, otherwise (or
+        for TLS sockets) the file is read in chunks of
+        :attr:`~kaa.IOChannel.chunk_size` bytes.  The file must stay open
+        until the InProgress is finished.  Its position is undefined
+        afterwards.
+
+        Only regular files are supported; use :meth:`~kaa.IOChannel.write`
+        with data from :meth:`~kaa.IOChannel.read` for pipes.
+        """
+        if not (self._mode & IO_WRITE):
+            raise IOError(9, 'Cannot write to a read-only channel')
+        if not self.writable:
+            raise IOError(9, 'Channel is not writable')
+        fd = fileobj if isinstance(fileobj, (int, long)) else fileobj.fileno()
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise ValueError('sendfile() requires a regular file')
+        if count is None:
+            count = max(st.st_size - offset, 0)
+        if count <= 0:
+            return self._queue_write('')
+        return self._queue_write(_FileSender(self, fd, offset, count))
+
+
     def _accept(self):
         """
         Accept a new connection and return a new Socket object.
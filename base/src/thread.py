@@ -29,12 +29,14 @@ from __future__ import absolute_import
 
 __all__ = [
     'MainThreadCallable', 'ThreadCallable', 'threaded', 'MAINTHREAD',
-    'synchronized', 'ThreadInProgress', 'ThreadPool', 'register_thread_pool',
-    'get_thread_pool'
+    'synchronized', 'ThreadInProgress', 'ThreadPool', 'ProcessPool',
+    'register_thread_pool', 'get_thread_pool'
 ]
 
 # python imports
+import os
 import sys
+import imp
 import threading
 import logging
 import socket
@@ -42,6 +44,12 @@ import errno
 import types
 import time
 import ctypes
+import heapq
+import bisect
+import itertools
+import subprocess
+import traceback
+import cPickle
 from thread import LockType
 
 # kaa imports
@@ -50,6 +58,7 @@ from . import nf_wrapper as notifier
 from .utils import wraps, DecoratorDataStore, property
 from .core import CoreThreading, Object
 from .async import InProgress, InProgressAborted, InProgressStatus
+from .async import AsyncExceptionBase, make_exception_class
 
 # get logging object
 log = logging.getLogger('base')
@@ -474,7 +483,7 @@ class _ThreadPoolMember(threading.Thread):
             # get a new job to process
             self.pool._condition.acquire()
             t0 = time.time()
-            while not self.pool._queue and not self.stopped:
+            while not self.pool._queued and not self.stopped:
                 # nothing to do, wait
                 self.pool._condition.wait(self.pool._timeout - (time.time() - t0))
                 if time.time() - t0 >= self.pool._timeout:
@@ -486,15 +495,173 @@ class _ThreadPoolMember(threading.Thread):
                 self.pool._condition.release()
                 return self._exit()
 
-            job = self.pool._queue.pop(0)
+            job = self.pool._pop()
             self.pool._busy += 1
             self.pool._condition.release()
-            job()
+            self._run(job)
+            self.pool._condition.acquire()
             self.pool._busy -= 1
+            self.pool._stats['finished'] += 1
+            self.pool._condition.release()
 
         self._exit()
 
 
+    def _run(self, job):
+        """
+        Process the given job.
+        """
+        job()
+
+
+
+class _ProcessPoolMember(_ThreadPoolMember):
+    """
+    Member thread for process pools, which runs the jobs in a worker process
+    (see _process_pool_worker()) and waits for their result.  The worker is
+    started with the first job and replaced after pool.maxjobs jobs.
+    """
+    def __init__(self, pool, name):
+        self._process = None
+        self._jobs = 0
+        super(_ProcessPoolMember, self).__init__(pool, name)
+
+
+    def _start_process(self):
+        main = getattr(sys.modules.get('__main__'), '__file__', None)
+        cmd = 'from kaa.base.thread import _process_pool_worker; _process_pool_worker(%r)' % main
+        # The worker must be able to import the modules we can.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        self._process = subprocess.Popen([sys.executable, '-c', cmd], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, close_fds=True, env=env)
+        self._jobs = 0
+
+
+    def _stop_process(self):
+        if self._process:
+            # The worker exits when its stdin is closed.
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+
+    def _call(self, func, args, kwargs):
+        """
+        Calls func in the worker process and returns its result.
+        """
+        # The module attribute of a function decorated with @kaa.threaded
+        # is the decorated function.
+        attr = getattr(sys.modules.get(func.__module__), func.__name__, None)
+        if attr is not func and getattr(attr, 'origfunc', None) is not func:
+            raise TypeError('%s can\'t be used with a ProcessPool, as it is not a module level function' % \
+                            func.__name__)
+        data = cPickle.dumps((func.__module__, func.__name__, args, kwargs), cPickle.HIGHEST_PROTOCOL)
+        if not self._process:
+            self._start_process()
+        try:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+            unpickler = cPickle.Unpickler(self._process.stdout)
+            unpickler.find_global = _find_global_main
+            result = unpickler.load()
+        except (IOError, EOFError):
+            self._process.kill()
+            self._stop_process()
+            raise IOError('process pool worker died')
+
+        self._jobs += 1
+        if self.pool._maxjobs and self._jobs >= self.pool._maxjobs:
+            self._stop_process()
+        if result[0] == 'throw':
+            raise _ProcessPoolException(result[1], result[2])
+        return result[1]
+
+
+    def _run(self, job):
+        callable = job._callable
+        if callable is not None:
+            job._callable = Callable(self._call, callable._func, callable._args, callable._kwargs)
+        job()
+
+
+    def _exit(self):
+        self._stop_process()
+        super(_ProcessPoolMember, self)._exit()
+
+
+
+class _ProcessPoolException(AsyncExceptionBase):
+    """
+    Raised for exceptions in jobs of a ProcessPool.  Instances inherit the
+    class of the exception in the worker, and print its traceback.
+    """
+    __metaclass__ = make_exception_class
+    def _kaa_get_header(self):
+        return 'Exception in process pool worker; traceback follows:'
+
+
+# Name of the main module of the parent in the worker processes of a
+# ProcessPool, as the worker has its own __main__.
+_WORKER_MAIN = '__kaa_main__'
+
+def _find_global_main(module, name):
+    """
+    Unpickles the classes and functions from the main module of the parent
+    in a worker process as those of our main module.
+    """
+    if module == _WORKER_MAIN:
+        module = '__main__'
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+
+def _process_pool_worker(main):
+    """
+    Main function of the worker processes of a ProcessPool.  Reads pickled
+    (module, function, args, kwargs) tuples from stdin and writes the
+    pickled result for each of them to stdout, until stdin is closed.
+
+    The main module of the parent (main is its filename) is imported as
+    __kaa_main__ when it is first needed, which only works for scripts that
+    don't do anything when not run as __main__.
+    """
+    # Anything the jobs print goes to stderr.
+    output = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    def find_global(module, name):
+        if module in ('__main__', _WORKER_MAIN):
+            module = _WORKER_MAIN
+            if module not in sys.modules:
+                imp.load_source(module, main)
+        else:
+            __import__(module)
+        return getattr(sys.modules[module], name)
+
+    while True:
+        unpickler = cPickle.Unpickler(sys.stdin)
+        unpickler.find_global = find_global
+        try:
+            module, name, args, kwargs = unpickler.load()
+        except EOFError:
+            break
+        try:
+            func = find_global(module, name)
+            # Undo @kaa.threaded.
+            func = getattr(func, 'origfunc', func)
+            result = ('finish', func(*args, **kwargs))
+        except Exception, e:
+            result = ('throw', e, traceback.extract_tb(sys.exc_info()[2]))
+        try:
+            data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            # Result or exception can't be pickled.
+            data = cPickle.dumps(('throw', TypeError(str(e)), []), cPickle.HIGHEST_PROTOCOL)
+        output.write(data)
+        output.flush()
+
+
+
 class ThreadPool(object):
     """
     Manages a pool of one or more threads for use with the
@@ -505,6 +672,12 @@ class ThreadPool(object):
     :func:`kaa.register_thread_pool`.  When done, the name can be referenced
     instead of passing the ThreadPool object.
     """
+    #: Upper bounds (in seconds) of the buckets of the wait time histogram
+    #: in :attr:`~kaa.ThreadPool.stats`.  The last bucket has no bound.
+    WAIT_HISTOGRAM = (0.001, 0.01, 0.1, 1, 10)
+    # Class of the pool members.
+    _member_class = _ThreadPoolMember
+
     def __init__(self, size=1):
         """
         :param size: maximum number of threads this thread pool will grow to.
@@ -515,8 +688,16 @@ class ThreadPool(object):
         self._members = []
         # Shared condition for all pool members
         self._condition = threading.Condition()
-        # Shared work queue of 2-tuples (callback, priority)
+        # Shared work queue, a heap of [-priority, seq, job, time queued]
+        # lists.  seq keeps jobs of the same priority in FIFO order.
+        # Dequeued jobs are set to None and skipped when they come up.
         self._queue = []
+        self._seq = itertools.count()
+        # Entries in the work queue keyed on id(job), and their number.
+        self._entries = {}
+        self._queued = 0
+        self._stats = dict(enqueued=0, dequeued=0, started=0, finished=0,
+                           wait=[0] * (len(self.WAIT_HISTOGRAM) + 1))
         # Shared thread timeout.
         self._timeout = 30
         # Thread pool name.  Set using register_thread_pool()
@@ -537,9 +718,9 @@ class ThreadPool(object):
         Grows or shrinks pool members based on current number of jobs and
         size limits.
         """
-        while len(self._members) - self._busy < len(self._queue) and len(self._members) < self._size:
+        while len(self._members) - self._busy < self._queued and len(self._members) < self._size:
             # We have jobs waiting and slots free, so spawn new members.
-            member = _ThreadPoolMember(self, '%s#%d' % (self._name, len(self._members)+1))
+            member = self._member_class(self, '%s#%d' % (self._name, len(self._members)+1))
             self._members.append(member)
 
         while len(self._members) > self._size:
@@ -572,8 +753,11 @@ class ThreadPool(object):
         callback.priority = priority
 
         self._condition.acquire()
-        self._queue.append(callback)
-        self._queue.sort(key=lambda job: job.priority, reverse=True)
+        entry = [-priority, self._seq.next(), callback, time.time()]
+        heapq.heappush(self._queue, entry)
+        self._entries[id(callback)] = entry
+        self._queued += 1
+        self._stats['enqueued'] += 1
         self._resize()
         self._condition.notify()
         self._condition.release()
@@ -590,14 +774,57 @@ class ThreadPool(object):
                   job was not found.
         """
         self._condition.acquire()
-        try:
-            self._queue.remove(job)
-        except ValueError:
-            found = False
-        else:
-            found = True
+        entry = self._entries.pop(id(job), None)
+        if entry:
+            entry[2] = None
+            self._queued -= 1
+            self._stats['dequeued'] += 1
+            if len(self._queue) > 2 * self._queued + 64:
+                # Mostly dequeued jobs, rebuild the heap without them.
+                self._queue = [ e for e in self._queue if e[2] is not None ]
+                heapq.heapify(self._queue)
+        self._condition.release()
+        return entry is not None
+
+
+    def _pop(self):
+        """
+        Removes the next job from the work queue and returns it.  Must be
+        called with the condition held and jobs queued.
+        """
+        while True:
+            entry = heapq.heappop(self._queue)
+            if entry[2] is not None:
+                break
+        del self._entries[id(entry[2])]
+        self._queued -= 1
+        self._stats['started'] += 1
+        self._stats['wait'][bisect.bisect_left(self.WAIT_HISTOGRAM, time.time() - entry[3])] += 1
+        return entry[2]
+
+
+    @property
+    def stats(self):
+        """
+        Statistics for the pool, a dict with the following keys:
+
+            * ``queued``: number of jobs waiting in the queue
+            * ``running``: number of jobs being processed
+            * ``threads``: number of pool members
+            * ``enqueued``, ``dequeued``, ``started``, ``finished``: number
+              of jobs that were added to the queue, removed from the queue
+              with :meth:`~kaa.ThreadPool.dequeue`, started and finished
+            * ``wait``: list of (bound, count) tuples, the number of started
+              jobs that waited in the queue no longer than bound seconds
+              (and longer than the previous bound).  The bound of the last
+              tuple is None.
+        """
+        self._condition.acquire()
+        stats = dict(self._stats, queued=self._queued, running=self._busy,
+                     threads=len(self._members))
+        stats['wait'] = zip(self.WAIT_HISTOGRAM + (None,), self._stats['wait'])
         self._condition.release()
-        return found
+        return stats
 
 
     @property
@@ -671,6 +898,65 @@ class ThreadPool(object):
 
 
 
+class ProcessPool(ThreadPool):
+    """
+    A :class:`~kaa.ThreadPool` that runs its jobs in worker processes, which
+    is useful for CPU bound jobs, as they don't compete for the GIL.  It can
+    be registered with :func:`kaa.register_thread_pool` and used with the
+    :func:`@kaa.threaded() <kaa.threaded>` decorator like any thread pool::
+
+        kaa.register_thread_pool('beacon::parser', kaa.ProcessPool())
+
+        @kaa.threaded('beacon::parser')
+        def parse(filename):
+            ...
+
+    Each pool member is a thread which sends the jobs to its worker process
+    and waits for the result.  The function, arguments and result of a job
+    are pickled, so the function must be defined at module level (not a
+    method), and the arguments and result must be picklable.  The worker
+    imports the module of the function itself; changes the parent made to
+    module state are not seen by the worker.  Functions from the main
+    script can only be used if it does nothing when it is imported rather
+    than run.  The ``progress`` argument of @kaa.threaded is not supported.
+    """
+    _member_class = _ProcessPoolMember
+
+    def __init__(self, size=None, maxjobs=0):
+        """
+        :param size: maximum number of worker processes this pool will grow
+                     to; defaults to the number of CPUs.
+        :type size: int
+        :param maxjobs: number of jobs after which a worker process is
+                        replaced by a new one, or 0 to keep using it.
+        :type maxjobs: int
+        """
+        if size is None:
+            try:
+                import multiprocessing
+                size = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                size = 1
+        super(ProcessPool, self).__init__(size)
+        self._maxjobs = maxjobs
+
+
+    @property
+    def maxjobs(self):
+        """
+        Number of jobs after which a worker process is replaced by a new one,
+        which limits the effect of memory leaks in the jobs.  If 0, workers
+        are only stopped when their pool member is (see
+        :attr:`~kaa.ThreadPool.timeout`).
+        """
+        return self._maxjobs
+
+    @maxjobs.setter
+    def maxjobs(self, value):
+        self._maxjobs = value
+
+
+
 def threaded(pool=None, priority=0, async=True, progress=False, wait=False):
     """
     Decorator causing the decorated function to be executed within a thread
@@ -0,0 +1,63 @@
+import sys
+import time
+
+import kaa
+
+# Runs coroutines shaped like beacon's crawler (Crawler._scan): a loop over
+# items, each yielding an InProgress for parsing the item that is either
+# finished already or finished on a later main loop iteration, optionally
+# followed by kaa.NotFinished to let other tasks run.  Reports the time per
+# item for a number of such coroutines running concurrently.
+
+# InProgress objects to finish on the next main loop iteration.
+pending = []
+
+def finish_pending():
+    batch = pending[:]
+    del pending[:]
+    for ip in batch:
+        ip.finish(None)
+
+kaa.main.signals['step'].connect(finish_pending)
+
+
+def parse(cached):
+    ip = kaa.InProgress()
+    if cached:
+        return ip.finish(None)
+    pending.append(ip)
+    return ip
+
+
+@kaa.coroutine()
+def scan(items, cached, yield_between):
+    for i in xrange(items):
+        ip = parse(cached)
+        if isinstance(ip, kaa.InProgress):
+            yield ip
+        if yield_between:
+            yield kaa.NotFinished
+    yield items
+
+
+@kaa.coroutine()
+def bench(name, coroutines, items, cached, yield_between):
+    t0 = time.time()
+    yield kaa.InProgressAll(*[ scan(items, cached, yield_between) for i in xrange(coroutines) ])
+    t = time.time() - t0
+    print '%-45s %6.2fus per item' % (name, t / (coroutines * items) * 1000000)
+
+
+@kaa.coroutine()
+def main(items):
+    for coroutines in (1, 10):
+        yield bench('%2d coroutines, finished IPs' % coroutines, coroutines, items, True, False)
+        yield bench('%2d coroutines, finished IPs, NotFinished' % coroutines, coroutines, items, True, True)
+        yield bench('%2d coroutines, pending IPs' % coroutines, coroutines, items, False, False)
+        yield bench('%2d coroutines, pending IPs, NotFinished' % coroutines, coroutines, items, False, True)
+    kaa.main.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
+    kaa.main.run()
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import cPickle
+
+import kaa
+import kaa.db
+from kaa.db import *
+
+WORDS = [ 'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+          'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa',
+          'quebec', 'romeo', 'sierra', 'tango', 'uniform', 'victor', 'whiskey' ]
+
+def create_db():
+    fd, dbfile = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    os.unlink(dbfile)
+    db = kaa.db.Database(dbfile)
+    db.register_inverted_index('keywords', min=2, max=30)
+    db.register_object_type_attrs('file',
+        [('name', 'parent_type', 'parent_id')],
+        name = (str, ATTR_SEARCHABLE | ATTR_INVERTED_INDEX, 'keywords', split_path),
+        media = (int, ATTR_SEARCHABLE | ATTR_INDEXED),
+        mtime = (int, ATTR_SIMPLE),
+        title = (unicode, ATTR_SIMPLE))
+    return db, dbfile
+
+
+def make_objects(n):
+    random.seed(0)
+    objects = []
+    for i in xrange(n):
+        name = '/media/library/%s/%s_%s_%d.mp3' % tuple(random.sample(WORDS, 3) + [i])
+        objects.append(dict(name=name, media=1, mtime=i, title=u'Title %d' % i))
+    return objects
+
+
+def bench_add(n):
+    db, dbfile = create_db()
+    objects = make_objects(n)
+    t0 = time.time()
+    for attrs in objects:
+        db.add('file', parent=('file', 0), **attrs)
+    db.commit()
+    t = time.time() - t0
+    os.unlink(dbfile)
+    return t
+
+
+def bench_add_many(n, batch=1000):
+    db, dbfile = create_db()
+    objects = make_objects(n)
+    t0 = time.time()
+    for i in xrange(0, n, batch):
+        db.add_many('file', objects[i:i+batch], parent=('file', 0))
+    db.commit()
+    t = time.time() - t0
+    # Sanity check: the deferred terms must be searchable.
+    assert len(db.query(type='file', keywords='alpha', limit=10)) == 10
+    os.unlink(dbfile)
+    return t
+
+
+def bench_keywords(n, posting_lists, queries=('alpha bravo', 'charlie delta echo', 'golf 42')):
+    db, dbfile = create_db()
+    db.add_many('file', make_objects(n))
+    db.commit()
+    db = kaa.db.Database(dbfile, posting_lists=posting_lists)
+    # Warm up (loads posting lists if enabled).
+    for q in queries:
+        db.query(keywords=q, limit=20)
+    t0 = time.time()
+    for i in xrange(10):
+        for q in queries:
+            db.query(keywords=q, limit=20)
+    t = (time.time() - t0) / (10 * len(queries))
+    os.unlink(dbfile)
+    return t
+
+
+def bench_simple_attr(n, indexed):
+    db, dbfile = create_db()
+    objects = make_objects(n)
+    for o in objects:
+        # Some bulk for the pickle, which is what makes full unpickling costly.
+        o['title'] = u' '.join(random.sample(WORDS, 10))
+    db.add_many('file', objects)
+    db.commit()
+    if not indexed:
+        # Rewrite rows using the old (single pickled dict) format.
+        rows = db._db_query('SELECT id, pickle FROM objects_file')
+        db._db_query('UPDATE objects_file SET pickle=? WHERE id=?',
+                     [(buffer(cPickle.dumps(kaa.db._unpickle_attrs(p), 2)), id) for id, p in rows],
+                     many=True)
+        db.commit()
+    rows = db.query(type='file')
+    t0 = time.time()
+    for row in rows:
+        row['mtime']
+    t = time.time() - t0
+    os.unlink(dbfile)
+    return t
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    t = bench_add(n)
+    print 'add():      %d objects in %.2fs (%d objects/sec)' % (n, t, n / t)
+    t = bench_add_many(n)
+    print 'add_many(): %d objects in %.2fs (%d objects/sec)' % (n, t, n / t)
+    t = bench_keywords(n, False)
+    print 'keyword query (sql):           %.2fms' % (t * 1000)
+    t = bench_keywords(n, True)
+    print 'keyword query (posting lists): %.2fms' % (t * 1000)
+    t = bench_simple_attr(n, False)
+    print 'ATTR_SIMPLE access (full pickle):    %.2fs' % t
+    t = bench_simple_attr(n, True)
+    print 'ATTR_SIMPLE access (indexed pickle): %.2fs' % t
@@ -0,0 +1,45 @@
+import sys
+import gc
+import time
+import resource
+
+import kaa
+
+# Creates n short-lived InProgress objects the way most of them are used
+# (finished with a callback connected, or finished before anyone connects)
+# and reports the time per object, and the memory used by n/10 unfinished
+# InProgress objects kept alive.
+
+def rss():
+    # Current resident set size in kB.
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+
+
+def nop(result):
+    pass
+
+
+def main(n):
+    t0 = time.time()
+    for i in xrange(n):
+        ip = kaa.InProgress()
+        ip.connect(nop)
+        ip.finish(i)
+    print 'create, connect, finish:  %6.2fus' % ((time.time() - t0) / n * 1000000)
+
+    t0 = time.time()
+    for i in xrange(n):
+        kaa.InProgress().finish(i).result
+    print 'create, finish, result:   %6.2fus' % ((time.time() - t0) / n * 1000000)
+
+    gc.collect()
+    before = rss()
+    ips = [ kaa.InProgress() for i in xrange(n / 10) ]
+    print 'memory per InProgress:    %6d bytes' % ((rss() - before) * 1024 / len(ips))
+    print 'max rss:                  %6d kB' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+
+import kaa
+
+# Transfers data through a pipe between two IOChannels in the same process
+# and reports the throughput: large writes read with the read signal, many
+# small writes, and lines read with the readline signal and with readline().
+# The amount of data in MB for the large writes comes from the command line.
+
+def pipe(queue_size):
+    rfd, wfd = os.pipe()
+    reader, writer = kaa.IOChannel(), kaa.IOChannel()
+    reader.wrap(rfd, kaa.IO_READ)
+    writer.wrap(wfd, kaa.IO_WRITE)
+    writer.queue_size = queue_size
+    return reader, writer
+
+
+def report(name, t0, size):
+    t = time.time() - t0
+    print '%-40s %7.2fs %7.1fMB/s' % (name, t, size / t / 1024 / 1024)
+
+
+@kaa.coroutine()
+def large_writes(mb):
+    block = 'x' * 16 * 1024 * 1024
+    reader, writer = pipe(len(block) * 2)
+    received = []
+    reader.signals['read'].connect(lambda data: received.append(len(data)))
+    t0 = time.time()
+    for i in xrange(mb / 32):
+        writer.write(block)
+        yield writer.write(block)
+    while sum(received) < mb / 32 * 2 * len(block):
+        yield kaa.delay(0)
+    report('%dMB in 16MB writes' % (mb / 32 * 32), t0, sum(received))
+    reader.close()
+    writer.close()
+
+
+@kaa.coroutine()
+def small_writes(n):
+    line = 'x' * 99 + '\n'
+    reader, writer = pipe(len(line) * n)
+    received = []
+    reader.signals['read'].connect(lambda data: received.append(len(data)))
+    t0 = time.time()
+    for i in xrange(n):
+        ip = writer.write(line)
+    yield ip
+    while sum(received) < n * len(line):
+        yield kaa.delay(0)
+    report('%d writes of 100 bytes' % n, t0, n * len(line))
+    reader.close()
+    writer.close()
+
+
+@kaa.coroutine()
+def lines(n, signal):
+    data = ('x' * 99 + '\n') * 10000
+    reader, writer = pipe(len(data))
+    received = []
+    if signal:
+        reader.signals['readline'].connect(lambda line: received.append(len(line)))
+    t0 = time.time()
+    for i in xrange(n / 10000):
+        ip = writer.write(data)
+        if not signal:
+            for j in xrange(10000):
+                received.append(len((yield reader.readline())))
+        yield ip
+    while len(received) < n / 10000 * 10000:
+        yield kaa.delay(0)
+    report('%d lines %s' % (n, 'with readline signal' if signal else 'with readline()'), t0, sum(received))
+    reader.close()
+    writer.close()
+
+
+@kaa.coroutine()
+def main(mb):
+    yield large_writes(mb)
+    yield small_writes(20000)
+    yield lines(200000, True)
+    yield lines(100000, False)
+    kaa.main.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1024)
+    kaa.main.run()
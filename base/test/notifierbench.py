@@ -0,0 +1,46 @@
+import sys
+import socket
+import subprocess
+
+import kaa
+
+# Runs the main loop for a second with the given number of idle sockets and
+# timers and reports how many steps it could do, for every notifier when
+# called without arguments (each in a new process).
+
+NOTIFIERS = ('generic', 'epoll')
+COUNTS = (10, 100, 1000)
+
+
+def run(notifier, count, busy):
+    kaa.main.init(notifier)
+    # Both ends of the pairs, select() only takes fds < 1024.
+    sockets = [ socket.socketpair() for i in xrange(count / 2) ]
+    for pair in sockets:
+        for s in pair:
+            kaa.IOMonitor(lambda: True).register(s.fileno())
+    # Timers that are due every 1ms if busy, otherwise never during the run.
+    timers = [ kaa.Timer(lambda: True) for i in xrange(count) ]
+    for timer in timers:
+        timer.start(0.001 if busy else 60)
+    steps = [ 0 ]
+    def step():
+        steps[0] += 1
+    kaa.Timer(step).start(0)
+    kaa.OneShotTimer(kaa.main.stop).start(1)
+    kaa.main.run()
+    return steps[0]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        print run(sys.argv[1], int(sys.argv[2]), sys.argv[3] == 'busy')
+        sys.exit(0)
+    for busy in ('idle', 'busy'):
+        for count in COUNTS:
+            result = []
+            for notifier in NOTIFIERS:
+                args = [ sys.executable, __file__, notifier, str(count), busy ]
+                steps = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
+                result.append('%s %7s steps/s' % (notifier, steps.strip() or 'failed'))
+            print '%4d sockets and timers (%s): %s' % (count, busy, ', '.join(result))
@@ -0,0 +1,120 @@
+import sys
+import time
+
+import kaa
+import kaa.rpc
+
+class Server(object):
+    def __init__(self):
+        self._results = {}
+
+    @kaa.rpc.expose()
+    def fetch(self, n, size):
+        # Distinct strings, otherwise the pickle only holds one of them.
+        if (n, size) not in self._results:
+            self._results[n, size] = [ '%08d' % i + 'x' * size for i in xrange(n) ]
+        return self._results[n, size]
+
+    @kaa.rpc.expose()
+    def echo(self, value):
+        return value
+
+    @kaa.rpc.expose()
+    def query(self, n):
+        if n not in self._results:
+            self._results[n] = query_result(n)
+        return self._results[n]
+
+    @kaa.rpc.expose()
+    def query_iter(self, n):
+        if n not in self._results:
+            self._results[n] = query_result(n)
+        for item in self._results[n]:
+            yield item
+
+
+def query_result(n):
+    # Resembles the attributes of beacon items for a query result.
+    return [ dict(type=u'file', id=i, name='track%05d.mp3' % i, parent=('dir', i / 100),
+                  media=1, mtime=1300000000 + i, image=None, overlay=False,
+                  title=u'Title %d' % i, artist=u'Artist %d' % (i % 50), length=215.5)
+             for i in xrange(n) ]
+
+
+@kaa.coroutine()
+def bench(client, repeat, cmd, *args):
+    # Warm up.
+    yield client.rpc(cmd, *args)
+    t0 = time.time()
+    for i in xrange(repeat):
+        yield client.rpc(cmd, *args)
+    yield (time.time() - t0) / repeat
+
+
+@kaa.coroutine()
+def bench_calls(client, n, batched):
+    t0 = time.time()
+    if batched:
+        yield client.rpc_many([ ('echo', (i,)) for i in xrange(n) ])
+    else:
+        yield kaa.InProgressAll(*[ client.rpc('echo', i) for i in xrange(n) ])
+    yield time.time() - t0
+
+
+@kaa.coroutine()
+def bench_stream(client, n, streamed):
+    # Returns the time until the first and the last item is available.
+    t0 = time.time()
+    if streamed:
+        first = None
+        for chunk in (yield client.rpc_iter('query_iter', n)):
+            yield chunk
+            if first is None:
+                first = time.time() - t0
+    else:
+        yield client.rpc('query', n)
+        first = time.time() - t0
+    yield first, time.time() - t0
+
+
+@kaa.coroutine()
+def main(n, size, repeat):
+    server = kaa.rpc.Server('/tmp/kaa-rpcbench', auth_secret='bench')
+    server.register(Server())
+    # Results are written in one go, so allow for them in the write queue.
+    server.signals['client-connected'].connect(lambda c: setattr(c._socket, 'queue_size', 256*1024*1024))
+
+    client = kaa.rpc.Client('/tmp/kaa-rpcbench', auth_secret='bench')
+    yield kaa.inprogress(client)
+    mb = n * size / 1024.0 / 1024
+    t = yield bench(client, repeat, 'fetch', n, size)
+    print 'large result (%.1fMB): %.1fms (%.1fMB/s)' % (mb, t * 1000, mb / t)
+    t = yield bench(client, 1000, 'fetch', 10, 10)
+    print 'small result:         %.3fms' % (t * 1000)
+    # Warm up.
+    yield bench_calls(client, 1000, False)
+    yield bench_calls(client, 1000, True)
+    print '1000 calls with rpc():      %.1fms' % ((yield bench_calls(client, 1000, False)) * 1000)
+    print '1000 calls with rpc_many(): %.1fms' % ((yield bench_calls(client, 1000, True)) * 1000)
+    for count in (10, 10000):
+        t = yield bench(client, 1000 / count * 10 or 10, 'query', count)
+        print 'query result (%d items): %.2fms' % (count, t * 1000)
+    client.close()
+
+    client = kaa.rpc.Client('/tmp/kaa-rpcbench', auth_secret='bench')
+    yield kaa.inprogress(client)
+    # Warm up.
+    yield bench_stream(client, 10000, False)
+    yield bench_stream(client, 10000, True)
+    for method, streamed in (('rpc()', False), ('rpc_iter()', True)):
+        first, last = yield bench_stream(client, 10000, streamed)
+        print 'query result (10000 items) with %-10s first item %.1fms, all %.1fms' % \
+              (method + ':', first * 1000, last * 1000)
+    client.close()
+    kaa.main.stop()
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    main(n, 64 * 1024, 5)
+    kaa.main.run()
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+import kaa
+
+# Sends a file of the given size in MB over a unix socket, once by reading it
+# in chunks and writing them, and once with Socket.sendfile(), and reports the
+# throughput and the CPU time used.  The receiving end is a thread reading
+# into a preallocated buffer.
+
+def receiver(sock, size):
+    buf = bytearray(1024 * 1024)
+    received = 0
+    while received < size:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        received += n
+    sock.close()
+
+
+@kaa.coroutine()
+def write_chunks(sock, f, size):
+    while True:
+        data = f.read(sock.chunk_size)
+        if not data:
+            break
+        yield sock.write(data)
+    yield size
+
+
+def send_file(sock, f, size):
+    return sock.sendfile(f)
+
+
+@kaa.coroutine()
+def bench(name, send, path, size):
+    ours, theirs = socket.socketpair()
+    thread = threading.Thread(target=receiver, args=(theirs, size))
+    thread.start()
+    sock = kaa.Socket()
+    sock.wrap(ours)
+    f = open(path, 'rb')
+    cpu, t0 = sum(os.times()[:2]), time.time()
+    sent = yield send(sock, f, size)
+    thread.join()
+    t, cpu = time.time() - t0, sum(os.times()[:2]) - cpu
+    assert sent == size
+    print '%-25s %7.1fMB/s  cpu %.2fs' % (name, size / t / 1024 / 1024, cpu)
+    f.close()
+    sock.close()
+
+
+@kaa.coroutine()
+def main(mb):
+    fd, path = tempfile.mkstemp()
+    try:
+        block = os.urandom(1024 * 1024)
+        for i in xrange(mb):
+            os.write(fd, block)
+        os.close(fd)
+        yield bench('write() in chunks', write_chunks, path, mb * len(block))
+        yield bench('sendfile()', send_file, path, mb * len(block))
+    finally:
+        os.unlink(path)
+    kaa.main.stop()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 512)
+    kaa.main.run()
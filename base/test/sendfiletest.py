@@ -0,0 +1,102 @@
+import os
+import sys
+import socket
+import tempfile
+import threading
+
+import kaa
+
+# Checks Socket.sendfile(): data written after the file is sent after it,
+# also when the file is copied through the socket's _sendfile_data() as
+# for TLS sockets, and the write can't be aborted once part of the file is
+# sent.
+
+class CopyingSocket(kaa.Socket):
+    # Sends files the way TLS sockets do, transforming each chunk.
+    def _can_sendfile(self):
+        return False
+
+    def _sendfile_data(self, data):
+        return data.upper()
+
+
+def receiver(sock, received):
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        received.append(data)
+    sock.close()
+
+
+@kaa.coroutine()
+def check_order(cls, path, size):
+    ours, theirs = socket.socketpair()
+    received = []
+    thread = threading.Thread(target=receiver, args=(theirs, received))
+    thread.start()
+    sock = cls(chunk_size=65536)
+    sock.wrap(ours)
+    f = open(path, 'rb')
+    sock.write('head')
+    ip = sock.sendfile(f)
+    sock.write('tail')
+    sent = yield ip
+    yield sock.write('')
+    sock.close()
+    thread.join()
+    f.close()
+    data = ''.join(received)
+    assert sent == size, sent
+    assert len(data) == size + 8, len(data)
+    assert data.startswith('head') and data.endswith('tail')
+    assert data[4:-4].lower() == open(path, 'rb').read()
+    print '%-15s later write stays in order: ok' % cls.__name__
+
+
+@kaa.coroutine()
+def check_abort(path):
+    # Nobody reads from the other end, so only part of the file fits into
+    # the socket buffer.
+    ours, theirs = socket.socketpair()
+    sock = kaa.Socket()
+    sock.wrap(ours)
+    f = open(path, 'rb')
+    ip = sock.sendfile(f)
+    before = sock.write('never')
+    # Nothing is sent yet, so this one can be aborted.
+    before.abort()
+    yield kaa.delay(0.1)
+    assert not ip.finished
+    try:
+        ip.abort()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('partly sent file was aborted')
+    print 'abort after partial send refused: ok'
+    sock.close(immediate=True)
+    theirs.close()
+    f.close()
+
+
+@kaa.coroutine()
+def main():
+    fd, path = tempfile.mkstemp()
+    try:
+        size = 10 * 1024 * 1024 + 17
+        os.write(fd, os.urandom(size).encode('hex')[:size].lower())
+        os.close(fd)
+        yield check_order(kaa.Socket, path, size)
+        yield check_order(CopyingSocket, path, size)
+        yield check_abort(path)
+    except:
+        sys.excepthook(*sys.exc_info())
+    finally:
+        os.unlink(path)
+    kaa.main.stop()
+
+
+if __name__ == '__main__':
+    main()
+    kaa.main.run()
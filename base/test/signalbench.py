@@ -0,0 +1,56 @@
+import sys
+import time
+
+import kaa
+
+# Emits signals with different callbacks connected and reports the time per
+# emit.
+
+class Receiver(object):
+    def method(self, *args, **kwargs):
+        pass
+
+def func(*args, **kwargs):
+    pass
+
+
+def bench(name, signal, n, *args, **kwargs):
+    emit = signal.emit
+    t0 = time.time()
+    for i in xrange(n):
+        emit(*args, **kwargs)
+    print '%-40s %6.2fus' % (name, (time.time() - t0) / n * 1000000)
+
+
+def main(n):
+    receiver = Receiver()
+    signal = kaa.Signal()
+    bench('no callbacks', signal, n, 1)
+    signal.connect(func)
+    bench('1 function', signal, n, 1)
+    bench('1 function, with kwargs', signal, n, 1, foo=2)
+    signal = kaa.Signal()
+    signal.connect(receiver.method)
+    bench('1 method', signal, n, 1)
+    signal = kaa.Signal()
+    signal.connect(func, 2)
+    bench('1 function with user args', signal, n, 1)
+    signal = kaa.Signal()
+    signal.connect_weak(receiver.method)
+    bench('1 weak method', signal, n, 1)
+    signal = kaa.Signal()
+    for i in xrange(5):
+        signal.connect(func)
+    bench('5 functions', signal, n, 1)
+
+    # A signal emitted once with a once callback, like InProgress.
+    t0 = time.time()
+    for i in xrange(n / 10):
+        signal = kaa.Signal()
+        signal.connect_once(func)
+        signal.emit(1)
+    print '%-40s %6.2fus' % ('new signal, connect_once, emit', (time.time() - t0) / (n / 10) * 1000000)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
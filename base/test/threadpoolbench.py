@@ -0,0 +1,50 @@
+import sys
+import time
+import random
+import threading
+
+import kaa
+
+# Enqueues n jobs with random priorities into a thread pool whose thread is
+# kept busy meanwhile, dequeues a tenth of them, and then lets the pool work
+# through the rest.
+
+def main(n):
+    pool = kaa.ThreadPool()
+    blocker = threading.Event()
+    pool.enqueue(blocker.wait)
+    # Creating the jobs is not part of the benchmark.
+    done = []
+    jobs = [ kaa.ThreadInProgress(done.append, i) for i in xrange(n) ]
+    priorities = [ random.randint(0, 10) for i in xrange(n) ]
+
+    t0 = time.time()
+    for job, priority in zip(jobs, priorities):
+        pool.enqueue(job, priority)
+    print 'enqueue %d jobs: %.3fs' % (n, time.time() - t0)
+
+    t0 = time.time()
+    for job in random.sample(jobs, n / 10):
+        pool.dequeue(job)
+    print 'dequeue %d jobs: %.3fs' % (n / 10, time.time() - t0)
+
+    t0 = time.time()
+    blocker.set()
+    while len(done) < n - n / 10:
+        time.sleep(0.01)
+    print 'process %d jobs: %.3fs' % (len(done), time.time() - t0)
+
+    # Jobs of the same priority must be processed in the order they were
+    # queued.
+    last = {}
+    for i in done:
+        assert last.get(priorities[i], -1) < i
+        last[priorities[i]] = i
+    print pool.stats
+    # Stop the pool thread before the interpreter shuts down.
+    pool.size = 0
+    time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -137,9 +137,10 @@ class Database(kaa.Object):
 
     This class is subclassed by the server for the read/write database.
     """
-    def __init__(self, dbdir):
+    def __init__(self, dbdir, readers=0):
         """
-        Init function
+        Init function. readers is the number of read-only connections kaa.db
+        may use for queries from threads.
         """
         super(Database, self).__init__()
         # internal db dir, it contains the real db and the
@@ -151,7 +152,7 @@ class Database(kaa.Object):
         overlay = os.path.join(self.directory, 'overlays')
         if not os.path.isdir(overlay):
             os.makedirs(overlay)
-        self._db = db.Database(self.directory + '/db')
+        self._db = db.Database(self.directory + '/db', readers=readers)
 
 
     # These methods are stubs on the client side, and will be implemented in
@@ -197,11 +198,15 @@ class Database(kaa.Object):
     # read only.
     # -------------------------------------------------------------------------
 
-    def query(self, **query):
+    def query(self, partial=None, **query):
         """
         Main query function. This function will call one of the specific
         query functions in this class depending on the query. This function
         returns an InProgress.
+
+        If partial is given, it is a callable that receives the list of
+        items found so far while a long query on database attributes is
+        still in progress, so the first results can be shown early.
         """
         # Remove non-true recursive attribute from query (non-recursive is default).
         if not query.get('recursive', True):
@@ -234,7 +239,7 @@ class Database(kaa.Object):
         elif query.get('type') == 'media':
             return kaa.InProgress().execute(self._db.query, **query)
         else:
-            return self._db_query_raw(query)
+            return self._db_query_raw(query, partial)
 
 
     def query_media(self, media):
@@ -452,12 +457,15 @@ class Database(kaa.Object):
 
 
     @kaa.coroutine()
-    def _db_query_raw(self, query):
+    def _db_query_raw(self, query, partial=None, rows=None):
         """
         Do a 'raw' query. This means to query the database and create
         a list of items from the result. The items will have a complete
         parent structure. For files / directories this function won't check
-        if they are still there.
+        if they are still there. The rows are fetched from the database as
+        the items are created, and partial (if given) is called with the
+        items created so far whenever this function yields. If rows is
+        given, it is the already fetched result of the query.
         """
         # FIXME: this function needs optimizing; adds at least 6 times the
         # overhead on top of kaa.db.query
@@ -470,7 +478,10 @@ class Database(kaa.Object):
             cache[media._beacon_id] = media
             cache[media.root._beacon_id] = media.root
 
-        for r in self._db.query(**query):
+        if rows is None:
+            rows = self._db.query_iter(**query)
+
+        for r in rows:
 
             # get parent
             pid = r['parent']
@@ -492,6 +503,8 @@ class Database(kaa.Object):
             if not counter % 50 and time.time() > timer + 0.05:
                 # We used too much time. Call yield NotFinished at
                 # this point to continue later.
+                if partial:
+                    partial(result[:])
                 timer = time.time()
                 yield kaa.NotFinished
 
@@ -217,9 +217,10 @@ class Query(object):
         # can take up to two seconds.
         yield self._rpc('db_lock')
         try:
-            self.result = self._client._db.query(**query)
-            if isinstance(self.result, kaa.InProgress):
-                self.result = yield self.result
+            result = self._client._db.query(partial=self._beacon_partial_result, **query)
+            if isinstance(result, kaa.InProgress):
+                result = yield result
+            self.result = result
         finally:
             self._rpc('db_unlock')
         self.signals['changed'].emit()
@@ -227,6 +228,16 @@ class Query(object):
             self._async.finish(True)
 
 
+    def _beacon_partial_result(self, result):
+        """
+        Partial result while the initial query is still in progress. The
+        changed signal is emitted so the first items can be rendered before
+        the whole result is available.
+        """
+        self.result = result
+        self.signals['changed'].emit()
+
+
     def __repr__(self):
         """
         Convert object to string (usefull for debugging)
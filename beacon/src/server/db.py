@@ -47,6 +47,13 @@ log = logging.getLogger('beacon.db')
 
 MAX_BUFFER_CHANGES = 200
 
+# Number of threads (and read-only connections) for database queries
+# done outside the main loop.
+DB_THREAD = 'beacon.db'
+DB_READERS = 2
+
+kaa.register_thread_pool(DB_THREAD, kaa.ThreadPool(DB_READERS))
+
 class ReadLock(object):
     """
     Read lock for the database.
@@ -70,9 +77,16 @@ class ReadLock(object):
     MUST test the read lock before attempting to write again.  Otherwise, a
     client 'db_lock' rpc could be processed before reentering the coroutine,
     and a db write may cause the client to barf in the middle of a db read.
+
+    If the database is in WAL mode (wal is True), readers and the writer
+    don't block each other, so clients holding the lock never stop the
+    server from writing.  The lock still emits its signals (so the server
+    commits and clients read up-to-date data), but it never reports itself
+    as locked.
     """
-    def __init__(self):
+    def __init__(self, wal=False):
         self.signals = kaa.Signals('locked', 'unlocked')
+        self._wal = wal
         self._clients = []
         self._in_progress = None
         # Precreate a finished InProgress object that we can return when
@@ -81,7 +95,7 @@ class ReadLock(object):
 
 
     def __inprogress__(self):
-        if self._clients:
+        if self._clients and not self._wal:
             # We are locked.  Create a new InProgress on-demand if necessary.
             if not self._in_progress:
                 self._in_progress = kaa.InProgress()
@@ -124,7 +138,7 @@ class ReadLock(object):
         """
         True if locked.
         """
-        return bool(self._clients)
+        return bool(self._clients) and not self._wal
 
 
 
@@ -150,14 +164,14 @@ class Database(RO_Database):
         """
         Init function
         """
-        super(Database,self).__init__(dbdir)
+        super(Database,self).__init__(dbdir, readers=DB_READERS)
 
         # handle changes in a list and add them to the database
         # on commit.
         self.changes = []
 
         # server lock when a client is doing something
-        self.read_lock = ReadLock()
+        self.read_lock = ReadLock(self._db.wal)
         self.read_lock.signals['locked'].connect_weak(self.commit)
 
         # register basic types
@@ -194,6 +208,25 @@ class Database(RO_Database):
         return kaa.inprogress(self.read_lock)
 
 
+    @kaa.coroutine()
+    def _db_query_raw(self, query, partial=None):
+        """
+        Do a 'raw' query (see the client side Database).  If the database is
+        in WAL mode and there are no pending changes, the rows are fetched in
+        a thread using a read-only connection, so a long query (e.g. from a
+        monitor) doesn't hold up the crawler and parser in the main loop.
+        """
+        rows = None
+        if self._db.wal and not self.changes:
+            rows = yield self._db_query_rows(query)
+        yield (yield super(Database, self)._db_query_raw(query, partial, rows))
+
+
+    @kaa.threaded(DB_THREAD)
+    def _db_query_rows(self, query):
+        return self._db.query(**query)
+
+
     def _query_filename_get_dir_create(self, name, parent):
         """
         Adds a directory to the db.  Called from _query_filename_get_dir in
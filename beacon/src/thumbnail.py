@@ -265,6 +265,7 @@ class Client(object):
                 channel = kaa.rpc.connect('thumb/socket')
                 channel.register(self)
                 self.rpc = channel.rpc
+                self.batch = channel.batch
                 yield kaa.inprogress(channel)
                 yield None
             except Exception, e:
@@ -288,8 +289,9 @@ class Client(object):
     @kaa.rpc.expose('connect')
     def _server_callback_connected(self, id):
         self.id = id
-        for s in self._schedules:
-            self.schedule(*s)
+        with self.batch():
+            for s in self._schedules:
+                self.schedule(*s)
         self._schedules = []
 
     @kaa.rpc.expose('log.info')
@@ -299,18 +301,19 @@ class Client(object):
     @kaa.rpc.expose('finished')
     def _server_callback_finished(self, id, filename, imagefile):
         log.info('finished job %s -> %s', filename, imagefile % ('large' if '%s' in imagefile else ()))
-        for job in Job.all[:]:
-            if job.id == id:
-                # found updated job
+        with self.batch():
+            for job in Job.all[:]:
+                if job.id == id:
+                    # found updated job
+                    Job.all.remove(job)
+                    job.signal.emit()
+                    continue
+                if job.valid:
+                    continue
+                # set old jobs to lower priority
                 Job.all.remove(job)
-                job.signal.emit()
-                continue
-            if job.valid:
-                continue
-            # set old jobs to lower priority
-            Job.all.remove(job)
-            if job.priority != Thumbnail.PRIORITY_LOW:
-                self.rpc('set_priority', (self.id, job.id), Thumbnail.PRIORITY_LOW)
+                if job.priority != Thumbnail.PRIORITY_LOW:
+                    self.rpc('set_priority', (self.id, job.id), Thumbnail.PRIORITY_LOW)
 
 _client = Client()
 connect = _client.connect
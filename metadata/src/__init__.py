@@ -42,23 +42,30 @@ from core import Media, MEDIA_AUDIO, MEDIA_VIDEO, MEDIA_IMAGE, MEDIA_AV, \
 # use network functions
 USE_NETWORK = 1
 
+# Parsers with a magic header are tried first for files starting with it,
+# whatever their extension.  Only set it for signatures no other format
+# has.
+
 # Audio parsers
 register('audio/mpeg', ('mp3',), 'audio.mp3')
 register('audio/ac3', ('ac3',), 'audio.ac3')
 register('application/adts', ('aac',), 'audio.adts')
-register('audio/m4a', ('m4a',), 'audio.m4a')
+register('audio/m4a', ('m4a',), 'audio.m4a', magic=(8, 'M4A '))
 register('application/ogg', ('ogg',), 'audio.ogg', magic='OggS\00')
 register('application/pcm', ('aif','voc','au'), 'audio.pcm')
 
 # Video parsers
-register('video/asf', ('asf','wmv','wma'), 'video.asf')
-register('video/flv', ('flv',), 'video.flv')
-register('application/mkv', ('mkv', 'mka', 'webm'), 'video.mkv')
-register('video/quicktime', ('mov', 'qt', 'mp4', 'mp4a', '3gp', '3gp2', 'mk2'), 'video.mp4')
-register('video/mpeg', ('mpeg','mpg','mp4', 'ts'), 'video.mpeg')
-register('application/ogg', ('ogm', 'ogg'), 'video.ogm')
-register('video/real', ('rm', 'ra', 'ram'), 'video.real')
-register('video/avi', ('wav','avi'), 'video.riff')
+register('video/asf', ('asf','wmv','wma'), 'video.asf',
+         magic='\x30\x26\xb2\x75\x8e\x66\xcf\x11\xa6\xd9\x00\xaa\x00\x62\xce\x6c')
+register('video/flv', ('flv',), 'video.flv', magic='FLV')
+register('application/mkv', ('mkv', 'mka', 'webm'), 'video.mkv', magic='\x1a\x45\xdf\xa3')
+register('video/quicktime', ('mov', 'qt', 'mp4', 'mp4a', '3gp', '3gp2', 'mk2'), 'video.mp4',
+         magic=[(4, 'ftyp'), (4, 'moov'), (4, 'wide')])
+register('video/mpeg', ('mpeg','mpg','mp4', 'ts'), 'video.mpeg',
+         magic=['\x00\x00\x01\xba', '\x00\x00\x01\xb3'])
+register('application/ogg', ('ogm', 'ogg'), 'video.ogm', magic='OggS\00')
+register('video/real', ('rm', 'ra', 'ram'), 'video.real', magic='.RMF')
+register('video/avi', ('wav','avi'), 'video.riff', magic=[(8, 'AVI '), (8, 'WAVE')])
 register('video/vcd', ('cue',), 'video.vcd')
 
 # Disc parsers
@@ -77,10 +84,10 @@ if 0:
     register('image/png', ('png',), 'image.png')
 else:
     register('image/bmp', ('bmp', ), 'image.bmp')
-    register('image/gif', ('gif', ), 'image.gif')
-    register('image/jpeg', ('jpg','jpeg'), 'image.jpg')
-    register('image/png', ('png',), 'image.png')
-    register('image/tiff', ('tif','tiff'), 'image.tiff')
+    register('image/gif', ('gif', ), 'image.gif', magic=['GIF87a', 'GIF89a'])
+    register('image/jpeg', ('jpg','jpeg'), 'image.jpg', magic='\xff\xd8\xff')
+    register('image/png', ('png',), 'image.png', magic='\x89PNG\r\n\x1a\n')
+    register('image/tiff', ('tif','tiff'), 'image.tiff', magic=['II\x2a\x00', 'MM\x00\x2a'])
 
 # Games parsers
 register('games/gameboy', ('gba', 'gb', 'gbc'), 'games.gameboy')
@@ -93,4 +100,4 @@ register('text/xml', ('xml', 'fxd', 'html', 'htm'), 'misc.xmlfile')
 # These parsers are prone to producing false positives, so we use them
 # last.  They should be fixed.
 register('text/plain', EXTENSION_STREAM, 'audio.webradio')
-register('application/flac', ('flac',), 'audio.flac')
+register('application/flac', ('flac',), 'audio.flac', magic='fLaC')
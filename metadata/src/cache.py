@@ -0,0 +1,209 @@
+# -*- coding: iso-8859-1 -*-
+# -----------------------------------------------------------------------------
+# cache.py - On-disk cache of parse results
+# -----------------------------------------------------------------------------
+# $Id$
+#
+# -----------------------------------------------------------------------------
+# kaa-Metadata - Media Metadata for Python
+# Copyright (C) 2003-2006 Thomas Schueppel, Dirk Meyer
+#
+# Please see the file AUTHORS for a complete list of authors.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MER-
+# CHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+# -----------------------------------------------------------------------------
+
+__all__ = [ 'Cache' ]
+
+# python imports
+import zlib
+import cPickle
+import sqlite3
+import logging
+import threading
+
+# kaa.metadata imports
+from version import VERSION
+
+# get logging object
+log = logging.getLogger('metadata')
+
+# Changes when the format of the cached data changes.  The cache is
+# cleared when it or the kaa.metadata version differ from the ones
+# it was written with.
+CACHE_FORMAT = 1
+
+# number of changes after which they are committed to the database
+CACHE_SYNC_INTERVAL = 100
+
+
+class Cache(object):
+    """
+    Cache of parse results in a sqlite database. Results are stored for
+    the device, inode, size and modification time from os.stat(), a file
+    with a different size or modification time is parsed again. Once the
+    stored results take more than maxsize bytes, the least recently used
+    are removed until they take three quarters of it.
+
+    The cache may be used from any thread. After close() lookups miss
+    and nothing is stored.
+    """
+    def __init__(self, filename, maxsize=64*1024*1024):
+        self.filename = filename
+        self.maxsize = maxsize
+        # The connection is shared by all threads, one at a time.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, timeout=10, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (dev INTEGER, ino INTEGER, size INTEGER, '
+                         'mtime REAL, used INTEGER, data BLOB, PRIMARY KEY (dev, ino))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        version = '%s-%d' % (VERSION, CACHE_FORMAT)
+        row = self._db.execute("SELECT value FROM meta WHERE name='version'").fetchone()
+        if not row or row[0] != version:
+            log.info('kaa.metadata version changed, clearing cache %s', filename)
+            self._db.execute('DELETE FROM results')
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+            self._db.commit()
+        self._used, self._size = self._db.execute('SELECT MAX(used), SUM(LENGTH(data)) FROM results').fetchone()
+        self._used = self._used or 0
+        self._size = self._size or 0
+        # changes not committed yet
+        self._changes = 0
+
+
+    def lookup(self, st):
+        """
+        Return the result stored for the os.stat() result st. Raises
+        KeyError if there is none for the file in this state.
+        """
+        self._lock.acquire()
+        try:
+            if self._db is None:
+                raise KeyError(st.st_ino)
+            row = self._db.execute('SELECT size, mtime, data FROM results WHERE dev=? AND ino=?',
+                                   (st.st_dev, st.st_ino)).fetchone()
+            if not row or row[0] != st.st_size or row[1] != st.st_mtime:
+                raise KeyError(st.st_ino)
+            self._used += 1
+            self._db.execute('UPDATE results SET used=? WHERE dev=? AND ino=?',
+                             (self._used, st.st_dev, st.st_ino))
+            self._changed()
+        except sqlite3.Error, e:
+            log.error('metadata cache %s: %s', self.filename, e)
+            raise KeyError(st.st_ino)
+        finally:
+            self._lock.release()
+        return cPickle.loads(zlib.decompress(row[2]))
+
+
+    def store(self, st, result):
+        """
+        Store result, which may be None, for the os.stat() result st.
+        """
+        try:
+            data = zlib.compress(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+        except Exception:
+            log.exception('unable to cache %s', getattr(result, 'url', None))
+            return
+        self._lock.acquire()
+        try:
+            if self._db is None:
+                return
+            row = self._db.execute('SELECT LENGTH(data) FROM results WHERE dev=? AND ino=?',
+                                   (st.st_dev, st.st_ino)).fetchone()
+            if row:
+                self._size -= row[0]
+            self._used += 1
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                             (st.st_dev, st.st_ino, st.st_size, st.st_mtime, self._used, buffer(data)))
+            self._size += len(data)
+            if self._size > self.maxsize:
+                self._evict()
+            self._changed()
+        except sqlite3.Error, e:
+            log.error('metadata cache %s: %s', self.filename, e)
+        finally:
+            self._lock.release()
+
+
+    def _evict(self):
+        """
+        Remove the least recently used results until the rest takes three
+        quarters of maxsize.
+        """
+        excess = self._size - self.maxsize * 3 / 4
+        for used, length in self._db.execute('SELECT used, LENGTH(data) FROM results ORDER BY used'):
+            excess -= length
+            if excess <= 0:
+                break
+        self._db.execute('DELETE FROM results WHERE used <= ?', (used,))
+        self._size = self._db.execute('SELECT SUM(LENGTH(data)) FROM results').fetchone()[0] or 0
+
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= CACHE_SYNC_INTERVAL:
+            self._sync()
+
+
+    def _sync(self):
+        if self._changes:
+            self._db.commit()
+            self._changes = 0
+
+
+    def sync(self):
+        """
+        Commit the changes to the database.
+        """
+        self._lock.acquire()
+        try:
+            if self._db is not None:
+                self._sync()
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        """
+        Remove all results.
+        """
+        self._lock.acquire()
+        try:
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+                self._size = self._changes = 0
+        finally:
+            self._lock.release()
+
+
+    def close(self):
+        """
+        Commit the changes and close the database.
+        """
+        self._lock.acquire()
+        try:
+            if self._db is not None:
+                self._sync()
+                self._db.close()
+                self._db = None
+        finally:
+            self._lock.release()
@@ -119,6 +119,9 @@ class Media(object):
     """
     _keys = MEDIACORE
     table_mapping = {}
+    # Keys not parsed yet when parsing with depth='summary'. They are
+    # parsed by _parse_lazy() when one of them is used first.
+    _lazy = ()
 
     def __init__(self, hash=None):
         if hash is not None:
@@ -268,7 +271,7 @@ class Media(object):
         """
         # make sure all strings are unicode
         for key in self._keys:
-            if key in UNPRINTABLE_KEYS:
+            if key in UNPRINTABLE_KEYS or key in self._lazy:
                 continue
             value = getattr(self, key)
             if value is None:
@@ -308,6 +311,47 @@ class Media(object):
             self.langcode, self.language = language.resolve(self.language)
 
 
+    def __getattr__(self, attr):
+        """
+        Parse the keys not parsed yet when one of them is used.
+        """
+        if attr in self._lazy:
+            self._parse_lazy()
+            return getattr(self, attr)
+        raise AttributeError(attr)
+
+
+    def _defer(self, keys, parent=None):
+        """
+        Remove keys until _parse_lazy() is called. Their current values
+        are set again before it parses them. For a Media object inside
+        another one, parent is the object whose _parse_lazy() sets them.
+        """
+        if not keys:
+            return
+        self._lazy = tuple(keys)
+        self._lazy_values = dict((key, self.__dict__.pop(key, None)) for key in keys)
+        self._lazy_parent = parent
+
+
+    def _undefer(self):
+        """
+        Set the keys removed by _defer() to their old values again.
+        """
+        if self._lazy:
+            self.__dict__.update(self._lazy_values)
+            self._lazy = ()
+            del self._lazy_values, self._lazy_parent
+
+
+    def _parse_lazy(self):
+        """
+        Set the keys in _lazy. Parsers deferring keys of the object
+        they return must override this.
+        """
+        self._lazy_parent._parse_lazy()
+
+
     #
     # data access
     #
@@ -119,7 +119,8 @@ class DVDInfo(core.Disc):
         core.Disc.__init__(self)
         self.offset = 0
 
-        if isinstance(device, file):
+        if not isinstance(device, basestring):
+            # iso file opened by the factory
             self.parseDVDiso(device)
         elif os.path.isdir(device):
             self.parseDVDdir(device)
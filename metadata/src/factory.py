@@ -29,9 +29,12 @@
 #
 # -----------------------------------------------------------------------------
 
-__all__ = [ 'Factory', 'register', 'gettype', 'parse' ]
+__all__ = [ 'Factory', 'register', 'gettype', 'parse', 'parse_many', 'enable_cache',
+            'disable_cache' ]
 
 # python imports
+import atexit
+import errno
 import stat
 import os
 import sys
@@ -52,9 +55,22 @@ log = logging.getLogger('metadata')
 # factory object
 _factory = None
 
+# cache.Cache object set by enable_cache()
+_cache = None
+
 # some timing debug
 TIME_DEBUG = False
 
+# number of files parse_many() sends to a worker at once
+PARSE_MANY_CHUNKSIZE = 8
+
+# values for the depth argument of parse()
+DEPTHS = ('full', 'summary')
+
+# bytes read from a file at once, and number of such blocks kept
+FILE_BLOCKSIZE = 64 * 1024
+FILE_BLOCKS = 4
+
 R_MIMETYPE  = 0
 R_EXTENSION = 1
 R_CLASS     = 2
@@ -62,6 +78,11 @@ R_CLASS     = 2
 def register(mimetype, extensions, c, magic=None):
     """
     Register a parser to the factory.
+
+    magic is a signature the file must start with for the parser, an
+    (offset, signature) tuple for a signature not at the beginning,
+    or a list of those. Files matching a signature are given to the
+    parser first, whatever their extension.
     """
     return Factory().register(mimetype, extensions, c, magic)
 
@@ -73,21 +94,264 @@ def gettype(mimetype, extensions):
     return Factory().get(mimetype,extensions)
 
 
-def parse(filename, force=True):
+def parse(filename, force=True, depth='full'):
     """
     parse a file
+
+    With depth='summary' parsers may skip parts of the file which are
+    not needed for the basic attributes like length, width and height.
+    These parts are parsed when one of the attributes they set is used
+    first, so the result looks the same; the Matroska parser does this
+    for chapters, attachments and tags.
     """
-    result = Factory().create(filename, force)
+    if depth not in DEPTHS:
+        raise ValueError('depth must be one of %s' % ', '.join(DEPTHS))
+    # disable_cache() may be called from another thread meanwhile
+    cache = _cache
+    st = _cache_stat(cache, filename)
+    if st is not None:
+        try:
+            return _cache_lookup(cache, filename, st)
+        except KeyError:
+            pass
+    result = _parse(filename, force, depth)
+    if st is not None and _cache_complete(force, depth):
+        cache.store(st, result)
+    return result
+
+
+def _parse(filename, force, depth):
+    result = Factory().create(filename, force, depth)
     if result:
         result._finalize()
     return result
 
 
+def _parse_job(job):
+    """
+    parse() in a worker process of parse_many()
+    """
+    filename, force, depth = job
+    return filename, _parse(filename, force, depth)
+
+
+def parse_many(filenames, workers=None, force=True, depth='full'):
+    """
+    Parse many files in parallel in worker processes. Returns an
+    iterator yielding (filename, result) tuples in the order the files
+    are parsed, result is what parse() returns for the file. Workers
+    defaults to the number of CPUs, with one worker (or without the
+    multiprocessing module) the files are parsed in this process.
+    """
+    if depth not in DEPTHS:
+        raise ValueError('depth must be one of %s' % ', '.join(DEPTHS))
+    if workers is None:
+        try:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            workers = 1
+    if workers > 1:
+        try:
+            import multiprocessing
+        except ImportError:
+            workers = 1
+    if workers <= 1:
+        return ((filename, parse(filename, force, depth)) for filename in filenames)
+    return _parse_many(filenames, workers, force, depth)
+
+
+def _parse_many(filenames, workers, force, depth):
+    import multiprocessing
+    # Files with a cached result are not sent to the workers, they
+    # don't use the cache.
+    cache = _cache
+    jobs = []
+    stats = {}
+    for filename in filenames:
+        st = _cache_stat(cache, filename)
+        if st is not None:
+            try:
+                yield filename, _cache_lookup(cache, filename, st)
+                continue
+            except KeyError:
+                if _cache_complete(force, depth):
+                    stats[filename] = st
+        jobs.append((filename, force, depth))
+    if not jobs:
+        return
+    # Import the parsers before the workers are forked, so they don't
+    # import them again each.
+    Factory().import_parsers()
+    pool = multiprocessing.Pool(workers, _import_parsers)
+    try:
+        for filename, result in pool.imap_unordered(_parse_job, jobs, PARSE_MANY_CHUNKSIZE):
+            if filename in stats:
+                cache.store(stats[filename], result)
+            yield filename, result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _import_parsers():
+    Factory().import_parsers()
+
+
+def enable_cache(filename, maxsize=64*1024*1024):
+    """
+    Cache parse results in the sqlite database filename. parse() and
+    parse_many() return the cached result for a file unless its size or
+    modification time changed, without opening it. The least recently
+    used results are removed when they take more than maxsize bytes, all
+    of them when kaa.metadata is updated. Only the results of calls with
+    force=True and depth='full' are stored, the others may miss
+    something or read the file later.
+    """
+    global _cache
+    import cache
+    disable_cache()
+    _cache = cache.Cache(filename, maxsize)
+
+
+def disable_cache():
+    """
+    Stop using the cache enabled with enable_cache().
+    """
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+atexit.register(disable_cache)
+
+
+def _cache_stat(cache, filename):
+    """
+    Return the os.stat() result of filename if it is a regular file and
+    cache is not None, None otherwise.
+    """
+    if cache is None or filename.find('://') > 0:
+        return None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st
+
+
+def _cache_complete(force, depth):
+    """
+    Return True if results of a parse with these arguments are stored in
+    the cache.
+    """
+    return force and depth == 'full'
+
+
+def _cache_lookup(cache, filename, st):
+    """
+    Return the cached result for filename or raise KeyError.
+    """
+    result = cache.lookup(st)
+    if result:
+        # The file may have another name than when it was parsed.
+        scheme = Factory().get_scheme_from_info(result)
+        result._set_url('%s://%s' % (scheme, os.path.abspath(filename)))
+    return result
+
+
 class NullParser(object):
     def __init__(self, file):
         raise core.ParseError
 
-class File(file):
+class _Source(object):
+    """
+    Open file shared by a File and its windows, with the blocks last read
+    from it.
+    """
+    def __init__(self, name):
+        self.fd = None
+        self.fd = os.open(name, os.O_RDONLY)
+        self.size = os.fstat(self.fd)[stat.ST_SIZE]
+        # (offset, data) tuples, most recently used first
+        self.blocks = []
+        # number of reads from the file
+        self.reads = 0
+
+
+    def read(self, offset, bytes):
+        """
+        Return the bytes at offset, from the blocks read if possible.
+        """
+        bytes = min(bytes, self.size - offset)
+        if bytes <= 0:
+            return ''
+        for block in self.blocks:
+            start = offset - block[0]
+            if start >= 0 and start + bytes <= len(block[1]):
+                if block is not self.blocks[0]:
+                    self.blocks.remove(block)
+                    self.blocks.insert(0, block)
+                return block[1][start:start+bytes]
+        # Read a whole block, or the last one of the file if the offset
+        # is in it, so parsers reading backwards from the end find the
+        # data in it as well.
+        length = max(bytes, FILE_BLOCKSIZE)
+        pos = max(0, min(offset, self.size - length))
+        os.lseek(self.fd, pos, 0)
+        data = ''
+        while len(data) < length:
+            chunk = os.read(self.fd, length - len(data))
+            self.reads += 1
+            if not chunk:
+                break
+            data += chunk
+        self.blocks.insert(0, (pos, data))
+        del self.blocks[FILE_BLOCKS:]
+        return data[offset-pos:offset-pos+bytes]
+
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+    def __del__(self):
+        self.close()
+
+
+    def __getstate__(self):
+        # Some parsers keep the File in their result, don't pickle the
+        # blocks read with it.
+        return dict(self.__dict__, fd=None, blocks=[])
+
+
+class File(object):
+    """
+    File given to the parsers. It reads the file in blocks of
+    FILE_BLOCKSIZE bytes and keeps the last FILE_BLOCKS of them, so the
+    small reads and seeks of the parsers cost a few large reads of the
+    file; the file is seen as of the size it had when it was opened.
+    Besides the methods of a file object, peek() and read_at() read
+    without moving the file position, and window() returns a File
+    for a part of the file. depth is the depth argument of parse().
+    """
+    depth = 'full'
+
+    def __init__(self, name, source=None, offset=0, size=None):
+        self.name = name
+        # windows don't close the file
+        self._owner = source is None
+        self._source = source or _Source(name)
+        self._offset = offset
+        if size is None:
+            size = self._source.size - offset
+        self.size = size
+        self._pos = 0
+
 
     def read(self, bytes=-1):
         """
@@ -95,10 +359,92 @@ class File(file):
         reached. If more than 5MB is requested, an IOError is
         raised. This should not mappen for kaa.metadata parsers.
         """
-        if bytes > 5000000 or (bytes < 0 and os.stat(self.name)[stat.ST_SIZE] - self.tell() > 1000000):
+        if bytes > 5000000 or (bytes < 0 and self.size - self._pos > 1000000):
             # reading more than 1MB looks like a bug
             raise IOError('trying to read %s bytes' % bytes)
-        return super(File, self).read(bytes)
+        if bytes < 0:
+            bytes = self.size
+        data = self.read_at(self._pos, bytes)
+        self._pos += len(data)
+        return data
+
+
+    def read_at(self, offset, bytes):
+        """
+        Return up to bytes bytes at offset.
+        """
+        bytes = min(bytes, self.size - offset)
+        if bytes <= 0 or offset < 0:
+            return ''
+        return self._source.read(self._offset + offset, bytes)
+
+
+    def peek(self, bytes):
+        """
+        Return up to bytes bytes at the current position without
+        moving it.
+        """
+        return self.read_at(self._pos, bytes)
+
+
+    def readline(self, bytes=-1):
+        line = ''
+        while bytes < 0 or len(line) < bytes:
+            data = self.peek(min(1024, bytes - len(line)) if bytes >= 0 else 1024)
+            if not data:
+                break
+            end = data.find('\n') + 1
+            if end:
+                data = data[:end]
+            line += data
+            self._pos += len(data)
+            if end:
+                break
+        return line
+
+
+    def readlines(self, hint=-1):
+        lines = []
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+        return lines
+
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        if offset < 0:
+            raise IOError(errno.EINVAL, 'Invalid argument')
+        self._pos = offset
+
+
+    def tell(self):
+        return self._pos
+
+
+    def window(self, offset, size):
+        """
+        Return a File for size bytes at offset. Its positions are
+        relative to offset and it ends after size bytes. It shares the
+        blocks read with this File.
+        """
+        offset = max(0, min(offset, self.size))
+        return File(self.name, self._source, self._offset + offset, min(size, self.size - offset))
+
+
+    def fileno(self):
+        return self._source.fd
+
+
+    def close(self):
+        if self._owner:
+            self._source.close()
+
 
 class _Factory:
     """
@@ -110,6 +456,8 @@ class _Factory:
         self.mimemap = {}
         self.classmap = {}
         self.magicmap = {}
+        self.magicorder = {}
+        self.magictable = None
         self.types = []
         self.device_types = []
         self.directory_types = []
@@ -131,6 +479,14 @@ class _Factory:
         return self.classmap[name]
 
 
+    def import_parsers(self):
+        """
+        Import the parser classes for files.
+        """
+        for info in self.types + self.stream_types:
+            self.get_class(info[R_CLASS])
+
+
     def get_scheme_from_info(self, info):
         if info.__class__.__name__ == 'DVDInfo':
             return 'dvd'
@@ -142,43 +498,61 @@ class _Factory:
         """
         create based on the file stream 'file
         """
-        # Check extension as a hint
+        # Parsers already tried on this file
+        tried = []
+        def attempt(info):
+            parser = self.get_class(info[R_CLASS])
+            if parser in tried:
+                # We already tried this parser, don't bother again.
+                return None
+            tried.append(parser)
+            file.seek(0,0)
+            try:
+                return parser(file)
+            except core.ParseError:
+                pass
+            except Exception:
+                log.exception('parse error')
+            return None
+
         e = os.path.splitext(file.name)[1].lower()
-        parser = None
+        extparsers = []
         if e and e.startswith('.') and e[1:] in self.extmap:
-            log.debug("trying ext %s on file %s", e[1:], file.name)
-            parsers = self.extmap[e[1:]]
-            for info in parsers:
-                file.seek(0,0)
-                try:
-                    parser = self.get_class(info[R_CLASS])
-                    return parser(file)
-                except core.ParseError:
-                    pass
-                except Exception:
-                    log.exception('parse error')
+            extparsers = self.extmap[e[1:]]
 
         # Try to find a parser based on the first bytes of the
         # file (magic header). If a magic header is found but the
-        # parser failed, no other parser will be tried to speed
-        # up parsing of a bunch of files. So magic information should
-        # only be set if the parser is very sure
+        # parser failed, only the parsers for the extension are
+        # tried after it, not all parsers, to speed up parsing of a
+        # bunch of files. So magic information should only be set if
+        # the parser is very sure
+        size, table = self.get_magic_table()
         file.seek(0,0)
-        magic = file.read(10)
-        for length, magicmap in self.magicmap.items():
-            if magic[:length] in magicmap:
-                for p in magicmap[magic[:length]]:
-                    log.info('Trying %s by magic header', p[R_CLASS])
-                    file.seek(0,0)
-                    try:
-                        parser = self.get_class(p[R_CLASS])
-                        return parser(file)
-                    except core.ParseError:
-                        pass
-                    except Exception:
-                        log.exception('parse error')
-                log.info('Magic header found but parser failed')
-                return None
+        head = file.read(size)
+        candidates = []
+        for offset, length, magicmap in table:
+            for info in magicmap.get(head[offset:offset+length], ()):
+                if info not in candidates:
+                    candidates.append(info)
+        if candidates:
+            candidates.sort(key=self.magicorder.get)
+            # Parsers for the extension go first if the magic
+            # header matches them as well.
+            candidates.sort(key=lambda info: info not in extparsers)
+            for info in candidates:
+                log.info('Trying %s by magic header', info[R_CLASS])
+                result = attempt(info)
+                if result is not None:
+                    return result
+            log.info('Magic header found but parser failed')
+            force = False
+
+        # Check extension as a hint
+        for info in extparsers:
+            log.debug("trying ext %s on file %s", e[1:], file.name)
+            result = attempt(info)
+            if result is not None:
+                return result
 
         if not force:
             log.info('No Type found by Extension (%s). Giving up.' % e)
@@ -186,22 +560,15 @@ class _Factory:
 
         log.info('No Type found by Extension (%s). Trying all parsers.' % e)
 
-        for e in self.types:
-            if self.get_class(e[R_CLASS]) == parser:
-                # We already tried this parser, don't bother again.
-                continue
-            log.debug('trying %s' % e[R_MIMETYPE])
-            file.seek(0,0)
-            try:
-                return self.get_class(e[R_CLASS])(file)
-            except core.ParseError:
-                pass
-            except Exception:
-                log.exception('parser error')
+        for info in self.types:
+            log.debug('trying %s' % info[R_MIMETYPE])
+            result = attempt(info)
+            if result is not None:
+                return result
         return None
 
 
-    def create_from_url(self, url, force=True):
+    def create_from_url(self, url, force=True, depth='full'):
         """
         Create information for urls. This includes file:// and cd://
         """
@@ -210,10 +577,10 @@ class _Factory:
 
         if scheme == 'file':
             (scheme, location, path, query, fragment) = split
-            return self.create_from_filename(location+path, force)
+            return self.create_from_filename(location+path, force, depth)
 
         elif scheme == 'cdda':
-            r = self.create_from_filename(split[4], force)
+            r = self.create_from_filename(split[4], force, depth)
             if r:
                 r._set_url(url)
             return r
@@ -255,7 +622,7 @@ class _Factory:
             # XXX Todo: Try other types
 
 
-    def create_from_filename(self, filename, force=True):
+    def create_from_filename(self, filename, force=True, depth='full'):
         """
         Create information for the given filename
         """
@@ -263,10 +630,11 @@ class _Factory:
             return None
         if os.path.isfile(filename):
             try:
-                f = File(filename,'rb')
+                f = File(filename)
             except (IOError, OSError), e:
                 log.info('error reading %s: %s' % (filename, e))
                 return None
+            f.depth = depth
             result = self.create_from_file(f, force)
             # create a hash for the file based on hashes from
             # http://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes
@@ -317,14 +685,14 @@ class _Factory:
         return None
 
 
-    def create(self, name, force=True):
+    def create(self, name, force=True, depth='full'):
         """
         Global 'create' function. This function calls the different
         'create_from_'-functions.
         """
         try:
             if name.find('://') > 0:
-                return self.create_from_url(name)
+                return self.create_from_url(name, depth=depth)
             if not os.path.exists(name):
                 return None
             if (os.uname()[0] == 'FreeBSD' and \
@@ -333,7 +701,7 @@ class _Factory:
                 return self.create_from_device(name)
             if os.path.isdir(name):
                 return self.create_from_directory(name)
-            return self.create_from_filename(name, force)
+            return self.create_from_filename(name, force, depth)
         except Exception:
             log.exception('kaa.metadata.create error')
             log.warning('Please report this bug to the Freevo mailing list')
@@ -364,11 +732,37 @@ class _Factory:
 
         # add to magic header list
         if magic is not None:
-            if not len(magic) in self.magicmap:
-                self.magicmap[len(magic)] = {}
-            if not magic in self.magicmap[len(magic)]:
-                self.magicmap[len(magic)][magic] = []
-            self.magicmap[len(magic)][magic].append(tuple)
+            if not isinstance(magic, list):
+                magic = [ magic ]
+            for signature in magic:
+                if isinstance(signature, basestring):
+                    signature = 0, signature
+                offset, signature = signature
+                key = offset, len(signature)
+                if not key in self.magicmap:
+                    self.magicmap[key] = {}
+                if not signature in self.magicmap[key]:
+                    self.magicmap[key][signature] = []
+                self.magicmap[key][signature].append(tuple)
+            if tuple not in self.magicorder:
+                self.magicorder[tuple] = len(self.magicorder)
+            self.magictable = None
+
+
+    def get_magic_table(self):
+        """
+        Return the number of bytes from the beginning of a file needed
+        to check all magic headers and a list of (offset, length, map)
+        tuples with map mapping the bytes at offset to the parsers.
+        The table is built on first use after a register() call.
+        """
+        if self.magictable is None:
+            table = [ (offset, length, magicmap) for (offset, length), magicmap in self.magicmap.items() ]
+            # longest signatures first
+            table.sort(key=lambda (offset, length, magicmap): (-length, offset))
+            size = max([ offset + length for offset, length, magicmap in table ] or [0])
+            self.magictable = size, table
+        return self.magictable
 
 
     def get(self, mimetype, extensions):
@@ -32,6 +32,7 @@ __all__ = ['Parser']
 
 # python imports
 from struct import unpack
+import os
 import logging
 import re
 from datetime import datetime
@@ -122,6 +123,10 @@ MATROSKA_TAG_LANGUAGE_ID          = 0x447A
 MATROSKA_TAG_STRING_ID            = 0x4487
 MATROSKA_TAG_BINARY_ID            = 0x4485
 
+# Elements not parsed with depth='summary' until they are needed, in the
+# order they are parsed then.
+DEFERRED_IDS = (MATROSKA_CHAPTERS_ID, MATROSKA_ATTACHMENTS_ID, MATROSKA_TAGS_ID)
+
 
 # See mkv spec for details:
 # http://www.matroska.org/technical/specs/index.html
@@ -381,6 +386,10 @@ class Matroska(core.AVContainer):
         self.samplerate = 1
 
         self.file = file
+        # With depth='summary' the chapters, attachments and tags are
+        # parsed when first used, (element id, file offset) tuples.
+        self._summary = getattr(file, 'depth', 'full') == 'summary'
+        self._deferred = []
         # Read enough that we're likely to get the full seekhead (FIXME: kludge)
         buffer = file.read(2000)
         if len(buffer) == 0:
@@ -418,6 +427,76 @@ class Matroska(core.AVContainer):
             log.debug('WARNING: file has no index')
             self._set('corrupt', True)
 
+        if self._deferred:
+            self.defer_keys(file.name)
+
+
+    def defer_keys(self, filename):
+        """
+        Defer the keys set by the elements skipped with depth='summary'.
+        """
+        st = os.stat(filename)
+        self._deferred_file = os.path.abspath(filename), st.st_size, st.st_mtime
+        ids = [ elem_id for elem_id, offset in self._deferred ]
+        keys = []
+        if MATROSKA_CHAPTERS_ID in ids:
+            keys.append('chapters')
+        if MATROSKA_ATTACHMENTS_ID in ids:
+            keys.append('thumbnail')
+        if MATROSKA_TAGS_ID in ids:
+            # Everything tags_to_attributes() may set.  The url is set by
+            # the factory and must not change.
+            tag_keys = [ 'tags' ]
+            for attr, filter in TAGS_MAP.values():
+                if attr != 'url' and attr not in tag_keys:
+                    tag_keys.append(attr)
+            keys.extend(tag_keys + [ 'season', 'episode', 'series' ])
+            for track in self.objects_by_uid.values():
+                track._defer([ key for key in tag_keys if key in track._keys ], self)
+        self._defer([ key for key in keys if key in self._keys ])
+
+
+    def _parse_lazy(self):
+        """
+        Parse the elements skipped with depth='summary'.
+        """
+        url = self.url
+        self._undefer()
+        for track in self.objects_by_uid.values():
+            track._undefer()
+        deferred, self._deferred = self._deferred, []
+        filename, size, mtime = self._deferred_file
+        try:
+            st = os.stat(filename)
+            if st.st_size != size or st.st_mtime != mtime:
+                log.warning('%s changed since it was parsed', filename)
+                return
+            file = open(filename, 'rb')
+        except (IOError, OSError), e:
+            log.warning('unable to parse %s: %s', filename, e)
+            return
+        # Chapters first, tags may refer to them.
+        for elem_id, offset in sorted(deferred, key=lambda (elem_id, offset): DEFERRED_IDS.index(elem_id)):
+            try:
+                self.process_elem(self.read_elem(file, offset))
+            except core.ParseError:
+                pass
+        file.close()
+        self.url = url
+        for chapter in self.chapters:
+            chapter._finalize()
+
+
+    def read_elem(self, file, offset):
+        """
+        Read the element at offset in the segment.
+        """
+        file.seek(offset)
+        elem = EbmlEntity(file.read(100))
+        # Fetch all data necessary for this element.
+        elem.add_data(file.read(elem.ebml_length))
+        return elem
+
     def process_elem(self, elem):
         elem_id = elem.get_id()
         log.debug('BEGIN: process element %s' % hex(elem_id))
@@ -466,22 +545,23 @@ class Matroska(core.AVContainer):
         for seek_elem in self.process_one_level(elem):
             if seek_elem.get_id() != MATROSKA_SEEK_ID:
                 continue
+            seek_id = None
             for sub_elem in self.process_one_level(seek_elem):
                 if sub_elem.get_id() == MATROSKA_SEEKID_ID:
-                    if sub_elem.get_value() == MATROSKA_CLUSTER_ID:
+                    seek_id = sub_elem.get_value()
+                    if seek_id == MATROSKA_CLUSTER_ID:
                         # Not interested in these.
                         return
 
                 elif sub_elem.get_id() == MATROSKA_SEEK_POSITION_ID:
-                    self.file.seek(self.segment.offset + sub_elem.get_value())
-                    buffer = self.file.read(100)
+                    offset = self.segment.offset + sub_elem.get_value()
+                    if self._summary and seek_id in DEFERRED_IDS:
+                        self._deferred.append((seek_id, offset))
+                        continue
                     try:
-                        elem = EbmlEntity(buffer)
+                        elem = self.read_elem(self.file, offset)
                     except core.ParseError:
                         continue
-
-                    # Fetch all data necessary for this element.
-                    elem.add_data(self.file.read(elem.ebml_length))
                     self.process_elem(elem)
 
 
@@ -511,7 +511,7 @@ class MPEG(core.AVContainer):
         self.filename        = file.name
 
         # get length of the file
-        self.length = self.get_length()
+        self.length = self.get_length(file)
         return 1
 
 
@@ -648,7 +648,7 @@ class MPEG(core.AVContainer):
         self.filename        = file.name
 
         # get length of the file
-        self.length = self.get_length()
+        self.length = self.get_length(file)
         return 1
 
 
@@ -789,7 +789,7 @@ class MPEG(core.AVContainer):
         self.filename        = file.name
 
         # get length of the file
-        self.length = self.get_length()
+        self.length = self.get_length(file)
         return 1
 
 
@@ -831,7 +831,7 @@ class MPEG(core.AVContainer):
 
     # Support functions ==============================================
 
-    def get_endpos(self):
+    def get_endpos(self, file=None):
         """
         get the last timestamp of the mpeg, return -1 if this is not possible
         """
@@ -842,7 +842,11 @@ class MPEG(core.AVContainer):
         if length < self.__sample_size__:
             return
 
-        file = open(self.filename)
+        if file is None:
+            file = open(self.filename)
+            close = True
+        else:
+            close = False
         file.seek(length - self.__sample_size__)
         buffer = file.read(self.__sample_size__)
 
@@ -854,15 +858,16 @@ class MPEG(core.AVContainer):
             end = self.get_time(buffer[pos:]) or end
             buffer = buffer[pos+100:]
 
-        file.close()
+        if close:
+            file.close()
         return end
 
 
-    def get_length(self):
+    def get_length(self, file=None):
         """
         get the length in seconds, return -1 if this is not possible
         """
-        end = self.get_endpos()
+        end = self.get_endpos(file)
         if end == None or self.start == None:
             return None
         if self.start > end:
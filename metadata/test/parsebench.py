@@ -0,0 +1,173 @@
+import os
+import sys
+import time
+import struct
+import shutil
+import tempfile
+
+import kaa.metadata
+
+# Parses a synthetic corpus of MP3, JPEG, Matroska and MP4 files, one after
+# the other with kaa.metadata.parse() and with kaa.metadata.parse_many(), and
+# reports the files parsed per second.  The files are parsed once more with
+# depth='summary', once more under a name with an unknown extension, which
+# leaves finding the parser to the magic headers, and twice with the cache
+# enabled.  The number of files of each type comes from the command line.
+
+# Size of the media data in each file; the parsers only read the headers,
+# but the file hash reads the first and last 64k.
+PAYLOAD = 256 * 1024
+
+def mp3(i):
+    def frame(id, text):
+        data = '\x00' + text
+        return id + struct.pack('>IH', len(data), 0) + data
+    frames = frame('TIT2', 'Title %d' % i) + frame('TPE1', 'Artist %d' % (i % 10)) + \
+             frame('TALB', 'Album %d' % (i % 5)) + frame('TRCK', str(i % 12 + 1))
+    # ID3v2.3 tag size is a 28 bit syncsafe integer.
+    size = ''.join(chr((len(frames) >> shift) & 0x7f) for shift in (21, 14, 7, 0))
+    # MPEG 1 layer 3, 128kbit/s, 44.1kHz frames of 417 bytes.
+    audio = ('\xff\xfb\x90\x64' + '\x00' * 413) * (PAYLOAD / 417)
+    return 'ID3\x03\x00\x00' + size + frames + audio
+
+
+def jpeg(i):
+    app0 = 'JFIF\x00\x01\x01\x01\x00\x48\x00\x48\x00\x00'
+    sof0 = struct.pack('>BHHB', 8, 480 + i % 10, 640, 3) + '\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    def segment(marker, data):
+        return '\xff' + marker + struct.pack('>H', len(data) + 2) + data
+    return '\xff\xd8' + segment('\xe0', app0) + segment('\xc0', sof0) + \
+           segment('\xda', '\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00') + '\x00' * PAYLOAD + '\xff\xd9'
+
+
+def ebml(id, data):
+    # Element with an 8 byte size.
+    return id + '\x01' + struct.pack('>Q', len(data))[1:] + data
+
+def ebml_uint(id, value):
+    return ebml(id, struct.pack('>I', value))
+
+def mkv(i):
+    header = ebml('\x1a\x45\xdf\xa3', ebml_uint('\x42\x86', 1) + ebml('\x42\x82', 'matroska') +
+                  ebml_uint('\x42\x87', 2) + ebml_uint('\x42\x85', 2))
+    info = ebml('\x15\x49\xa9\x66', ebml_uint('\x2a\xd7\xb1', 1000000) +
+                ebml('\x44\x89', struct.pack('>d', 60000.0 + i)) + ebml('\x7b\xa9', 'Movie %d' % i))
+    video = ebml('\xae', ebml_uint('\xd7', 1) + ebml_uint('\x73\xc5', 1) + ebml_uint('\x83', 1) +
+                 ebml('\x86', 'V_MPEG4/ISO/AVC') + ebml('\xe0', ebml_uint('\xb0', 1280) + ebml_uint('\xba', 720)))
+    tracks = [ video ]
+    for n in xrange(2, 10):
+        tracks.append(ebml('\xae', ebml_uint('\xd7', n) + ebml_uint('\x73\xc5', n) + ebml_uint('\x83', 2) +
+                           ebml('\x86', 'A_AC3') + ebml('\x22\xb5\x9c', 'eng') +
+                           ebml('\xe1', ebml_uint('\x9f', 6))))
+    tracks = ebml('\x16\x54\xae\x6b', ''.join(tracks))
+    chapters = ebml('\x10\x43\xa7\x70', ebml('\x45\xb9', ''.join(
+        ebml('\xb6', ebml_uint('\x73\xc4', 100 + n) + ebml('\x91', struct.pack('>Q', n * 300000000000)) +
+             ebml('\x80', ebml('\x85', 'Chapter %d' % n))) for n in xrange(20))))
+    cover = ebml('\x19\x41\xa4\x69', ebml('\x61\xa7', ebml('\x46\x6e', 'cover.jpg') +
+                 ebml('\x46\x60', 'image/jpeg') + ebml('\x46\x5c', jpeg(i)[:64 * 1024])))
+    def tag(target, name, value):
+        return ebml('\x73\x73', ebml('\x63\xc0', target) +
+                    ebml('\x67\xc8', ebml('\x45\xa3', name) + ebml('\x44\x87', value)))
+    tags = [ tag('', 'ARTIST', 'Artist %d' % i), tag('', 'GENRE', 'Genre'), tag('', 'SUMMARY', 'x' * 200) ]
+    for n in xrange(1, 10):
+        tags.append(tag(ebml_uint('\x63\xc5', n), 'BPS', str(128000 * n)))
+    for n in xrange(20):
+        tags.append(tag(ebml_uint('\x63\xc4', 100 + n), 'TITLE', 'Chapter title %d' % n))
+    tags = ebml('\x12\x54\xc3\x67', ''.join(tags))
+    cues = ebml('\x1c\x53\xbb\x6b', ebml('\xbb', ebml_uint('\xb3', 0) +
+                ebml('\xb7', ebml_uint('\xf7', 1) + ebml_uint('\xf1', 0))))
+    cluster = ebml('\x1f\x43\xb6\x75', ebml_uint('\xe7', 0) + ebml('\xa3', '\x00' * PAYLOAD))
+    # The seek head points to the other top level elements by their offset
+    # in the segment, and is of the same size whatever the offsets are.
+    elements = (info, tracks, chapters, cover, tags, cues)
+    def seekhead(offset):
+        seeks = ''
+        for element in elements:
+            seeks += ebml('\x4d\xbb', ebml('\x53\xab', element[:4]) + ebml_uint('\x53\xac', offset))
+            offset += len(element)
+        return ebml('\x11\x4d\x9b\x74', seeks)
+    return header + ebml('\x18\x53\x80\x67', seekhead(len(seekhead(0))) + ''.join(elements) + cluster)
+
+
+def atom(type, data):
+    return struct.pack('>I', len(data) + 8) + type + data
+
+def mp4(i):
+    ftyp = atom('ftyp', 'isom\x00\x00\x02\x00isomiso2avc1mp41')
+    mvhd = atom('mvhd', struct.pack('>IIIII', 0, 0, 0, 1000, 60000 + i) + '\x00' * 80)
+    tkhd = atom('tkhd', struct.pack('>IIIIII', 7, 3500000000, 3500000000, 1, 0, 60000 + i) + '\x00' * 52 +
+                struct.pack('>II', 1280 << 16, 720 << 16))
+    mdhd = atom('mdhd', struct.pack('>IIIII', 0, 0, 0, 1000, 60000 + i) + '\x55\xc4\x00\x00')
+    hdlr = atom('hdlr', struct.pack('>I', 0) + 'mhlrvide' + '\x00' * 12 + 'VideoHandler\x00')
+    stsd = atom('stsd', struct.pack('>II', 0, 1) + atom('avc1', '\x00' * 78))
+    minf = atom('minf', atom('vmhd', '\x00' * 12) + atom('stbl', stsd))
+    trak = atom('trak', tkhd + atom('mdia', mdhd + hdlr + minf))
+    return ftyp + atom('moov', mvhd + trak) + atom('mdat', '\x00' * PAYLOAD)
+
+
+def make_corpus(directory, n):
+    """
+    Writes n files of each type to directory and returns their names.
+    """
+    paths = []
+    for ext, make in (('mp3', mp3), ('jpg', jpeg), ('mkv', mkv), ('mp4', mp4)):
+        for i in xrange(n):
+            path = os.path.join(directory, '%05d.%s' % (i, ext))
+            open(path, 'wb').write(make(i))
+            paths.append(path)
+    return paths
+
+
+def main(n):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = make_corpus(directory, n)
+        t0 = time.time()
+        results = [ kaa.metadata.parse(path) for path in paths ]
+        t = time.time() - t0
+        print '%-30s %7.1f files/s' % ('parse()', len(paths) / t)
+        for path, result in zip(paths, results):
+            assert result, path
+
+        t0 = time.time()
+        results = [ kaa.metadata.parse(path, depth='summary') for path in paths ]
+        t = time.time() - t0
+        print '%-30s %7.1f files/s' % ("parse(), depth='summary'", len(paths) / t)
+        for path, result in zip(paths, results):
+            assert result, path
+
+        # Hard links with an extension no parser is registered for.  The MP3
+        # parser goes by the extension, so MP3 files are left out.
+        unknown = [ path + '.unknown' for path in paths if not path.endswith('.mp3') ]
+        for link in unknown:
+            os.link(link[:-8], link)
+        t0 = time.time()
+        results = [ kaa.metadata.parse(path) for path in unknown ]
+        t = time.time() - t0
+        print '%-30s %7.1f files/s' % ('parse(), unknown extension', len(unknown) / t)
+        for path, result in zip(unknown, results):
+            assert result, path
+
+        for workers in (1, 2, 4):
+            t0 = time.time()
+            results = dict(kaa.metadata.parse_many(paths, workers=workers))
+            t = time.time() - t0
+            print '%-30s %7.1f files/s' % ('parse_many(), %d workers' % workers, len(paths) / t)
+            assert sorted(results) == sorted(paths)
+            assert None not in results.values()
+
+        kaa.metadata.enable_cache(os.path.join(directory, 'cache.db'))
+        for name in ('parse(), filling cache', 'parse(), cached'):
+            t0 = time.time()
+            results = [ kaa.metadata.parse(path) for path in paths ]
+            t = time.time() - t0
+            print '%-30s %7.1f files/s' % (name, len(paths) / t)
+            for path, result in zip(paths, results):
+                assert result, path
+        kaa.metadata.disable_cache()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 250)
@@ -0,0 +1,77 @@
+import os
+import sys
+import struct
+import shutil
+import tempfile
+
+import kaa.metadata
+from parsebench import PAYLOAD, mp3, jpeg, mkv, mp4
+
+# Parses one file of each type in the parsebench corpus, and an AVI and an
+# MPEG program stream file, and reports the number of read system calls
+# each took from /proc/self/io (so it only works on Linux).  The file hash
+# computed for every file takes its share of them.  When a maximum is given
+# on the command line, files taking more fail the test.
+
+def avi(i):
+    def chunk(id, data):
+        return id + struct.pack('<I', len(data)) + data + '\x00' * (len(data) % 2)
+    def riff_list(type, data):
+        return chunk('LIST', type + data)
+    avih = struct.pack('<14I', 40000, 0, 0, 0x10, 1500 + i, 0, 1, 0, 640, 480, 0, 0, 0, 0)
+    strh = 'vidsXVID' + struct.pack('<IHHIIIIIIIII', 0, 0, 0, 0, 1, 25, 0, 1500 + i, 0, 0, 0, 0) + '\x00' * 4
+    strf = struct.pack('<IIIHH', 40, 640, 480, 1, 24) + 'XVID' + struct.pack('<5I', 0, 0, 0, 0, 0)
+    hdrl = riff_list('hdrl', chunk('avih', avih) + riff_list('strl', chunk('strh', strh) + chunk('strf', strf)))
+    movi = riff_list('movi', chunk('00dc', '\xff' * PAYLOAD))
+    idx1 = chunk('idx1', struct.pack('<4sIII', '00dc', 0x10, 4, PAYLOAD))
+    body = 'AVI ' + hdrl + movi + idx1
+    return 'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def mpeg(i):
+    # MPEG-1 program stream: packs of 2048 bytes 40ms apart, each with a
+    # video packet, the first one starting with a sequence header.
+    def pack(scr, data):
+        scr = ''.join(chr(c) for c in (0x21 | (scr >> 29) & 0x0e, (scr >> 22) & 0xff,
+                      (scr >> 14) & 0xfe | 1, (scr >> 7) & 0xff, (scr << 1) & 0xfe | 1))
+        pes = '\x0f' + data
+        return '\x00\x00\x01\xba' + scr + '\x80\x1b\x83' + '\x00\x00\x01\xe0' + struct.pack('>H', len(pes)) + pes
+    sequence = '\x00\x00\x01\xb3\x16\x01\x20\x13\x02\xce\xe0\x00'
+    packs = [ pack(3600, sequence + '\xff' * (2048 - 18 - 12 - len(sequence))) ]
+    for n in xrange(PAYLOAD / 2048 + i % 10):
+        packs.append(pack(3600 * (n + 2), '\xff' * (2048 - 18 - 12)))
+    return ''.join(packs)
+
+
+def syscr():
+    for line in open('/proc/self/io'):
+        if line.startswith('syscr:'):
+            return int(line.split()[1])
+
+
+def main(limit):
+    # Importing the parsers reads their modules.
+    kaa.metadata.Factory().import_parsers()
+    directory = tempfile.mkdtemp()
+    failed = False
+    try:
+        for ext, make in (('mp3', mp3), ('jpg', jpeg), ('mkv', mkv), ('mp4', mp4), ('avi', avi), ('mpg', mpeg)):
+            path = os.path.join(directory, '00000.' + ext)
+            open(path, 'wb').write(make(0))
+            # don't count the reads of /proc/self/io
+            overhead = -syscr() + syscr()
+            calls = syscr()
+            result = kaa.metadata.parse(path)
+            calls = syscr() - calls - overhead
+            assert result, path
+            print '%-5s %-20s %4d read calls' % (ext, result.mime, calls)
+            if limit and calls > limit:
+                failed = True
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)